@@ -5,33 +5,44 @@ import sqlite3
 import time as sleep_timer
 import subprocess
 import re
-from collections import deque
 import sys
-import win32com.client
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from textual.app import App, ComposeResult
-from textual.widgets import Header, Footer, Static, DataTable, Input, Button
-from textual.containers import VerticalScroll, Horizontal
-from textual.screen import ModalScreen
+from textual.widgets import Header, Footer, Static, Input, Button, DataTable
+from textual.containers import VerticalScroll, Horizontal, Vertical
+from textual.screen import Screen, ModalScreen
 from textual.binding import Binding
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.geometry import Size
 from rich.text import Text
 from rich.table import Table
-from rich.layout import Layout
 from rich.panel import Panel
-from rich.console import Group
-import numpy as np
+from rich.segment import Segment
+from rich.style import Style
+from rich.cells import cell_len
+from tickbuffer import TickRingBuffer, LOT_LABELS
+from ayumidb import connect, LOT_PROFILE_DAYS
+from ayumianalysis import AnalysisStage, AnalysisSnapshot, DashboardStage, DashboardSnapshot
+from burstdetector import describe, BURST_LABELS
+from ayumimetrics import StageTimings, MetricsExporter, read_prometheus_file, METRICS_DIR, QUANTILES
+from ayumichannel import subscribe
 
 # --- 基本設定 ---
 AYUMI_BASE_DIR = r"C:\ayumi"
 
-# --- 必要なディレクトリを起動時に自動作成 ---
-try:
-    os.makedirs(AYUMI_BASE_DIR, exist_ok=True)
-    print(f"INFO: データディレクトリ '{AYUMI_BASE_DIR}' を確認・作成しました。")
-except OSError as e:
-    print(f"エラー: ディレクトリの作成に失敗しました: {AYUMI_BASE_DIR}")
-    print(f"詳細: {e}")
-    input("Enterキーを押して終了します...")
-    sys.exit(1)
+# --- 必要なディレクトリを起動時に自動作成 (import しただけでは作らない) ---
+def ensure_base_dir() -> None:
+    try:
+        os.makedirs(AYUMI_BASE_DIR, exist_ok=True)
+        print(f"INFO: データディレクトリ '{AYUMI_BASE_DIR}' を確認・作成しました。")
+    except OSError as e:
+        print(f"エラー: ディレクトリの作成に失敗しました: {AYUMI_BASE_DIR}")
+        print(f"詳細: {e}")
+        input("Enterキーを押して終了します...")
+        sys.exit(1)
 
 # --- ヘルパー関数: リソースパスの解決 ---
 def resource_path(relative_path: str) -> str:
@@ -48,6 +59,8 @@ def resource_path(relative_path: str) -> str:
 # --- パス設定 (AYUMI_BASE_DIRを基準に) ---
 EXCEL_WORKBOOK_PATH = os.path.join(AYUMI_BASE_DIR, "ayumi.xlsm")
 DB_PATH = os.path.join(AYUMI_BASE_DIR, "market_data.db")
+STATE_DIR = os.path.join(AYUMI_BASE_DIR, "state")  # 銘柄ごとの分析状態 (起動・銘柄切替の直後にその続きから分析する)
+DASHBOARD_TICKERS_PATH = os.path.join(AYUMI_BASE_DIR, "dashboard.txt")  # 一覧に並べる銘柄 (1行1銘柄。なければ収集中の全銘柄)
 DATA_IMPORTER_SCRIPT_PATH = resource_path("ayumisql.py")
 EXCEL_ADDIN_PATH = os.path.expandvars(r"%LOCALAPPDATA%\MarketSpeed2\Bin\rss\MarketSpeed2_RSS_64bit.xll")
 
@@ -55,99 +68,129 @@ EXCEL_ADDIN_PATH = os.path.expandvars(r"%LOCALAPPDATA%\MarketSpeed2\Bin\rss\Mark
 EXCEL_SHEET_NAME_TICKER = 'Sheet1'
 EXCEL_TICKER_CELL = 'E4'
 VERIFICATION_CELL = 'F4'
+POLL_INTERVAL_SEC = 2            # 新着通知を受けられない場合のポーリング間隔
+FALLBACK_POLL_INTERVAL_SEC = 10  # 新着通知を受けている場合の、取りこぼし対策のポーリング間隔
+ANALYSIS_MAX_FPS = 4             # 分析パネルの最大再描画回数/秒 (これより速く届いた結果は最新の1件にまとめる)
+METRICS_PATH = os.path.join(METRICS_DIR, 'tui.prom')                      # TUI側の段階ごとの所要時間の書き出し先
+COLLECTOR_METRICS_PATH = os.path.join(METRICS_DIR, 'collector.prom')    # 収集スクリプトが書き出す所要時間 (計測パネルに並べて表示)
+METRICS_PORT = None  # ポート番号を入れると http://127.0.0.1:<ポート>/metrics でも返す
 
 def format_yen(value: float) -> str:
     if value >= 1_0000_0000: return f"{value / 1_0000_0000:,.1f}億円"
     if value >= 1_0000: return f"{value / 1_0000:,.0f}万円"
     return f"{value:,.0f}円"
 
-class TradeAnalyzer:
-    def __init__(self, window_size: int = 5000, time_window_sec: int = 300):
-        self.window_size, self.time_window_sec, self.history = window_size, time_window_sec, pd.DataFrame()
-    def _calculate_metrics(self, df: pd.DataFrame) -> dict:
-        if df.empty or '時刻' not in df.columns or df['時刻'].iloc[-1] is pd.NaT: return {}
-        now = pd.to_datetime(df['時刻'].iloc[-1]); window_df = df[df['時刻'] > now - pd.Timedelta(seconds=self.time_window_sec)]
-        if window_df.empty or len(window_df) < 2: return {}
-        vwap = (window_df['価格'] * window_df['出来高']).sum() / window_df['出来高'].sum(); volatility = window_df['価格'].std(ddof=0)
-        time_span_min = (window_df['時刻'].iloc[-1] - window_df['時刻'].iloc[0]).total_seconds() / 60
-        trade_density = len(window_df) / time_span_min if time_span_min > 0 else 0; avg_volume_per_trade = window_df['出来高'].mean()
-        price_open, price_close = window_df['価格'].iloc[0], window_df['価格'].iloc[-1]
-        return {'vwap': vwap, 'volatility': volatility, 'trade_density_per_min': trade_density, 'avg_volume_per_trade': avg_volume_per_trade, 'price_open': price_open, 'price_close': price_close}
-    def _get_dynamic_thresholds(self, metrics: dict) -> tuple:
-        if not metrics or 'avg_volume_per_trade' not in metrics or metrics['avg_volume_per_trade'] == 0: return (1_000_000, 10_000_000, 50_000_000)
-        base_vol, vwap = metrics['avg_volume_per_trade'], metrics['vwap']; return (base_vol * 5 * vwap, base_vol * 20 * vwap, base_vol * 100 * vwap)
-    def analyze(self, df: pd.DataFrame) -> dict | None:
-        if df.empty or len(df) < 2: return None
-        df = df.copy(); df.columns = ['id', '時刻', '価格', '出来高', '方向']
-        df['時刻'] = pd.to_datetime(df['時刻'], errors='coerce'); df['価格'] = pd.to_numeric(df['価格'], errors='coerce'); df['出来高'] = pd.to_numeric(df['出来高'], errors='coerce')
-        df.dropna(inplace=True); df = df[df['出来高'] > 0]
-        if df.empty: return None
-        metrics = self._calculate_metrics(df)
-        if not metrics: return None
-        df['約定代金'] = df['価格'] * df['出来高']; m_th, l_th, s_th = self._get_dynamic_thresholds(metrics)
-        bins, code_labels = [0, m_th, l_th, s_th, float('inf')], ['小口', '中口', '大口', '超大口']
-        df['ロット'] = pd.cut(df['約定代金'], bins=bins, labels=code_labels, right=False, include_lowest=True)
-        pivot = df.groupby(['ロット', '方向'], observed=True)['出来高'].sum().unstack(fill_value=0)
-        for col in ['買い', '売り']:
-            if col not in pivot.columns: pivot[col] = 0
-        pivot['差引'] = pivot['買い'] - pivot['売り']; pivot = pivot.reindex(code_labels, fill_value=0)
-        total_buy_volume = pivot['買い'].sum()
-        total_sell_volume = pivot['売り'].sum()
-        total_volume_for_ratio = total_buy_volume + total_sell_volume
-        buy_ratio = total_buy_volume / total_volume_for_ratio if total_volume_for_ratio > 0 else 0
-        signal, confidence, condition = "中立", 0, "様子見"
-        large_trades = df[df['ロット'].isin(['大口', '超大口'])]; large_buys = large_trades[large_trades['方向'] == '買い']; large_sells = large_trades[large_trades['方向'] == '売り']
-        large_buy_volume = large_buys['出来高'].sum(); large_sell_volume = large_sells['出来高'].sum(); large_net_volume = large_buy_volume - large_sell_volume
-        confidence_score = abs(large_net_volume) / (metrics.get('avg_volume_per_trade', 1) * 10)
-        buy_vwap = (large_buys['価格'] * large_buys['出来高']).sum() / large_buy_volume if large_buy_volume > 0 else 0
-        sell_vwap = (large_sells['価格'] * large_sells['出来高']).sum() / large_sell_volume if large_sell_volume > 0 else 0
-        is_price_up = metrics['price_close'] >= metrics['price_open']; is_price_down = metrics['price_close'] < metrics['price_open']
-        if large_sell_volume > large_buy_volume * 1.5 and is_price_up: signal, confidence, condition = "強い買い", min(10, int(confidence_score * 1.5) + 3), "売り吸収の可能性"
-        elif large_buy_volume > large_sell_volume * 1.5 and is_price_down: signal, confidence, condition = "強い売り", min(10, int(confidence_score * 1.5) + 3), "買い疲れの兆候"
-        elif large_net_volume > 0 and confidence_score > 1:
-            signal, confidence = "強い買い", min(10, int(confidence_score) + 1)
-            condition = "VWAP越えの積極買い" if buy_vwap > metrics['vwap'] else "大口による買い集め"
-        elif large_net_volume < 0 and confidence_score > 1:
-            signal, confidence = "強い売り", min(10, int(confidence_score) + 1)
-            condition = "VWAP下での売り" if sell_vwap < metrics['vwap'] else "大口による売り"
-        elif pivot['差引'].sum() > 0: signal, confidence, condition = "買い優勢", 3, "小口中心の買い"
-        elif pivot['差引'].sum() < 0: signal, confidence, condition = "売り優勢", 3, "小口中心の売り"
-        summary = {'total_volume': int(df['出来高'].sum()), 'breakdown': pivot, 'signal': signal, 'confidence': confidence, 'condition': condition, 'metrics': metrics, 'thresholds_yen': {'medium': m_th, 'large': l_th, 'super_large': s_th}, 'buy_ratio': buy_ratio}
-        return {'summary': summary, 'detail_df': df.tail(self.window_size)}
+# 約定ログの列 (見出し, 表示幅)
+LOG_COLUMNS = [("時刻", 8), ("価格", 10), ("出来高", 9), ("方向", 4), ("ロット", 6)]
+LOG_LINE_WIDTH = sum(width for _, width in LOG_COLUMNS) + len(LOG_COLUMNS) - 1
+
+def _format_log_line(cells) -> str:
+    return ' '.join(' ' * max(0, width - cell_len(c)) + c for c, (_, width) in zip(cells, LOG_COLUMNS))
+
+class TradeLogView(ScrollView):
+    """
+    リングバッファ上の約定を新しい順に描画する仮想スクロールのログ。
+    行は描画時にバッファから直接組み立てるため、新着の追加は行数が変わるだけで既存行の作り直しはなく、
+    画面外の行は描画しない。スタイルは (方向, ロット) ごとにキャッシュする。
+    """
+    DEFAULT_CSS = "TradeLogView { height: 1fr; }"
+
+    def __init__(self, max_rows: int = 5000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_rows = max_rows
+        self.ticks = TickRingBuffer(max_rows)
+        self._styles = {}
+
+    def show(self, ticks: TickRingBuffer | None) -> None:
+        """計算ステージから届いた新しい行 ticks を手元のバッファに続けて表示する。増えた分だけ上に行が加わり、max_rows 件を超えた古い行は下から外れる。"""
+        if ticks is None or len(ticks) == 0: return
+        end_seq, had_rows = self.ticks.end_seq, len(self.ticks) > 0
+        self.ticks.extend(ticks)
+        added = max(0, self.ticks.end_seq - end_seq) if had_rows else 0
+        self.virtual_size = Size(LOG_LINE_WIDTH, len(self.ticks))
+        # 先頭を見ているときは最新行を追い、過去の行を見ているときは同じ行が見え続けるようにずらす
+        if self.scroll_y > 0 and added: self.scroll_to(y=self.scroll_y + added, animate=False, immediate=True)
+        self.refresh()
+
+    def clear_rows(self) -> None:
+        self.ticks.clear()
+        self.virtual_size = Size(LOG_LINE_WIDTH, 0)
+        self.scroll_to(y=0, animate=False, immediate=True); self.refresh()
+
+    def _style(self, direction: int, lot: int) -> Style:
+        style = self._styles.get((direction, lot))
+        if style is None:
+            base_style = 'red' if direction > 0 else '#9acd32'  # yellowgreen (rich は CSS の色名を解釈できない)
+            if lot == 2: final_style = f"bold {base_style}"
+            elif lot == 3: final_style = 'bold bright_magenta' if direction > 0 else 'bold yellow'
+            else: final_style = base_style
+            style = self._styles[(direction, lot)] = self.rich_style + Style.parse(final_style)
+        return style
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        row, width = scroll_y + y, self.size.width
+        if not len(self.ticks) or row >= self.virtual_size.height: return Strip.blank(width, self.rich_style)
+        ticks, seq = self.ticks, self.ticks.end_seq - 1 - row
+        direction, lot = int(ticks.at('direction', seq)), int(ticks.at('lot', seq))
+        sec = int(ticks.at('t', seq)) // 1_000_000_000 % 86400
+        line = _format_log_line((
+            f"{sec // 3600:02d}:{sec // 60 % 60:02d}:{sec % 60:02d}", f"{ticks.at('price', seq):,}", f"{int(ticks.at('volume', seq)):,}",
+            '買い' if direction > 0 else '売り' if direction < 0 else '不明', LOT_LABELS[lot] if lot >= 0 else '-',
+        ))
+        return Strip([Segment(line, self._style(direction, lot))]).crop_extend(scroll_x, scroll_x + width, self.rich_style)
 
 class TradeLogWidget(Static):
-    def compose(self) -> ComposeResult: yield DataTable()
+    def compose(self) -> ComposeResult:
+        yield Static(Text(_format_log_line([name for name, _ in LOG_COLUMNS]), style="bold")); yield TradeLogView()
     def on_mount(self) -> None:
-        self.border_title = "リアルタイム約定ログ"; tbl = self.query_one(DataTable); tbl.cursor_type = "row"
-        tbl.add_columns("時刻","価格","出来高","方向","ロット")
-
-    def update_log(self, df: pd.DataFrame|None) -> None:
-        tbl = self.query_one(DataTable); tbl.clear()
-        if df is None or df.empty: return
-        df_display = df.tail(500).iloc[::-1]
-        rows = []
-        for _, r in df_display.iterrows():
-            time_str = r['時刻'].strftime('%H:%M:%S') if pd.notnull(r['時刻']) else "N/A"
-            base_style = 'red' if r['方向'] == '買い' else 'yellowgreen'
-            if r['ロット'] == '大口': final_style = f"bold {base_style}"
-            elif r['ロット'] == '超大口': final_style = 'bold bright_magenta' if r['方向'] == '買い' else 'bold yellow'
-            else: final_style = base_style
-            rows.append((
-                Text(time_str, style=final_style), Text(f"{r['価格']:,}", style=final_style),
-                Text(f"{int(r['出来高']):,}", style=final_style), Text(r['方向'], style=final_style),
-                Text(str(r['ロット']), style=final_style),
-            ))
-        tbl.add_rows(rows)
-        tbl.scroll_home(animate=False)
+        self.border_title = "リアルタイム約定ログ"
+
+    def update_log(self, ticks: TickRingBuffer|None) -> None:
+        self.query_one(TradeLogView).show(ticks)
 
     def clear_log(self) -> None:
         """ログテーブルをクリアする"""
-        self.query_one(DataTable).clear()
+        self.query_one(TradeLogView).clear_rows()
 
 class TradeAnalysisWidget(Static):
+    """
+    分析結果を 判定・市場指標・出来高比率・ロット別出来高・期間別比較 の子パネルに分けて表示する。
+    パネルごとに表示内容 (整形済みの値) を前回描画したものと比べ、変わったパネルだけを作り直す。
+    再描画は最大 max_fps 回/秒に間引き、その間に届いた分析結果は最新の1件だけを描画する。
+    """
+    DEFAULT_CSS = """
+    #analysis-waiting { height: 1fr; }
+    #analysis-header { height: 5; border: round blue; border-title-align: center; }
+    #analysis-main { height: 1fr; }
+    #analysis-metrics { width: 1fr; border: round green; border-title-align: center; }
+    #analysis-breakdown-box { width: 1fr; border: round yellow; border-title-align: center; }
+    #analysis-ratio { height: auto; border: round cyan; border-title-align: center; }
+    #analysis-breakdown { height: auto; }
+    #analysis-horizons { height: auto; border: round magenta; border-title-align: center; }
+    """
+    def __init__(self, max_fps: float = ANALYSIS_MAX_FPS, timings: StageTimings | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_fps = max_fps
+        self.timings = timings  # あれば描画 (analysis_render) の所要時間を記録する
+        self._rendered = {}     # パネル名 -> 最後に描画した表示内容
+        self._pending = (None, None)  # まだ描画していない最新の (分析結果, 当日全体の指標)
+        self._frame_timer = None
+        self._last_frame = 0.0
+    def compose(self) -> ComposeResult:
+        yield Static(Panel("分析データを待っています...", style="bold dim"), id="analysis-waiting")
+        with Vertical(id="analysis-body"):
+            yield Static(id="analysis-header")
+            with Horizontal(id="analysis-main"):
+                yield Static(id="analysis-metrics")
+                with Vertical(id="analysis-breakdown-box"):
+                    yield Static(id="analysis-ratio"); yield Static(id="analysis-breakdown")
+            yield Static(id="analysis-horizons")
     def on_mount(self) -> None:
-        self.border_title = "インテリジェント約定分析"; self.analysis_layout = Layout(); self.analysis_layout.split_column(Layout(name="header", size=5), Layout(name="main"))
-        self.analysis_layout["main"].split_row(Layout(name="metrics"), Layout(name="breakdown")); self.update(self.analysis_layout)
+        self.border_title = "インテリジェント約定分析"; self.query_one("#analysis-body").display = False
+        self.query_one("#analysis-header").border_title = "判定"; self.query_one("#analysis-metrics").border_title = "市場指標"
+        self.query_one("#analysis-breakdown-box").border_title = "売買分析"; self.query_one("#analysis-ratio").border_title = "全体出来高比率"
+        self.query_one("#analysis-horizons").border_title = "期間別比較"
     def _create_ratio_bar(self, buy_ratio: float, width: int = 40) -> Table:
         buy_width = int(buy_ratio * width)
         sell_width = width - buy_width
@@ -156,35 +199,234 @@ class TradeAnalysisWidget(Static):
         grid.add_column(justify="right", no_wrap=True); grid.add_column(width=width, justify="center"); grid.add_column(justify="left", no_wrap=True)
         grid.add_row(Text(f"買い {buy_ratio:.1%}", style="bold green"), bar_text, Text(f"{1 - buy_ratio:.1%} 売り", style="bold red"))
         return grid
-    def update_analysis(self, analysis: dict|None) -> None:
-        layout = self.analysis_layout
-        if not analysis:
-            self.update(Panel("分析データを待っています...", style="bold dim"))
+    def update_analysis(self, analysis: dict|None, session: dict|None = None) -> None:
+        """分析結果を受け取る。前回の描画から 1/max_fps 秒経っていなければ、その時点まで描画を遅らせてまとめる。"""
+        self._pending = (analysis, session)
+        wait = self._last_frame + 1 / self.max_fps - sleep_timer.monotonic()
+        if wait <= 0: self._flush_frame()
+        elif self._frame_timer is None: self._frame_timer = self.set_timer(wait, self._flush_frame)
+    def _flush_frame(self) -> None:
+        self._frame_timer = None; self._last_frame = sleep_timer.monotonic()
+        if self.timings is None: self._render_analysis(*self._pending); return
+        with self.timings.time('analysis_render'): self._render_analysis(*self._pending)
+    def _render_analysis(self, analysis: dict|None, session: dict|None = None) -> None:
+        waiting = not analysis
+        if self.query_one("#analysis-waiting").display != waiting:
+            self.query_one("#analysis-waiting").display = waiting; self.query_one("#analysis-body").display = not waiting
+        if waiting:
+            self._rendered = {}
             return
-        summary, metrics = analysis, analysis['metrics']; sig, conf, cond = summary['signal'], summary['confidence'], summary['condition']
+        summary, metrics = analysis, analysis['metrics']
+        thresholds = summary['thresholds_yen']; m_th, l_th, s_th = thresholds['medium'], thresholds['large'], thresholds['super_large']
+        ranges = {'小口': f"~ {format_yen(m_th)}", '中口': f"{format_yen(m_th)} ~ {format_yen(l_th)}", '大口': f"{format_yen(l_th)} ~ {format_yen(s_th)}", '超大口': f"{format_yen(s_th)} ~"}
+        buy_ratio = summary.get('buy_ratio', 0)
+        # 各パネルの表示内容。画面上の文字列が変わらない限り同じ値になるよう、整形後の値で比べる
+        contents = {
+            'header': (summary['signal'], summary['confidence'], summary['condition'], f"{summary['total_volume']:,}"),
+            'metrics': (f"{metrics['vwap']:,.2f}", f"{metrics['volatility']:,.2f}", f"{metrics['trade_density_per_min']:.1f}", f"{metrics['avg_volume_per_trade']:,.0f}")
+                       + ((f"{session['vwap']:,.2f}", f"{session['high']:,.1f} / {session['low']:,.1f}", f"{session['buy_volume'] / session['volume']:.1%}") if session else ('-', '-', '-')),
+            'ratio': (int(buy_ratio * 40), f"{buy_ratio:.1%}", f"{1 - buy_ratio:.1%}"),
+            'breakdown': (tuple((lot_name, ranges.get(lot_name, "N/A"), int(row['買い']), int(row['売り']), int(row['差引'])) for lot_name, row in summary['breakdown'].iterrows()),
+                          summary.get('thresholds_source') == 'profile'),
+            # 直近のバッファで期間を覆いきれていない列は見出しに * を付ける
+            'horizons': tuple(((f"{h // 60}分" if h >= 60 else f"{h}秒") + ('' if hm['complete'] else '*'),
+                               f"{hm['vwap']:,.2f}", f"{hm['volatility']:,.2f}", f"{hm['trade_density_per_min']:.1f}", f"{hm['buy_ratio']:.1%}",
+                               tuple(int(b - s) for b, s in hm['breakdown']))
+                              for h, hm in summary.get('horizons', {}).items()),
+        }
+        builders = {
+            'header': lambda c: self._render_header(*c), 'metrics': lambda c: self._render_metrics(*c),
+            'ratio': lambda c: self._create_ratio_bar(buy_ratio), 'breakdown': lambda c: self._render_breakdown(*c), 'horizons': self._render_horizons,
+        }
+        for name, content in contents.items():
+            if self._rendered.get(name) == content: continue
+            self.query_one(f"#analysis-{name}", Static).update(builders[name](content)); self._rendered[name] = content
+    def _render_header(self, sig: str, conf: int, cond: str, total_volume: str) -> Table:
         style = 'bold green' if '買い' in sig else 'bold red' if '売り' in sig else 'bold white'
         header_table = Table.grid(expand=True); header_table.add_column(justify="left"); header_table.add_column(justify="right")
-        header_table.add_row(f"[bold]推奨シグナル: [{style}]{sig}[/{style}][/]", f"信頼度: {'★'*conf}{'☆'*(10-conf)}"); header_table.add_row(f"[bold]市場コンディション: [cyan]{cond}[/]", f"総出来高: {summary['total_volume']:,}株")
-        layout["header"].update(Panel(header_table, title="判定", border_style="blue"))
+        header_table.add_row(f"[bold]推奨シグナル: [{style}]{sig}[/{style}][/]", f"信頼度: {'★'*conf}{'☆'*(10-conf)}"); header_table.add_row(f"[bold]市場コンディション: [cyan]{cond}[/]", f"総出来高: {total_volume}株")
+        return header_table
+    def _render_metrics(self, vwap: str, volatility: str, density: str, avg_volume: str, day_vwap: str, day_range: str, day_buy_ratio: str) -> Table:
         metrics_table = Table.grid(padding=(0, 1)); metrics_table.add_column(); metrics_table.add_column(justify="right")
-        metrics_table.add_row("[bold]VWAP:", f"[yellow]{metrics['vwap']:,.2f}[/]"); metrics_table.add_row("[bold]ボラティリティ:", f"[cyan]{metrics['volatility']:,.2f}[/]"); metrics_table.add_row("[bold]取引密度/分:", f"[magenta]{metrics['trade_density_per_min']:.1f}回[/]"); metrics_table.add_row("[bold]平均出来高/約定:", f"[green]{metrics['avg_volume_per_trade']:,.0f}株[/]")
-        layout["metrics"].update(Panel(metrics_table, title="市場指標", border_style="green"))
-        buy_ratio = summary.get('buy_ratio', 0)
-        ratio_bar_table = self._create_ratio_bar(buy_ratio)
-        breakdown_table = Table(title="ロット別出来高", header_style="bold magenta", show_header=True, expand=True)
+        metrics_table.add_row("[bold]VWAP:", f"[yellow]{vwap}[/]"); metrics_table.add_row("[bold]ボラティリティ:", f"[cyan]{volatility}[/]"); metrics_table.add_row("[bold]取引密度/分:", f"[magenta]{density}回[/]"); metrics_table.add_row("[bold]平均出来高/約定:", f"[green]{avg_volume}株[/]")
+        metrics_table.add_row("[bold]当日VWAP:", f"[yellow]{day_vwap}[/]"); metrics_table.add_row("[bold]当日高値/安値:", f"[cyan]{day_range}[/]"); metrics_table.add_row("[bold]当日買い比率:", f"[green]{day_buy_ratio}[/]")
+        return metrics_table
+    def _render_breakdown(self, rows: tuple, from_profile: bool = False) -> Table:
+        title = f"ロット別出来高 [dim](過去{LOT_PROFILE_DAYS}日の分布から)[/]" if from_profile else "ロット別出来高 [dim](直近の平均から)[/]"
+        breakdown_table = Table(title=title, header_style="bold magenta", show_header=True, expand=True)
         breakdown_table.add_column("ロット", justify="left", style="cyan"); breakdown_table.add_column("約定代金レンジ", justify="left", style="dim white", max_width=25); breakdown_table.add_column("買い", justify="right", style="green"); breakdown_table.add_column("売り", justify="right", style="red"); breakdown_table.add_column("差引", justify="right")
-        thresholds = summary['thresholds_yen']; m_th, l_th, s_th = thresholds['medium'], thresholds['large'], thresholds['super_large']
-        ranges = {'小口': f"~ {format_yen(m_th)}", '中口': f"{format_yen(m_th)} ~ {format_yen(l_th)}", '大口': f"{format_yen(l_th)} ~ {format_yen(s_th)}", '超大口': f"{format_yen(s_th)} ~"}
-        for lot_name, row in summary['breakdown'].iterrows():
-            b, s, n = int(row['買い']), int(row['売り']), int(row['差引']); ns = 'bold green' if n > 0 else 'bold red' if n < 0 else 'white'; range_str = ranges.get(lot_name, "N/A")
+        for lot_name, range_str, b, s, n in rows:
+            ns = 'bold green' if n > 0 else 'bold red' if n < 0 else 'white'
             breakdown_table.add_row(lot_name, range_str, f"{b:,}", f"{s:,}", f"[{ns}]{n:+,}[/{ns}]")
-        breakdown_content = Group(Panel(ratio_bar_table, title="全体出来高比率", border_style="cyan"), breakdown_table)
-        layout["breakdown"].update(Panel(breakdown_content, border_style="yellow", title="売買分析"))
-        self.update(layout)
+        return breakdown_table
+    def _render_horizons(self, columns: tuple) -> Table | str:
+        if not columns: return "[dim]期間別の指標はありません[/]"
+        horizons_table = Table(header_style="bold magenta", show_header=True, expand=True, box=None)
+        horizons_table.add_column("指標", justify="left", style="bold")
+        for col in columns: horizons_table.add_column(col[0], justify="right")
+        horizons_table.add_row("VWAP", *(f"[yellow]{c[1]}[/]" for c in columns)); horizons_table.add_row("ボラティリティ", *(f"[cyan]{c[2]}[/]" for c in columns))
+        horizons_table.add_row("取引密度/分", *(f"[magenta]{c[3]}[/]" for c in columns)); horizons_table.add_row("買い比率", *(f"[green]{c[4]}[/]" for c in columns))
+        for i, lot_name in enumerate(('小口', '中口', '大口', '超大口')):
+            cells = []
+            for c in columns:
+                n = c[5][i]; ns = 'green' if n > 0 else 'red' if n < 0 else 'white'
+                cells.append(f"[{ns}]{n:+,}[/{ns}]")
+            horizons_table.add_row(f"差引 {lot_name}", *cells)
+        return horizons_table
 
     def clear_analysis(self) -> None:
-        """分析パネルを初期状態に戻す"""
-        self.update_analysis(None)
+        """分析パネルを初期状態に戻す (間引き待ちの結果は捨てて即座に反映する)"""
+        if self._frame_timer is not None: self._frame_timer.stop(); self._frame_timer = None
+        self._pending = (None, None); self._render_analysis(None)
+
+class TimingPanel(Static):
+    """
+    処理段階ごとの所要時間・遅延 (直近の p50/p95/p99) の表。d キーで表示を切り替え、表示中は1秒ごとに更新する。
+    収集スクリプトの段階は、収集スクリプトが書き出したメトリクスファイルから読む (最大 EXPORT_INTERVAL_SEC 秒遅れ)。
+    """
+    DEFAULT_CSS = "TimingPanel { dock: bottom; height: auto; display: none; border: round #4a4a4a; background: #2f3136; }"
+    # (表示名, 読み出し元, 段階名)
+    ROWS = (
+        ("収集: ブック解析", 'collector', 'read'), ("収集: 整形", 'collector', 'clean'), ("収集: 方向推定", 'collector', 'direction'),
+        ("収集: DB挿入", 'collector', 'insert'), ("収集: 1回の確認", 'collector', 'poll'),
+        ("TUI: 取得", 'tui', 'fetch'), ("TUI: 分析", 'tui', 'analyze'), ("TUI: ログ用の写し", 'tui', 'snapshot'),
+        ("TUI: ログ描画", 'tui', 'log_render'), ("TUI: 分析パネル描画", 'tui', 'analysis_render'),
+        ("TUI: 状態の保存", 'tui', 'state_save'), ("TUI: 切替→最初の表示", 'tui', 'first_frame'),
+        ("一覧: 取得", 'tui', 'dashboard_fetch'), ("一覧: 分析", 'tui', 'dashboard_analyze'), ("一覧: 描画", 'tui', 'dashboard_render'),
+        ("遅延: シート→DB", 'collector', 'sheet_to_db'), ("遅延: DB→画面", 'tui', 'db_to_screen'), ("遅延: シート→画面", 'tui', 'sheet_to_screen'),
+    )
+    def __init__(self, timings: StageTimings, collector_path: str = COLLECTOR_METRICS_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.timings, self.collector_path = timings, collector_path
+    def on_mount(self) -> None:
+        self.border_title = "処理時間 (ミリ秒, 直近の分位点)"; self.set_interval(1.0, self.refresh_table)
+    def toggle(self) -> None:
+        self.display = not self.display
+        if self.display: self.refresh_table()
+    def refresh_table(self) -> None:
+        if not self.display: return
+        sources = {'tui': self.timings.summary(), 'collector': read_prometheus_file(self.collector_path)}
+        table = Table(header_style="bold magenta", expand=True, box=None)
+        table.add_column("段階", style="bold"); table.add_column("件数", justify="right")
+        for q in QUANTILES: table.add_column(f"p{q * 100:g}", justify="right")
+        table.add_column("最大", justify="right")
+        for label, source, stage in self.ROWS:
+            s = sources[source].get(stage)
+            if not s: table.add_row(label, "[dim]-[/]", *(["[dim]-[/]"] * (len(QUANTILES) + 1))); continue
+            table.add_row(label, f"{int(s['count']):,}", *(f"{s[q] * 1000:,.1f}" for q in QUANTILES), f"{s['max'] * 1000:,.1f}" if 'max' in s else "-")
+        self.update(table)
+
+def load_dashboard_tickers(conn, path: str = DASHBOARD_TICKERS_PATH) -> list:
+    """一覧に並べる銘柄コード。path (1行1銘柄、# 以降は無視) があればその順、なければ収集スクリプトが収集中の銘柄。"""
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return [code for code in (line.split('#')[0].strip().upper() for line in f) if code]
+    return [row[0] for row in conn.execute("SELECT ticker_code FROM collector_sources WHERE ticker_code IS NOT NULL GROUP BY ticker_code ORDER BY MIN(name)")]
+
+class DashboardScreen(Screen):
+    """
+    複数銘柄の一覧。1銘柄1行に シグナル・信頼度・買い比率・VWAP乖離・大口差引・直近のバースト を並べ、Enter でその銘柄の2画面表示を開く。
+    取得と分析は DashboardStage (全銘柄まとめての取得と、ワーカープロセスでの並列分析) が行う。
+    セルごとに表示内容を前回描画したものと比べ、変わったセルだけを書き換える。
+    """
+    BINDINGS = [Binding("escape", "close", "2画面表示"), Binding("r", "reload_tickers", "銘柄を読み直す")]
+    # (列キー, 見出し)
+    COLUMNS = (("ticker", "銘柄"), ("signal", "シグナル"), ("confidence", "信頼度"), ("buy_ratio", "買い比率"), ("price", "価格"),
+               ("vwap_dev", "VWAP乖離"), ("large_net", "大口差引"), ("new", "新規"), ("burst", "直近のバースト"))
+    def __init__(self, stage: DashboardStage, **kwargs):
+        super().__init__(**kwargs)
+        self.stage = stage
+        self.generation = stage.generation
+        self.running = False
+        self.refresh_requested = False
+        self._rendered = {}    # (銘柄, 列キー) -> 最後に描画した表示内容
+        self._bursts = {}      # 銘柄 -> 最後に検知されたバースト
+    def compose(self) -> ComposeResult:
+        yield Header(show_clock=True); yield DataTable(id="dashboard-table", cursor_type="row", zebra_stripes=True); yield Footer()
+    def on_mount(self) -> None:
+        table = self.query_one(DataTable)
+        table.border_title = "銘柄一覧 (Enter: 2画面表示)"
+        for key, label in self.COLUMNS: table.add_column(label, key=key)
+        self.reset_rows(self.stage.tickers)
+        self.set_interval(FALLBACK_POLL_INTERVAL_SEC if self.app.tick_channel else POLL_INTERVAL_SEC, self.request_update)
+    def on_screen_resume(self) -> None:
+        self.request_update()
+    def reset_rows(self, tickers: list) -> None:
+        table = self.query_one(DataTable)
+        table.clear(); self._rendered, self._bursts = {}, {}
+        for code in tickers: table.add_row(*([code] + ["-"] * (len(self.COLUMNS) - 1)), key=code)
+
+    def request_update(self) -> None:
+        """取得と分析を依頼する。実行中なら、終わった後にもう1回だけ実行するよう予約する。"""
+        if not self.is_current or self.app.is_paused: return
+        if self.running:
+            self.refresh_requested = True; return
+        self.running = True
+        self.run_worker(self.run_update(), group="dashboard")
+    async def run_update(self) -> None:
+        try:
+            while True:
+                self.refresh_requested = False
+                self.apply_snapshot(await asyncio.wrap_future(self.stage.submit()))
+                if not self.refresh_requested or not self.is_current: break
+        finally:
+            self.running = False
+
+    def apply_snapshot(self, snapshot: DashboardSnapshot) -> None:
+        """一覧に反映する。銘柄の組を変える前に依頼した結果は捨てる。"""
+        if snapshot.generation != self.generation: return
+        if snapshot.error:
+            self.sub_title = f"[bold red]!!! データベースエラー: {snapshot.error}[/]"; return
+        new_count = sum(row.new_count for row in snapshot.rows)
+        self.sub_title = f"最終確認: {pd.Timestamp.now().strftime('%H:%M:%S')} | 新規約定: {new_count}件 | {len(snapshot.rows)}銘柄"
+        with self.app.timings.time('dashboard_render'):
+            table = self.query_one(DataTable)
+            for row in snapshot.rows:
+                for event in row.bursts: self.app.log(f">>> [{row.ticker}] {describe(event)}")
+                if row.bursts: self._bursts[row.ticker] = row.bursts[-1]
+                for key, content in self._cells(row).items():
+                    if self._rendered.get((row.ticker, key)) == content: continue
+                    table.update_cell(row.ticker, key, self._render_cell(key, content)); self._rendered[(row.ticker, key)] = content
+    def _cells(self, row) -> dict:
+        """行の各セルの表示内容 (整形後の値)。"""
+        burst = self._bursts.get(row.ticker)
+        cells = {'new': (f"{row.new_count:,}" if row.new_count else "",), 'burst': (describe(burst).split(' (')[0], burst.side) if burst else ("-", None)}
+        if row.signal is None:
+            return {**cells, **{key: ("-",) for key in ('signal', 'confidence', 'buy_ratio', 'price', 'vwap_dev', 'large_net')}}
+        return {
+            **cells,
+            'signal': (row.signal,), 'confidence': (row.confidence,), 'buy_ratio': (f"{row.buy_ratio:.1%}", row.buy_ratio >= 0.5),
+            'price': (f"{row.price:,}",), 'vwap_dev': (f"{row.vwap_dev_bps:+,.1f}bp" if row.vwap_dev_bps is not None else "-", row.vwap_dev_bps or 0),
+            'large_net': (f"{row.large_net:+,}", row.large_net),
+        }
+    def _render_cell(self, key: str, content: tuple) -> Text:
+        value = content[0]
+        if key == 'signal' and value != "-":
+            return Text(value, style='bold green' if '買い' in value else 'bold red' if '売り' in value else 'bold white')
+        if key == 'confidence' and value != "-": return Text('★' * value + '☆' * (10 - value), style="yellow")
+        if key == 'buy_ratio' and value != "-": return Text(value, justify="right", style="green" if content[1] else "red")
+        if key in ('vwap_dev', 'large_net') and value != "-":
+            return Text(value, justify="right", style="green" if content[1] > 0 else "red" if content[1] < 0 else "white")
+        if key == 'burst' and content[1] is not None:
+            return Text(value, style={1: "bold red", -1: "bold #9acd32", 0: "bold yellow"}[content[1]])
+        return Text(value, justify="right" if key in ('price', 'new') else "left")
+
+    def on_data_table_row_selected(self, event: DataTable.RowSelected) -> None:
+        self.app.close_dashboard(event.row_key.value)
+    def action_close(self) -> None:
+        self.app.close_dashboard()
+    def action_reload_tickers(self) -> None:
+        """dashboard.txt (なければ収集中の銘柄) を読み直して一覧の銘柄を入れ替える。入れ替えは取得スレッドで行い、画面は止めない。"""
+        try:
+            tickers = load_dashboard_tickers(self.app.db_connection)
+        except (OSError, sqlite3.Error) as e:
+            self.app.log(f"!!! 一覧の銘柄を読めません: {e}"); return
+        if not tickers or tickers == self.stage.tickers: return
+        self.run_worker(self.reload_tickers(tickers), group="dashboard-reload", exclusive=True)
+    async def reload_tickers(self, tickers: list) -> None:
+        """取得スレッドでの入れ替えが終わってから、一覧を新しい銘柄で作り直す。"""
+        self.generation = await asyncio.wrap_future(self.stage.set_tickers(tickers))
+        self.reset_rows(tickers); self.request_update()
 
 class ChangeTickerScreen(ModalScreen):
     """銘柄コードを変更するためのモーダル画面"""
@@ -219,32 +461,61 @@ class TraderApp(App):
         Binding("q", "quit", "終了"),
         Binding("p", "toggle_pause", "一時停止/再開"),
         Binding("c", "change_ticker", "銘柄変更"),
+        Binding("d", "toggle_timings", "処理時間"),
+        Binding("w", "show_dashboard", "銘柄一覧"),
     ]
     def __init__(self, ticker_code: str, background_process=None, excel_instance=None):
         super().__init__()
         self.target_ticker = ticker_code
-        self.analyzer = TradeAnalyzer()
+        self.analysis_stage = None
+        self.dashboard_stage = None   # 銘柄一覧を初めて開いたときに作る
+        self.dashboard = None
+        self.generation = 0           # 銘柄切替のたびに増やし、古い銘柄の分析結果を捨てるのに使う
+        self.analysis_running = False
+        self.refresh_requested = False
+        self.last_summary = None
         self.last_id = 0
-        self.df_history = pd.DataFrame()
+        self.switched_at = None       # 起動・銘柄切替の時刻 (最初の分析結果を表示するまでの時間の計測用)
         self.is_paused = False
         self.update_timer = None
         self.footer_message_timer = None
-        self.trade_counts = deque(maxlen=30)
         self.background_process = background_process
         self.excel_instance = excel_instance
+        # 銘柄切替での Excel の操作は専用スレッドで行う (COM のオブジェクトは取得したスレッドでしか使えないので、そのスレッドで取り直す)
+        self.excel_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ayumi-excel', initializer=init_com_thread)
+        self.excel_thread_instance = None
         self.db_connection = None
-    CSS = ("Screen{layout:grid;grid-size:2;grid-columns:1fr 2fr;grid-gutter:1;padding:1;background:#1e1f22;} #trade-log,#trade-analysis{border:round #4a4a4a;background:#2f3136;padding:1;overflow:auto;height:100%;} #trade-analysis{padding:0;}")
-    def compose(self) -> ComposeResult: yield Header(show_clock=True); yield TradeLogWidget(id="trade-log"); yield TradeAnalysisWidget(id="trade-analysis"); yield Footer()
-    def on_mount(self) -> None:
+        self.tick_channel = None
+        self.timings = StageTimings()
+        self.metrics_exporter = None
+    CSS = ("Screen{layout:grid;grid-size:2;grid-columns:1fr 2fr;grid-gutter:1;padding:1;background:#1e1f22;} #trade-log,#trade-analysis{border:round #4a4a4a;background:#2f3136;padding:1;overflow:auto;height:100%;} #trade-analysis{padding:0;} DashboardScreen{layout:vertical;padding:0 1;} #dashboard-table{height:1fr;border:round #4a4a4a;background:#2f3136;}")
+    def compose(self) -> ComposeResult:
+        yield Header(show_clock=True); yield TradeLogWidget(id="trade-log"); yield TradeAnalysisWidget(id="trade-analysis", timings=self.timings)
+        yield TimingPanel(self.timings, id="timings"); yield Footer()
+    async def on_mount(self) -> None:
         try:
-            self.db_connection = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=10.0, check_same_thread=False)
-            self.db_connection.execute("PRAGMA journal_mode=WAL;")
+            self.db_connection = connect(DB_PATH, 'reader', check_same_thread=False)
             self.log(">>> データベース接続をWALモード(Read-Only)で確立しました。")
         except sqlite3.Error as e:
             self.show_flash_message(f"[bold red]!!! DB接続エラー: {e}[/]", duration=9999); return
-        self.update_panels(); self.update_timer = self.set_interval(2, self.update_panels)
+        self.analysis_stage = AnalysisStage(DB_PATH, timings=self.timings, state_dir=STATE_DIR)
+        self.metrics_exporter = MetricsExporter(self.timings, 'tui', METRICS_PATH, METRICS_PORT)
+        self.set_interval(self.metrics_exporter.interval, self.metrics_exporter.maybe_write)
+        try:
+            self.tick_channel = await subscribe(self.on_ticks_published)
+            self.log(">>> 収集スクリプトからの新着通知を受信します。")
+        except OSError as e:
+            self.log(f"!!! 新着通知を受信できません。{POLL_INTERVAL_SEC}秒ごとのポーリングで更新します: {e}")
+        self.switched_at = sleep_timer.perf_counter()
+        self.update_panels(); self.update_timer = self.set_interval(FALLBACK_POLL_INTERVAL_SEC if self.tick_channel else POLL_INTERVAL_SEC, self.update_panels)
+        self.set_interval(10, self.supervise_collector)
     def on_unmount(self) -> None:
+        if self.tick_channel: self.tick_channel.close()
+        if self.metrics_exporter: self.metrics_exporter.close()
+        if self.analysis_stage: self.analysis_stage.close()
+        if self.dashboard_stage: self.dashboard_stage.close()
         if self.db_connection: self.db_connection.close(); self.log(">>> データベース接続を解放しました。")
+        self.excel_executor.shutdown(wait=False)
     async def on_ready(self) -> None:
         try:
             header = self.query_one(Header)
@@ -272,45 +543,88 @@ class TraderApp(App):
         self.footer_message_timer = None
         self.update_panels()
 
-    def analyze_latest_ticks(self, new_df: pd.DataFrame, last_summary: dict | None):
-        if new_df.empty or last_summary is None: return
-        self.trade_counts.append(len(new_df))
-        avg_trade_count = sum(self.trade_counts) / len(self.trade_counts) if self.trade_counts else 0
-        if len(new_df) > avg_trade_count * 5 and len(new_df) > 5:
-            buy_ratio = (new_df['方向'] == '買い').sum() / len(new_df)
-            if buy_ratio > 0.8:
-                self.show_flash_message(f"[bold green]!![/bold green] [white]高密度な[red]買いバースト[/red]を検知 ({len(new_df)}件)[/white]")
-            elif buy_ratio < 0.2:
-                self.show_flash_message(f"[bold red]!![/bold red] [white]高密度な[yellowgreen]売りバースト[/yellowgreen]を検知 ({len(new_df)}件)[/white]")
+    def show_bursts(self, bursts: tuple) -> None:
+        """収集スクリプトが約定時刻から検知したバーストをログに出し、最後の1件をフラッシュメッセージで知らせる。"""
+        if not bursts: return
+        for event in bursts: self.log(f">>> {describe(event)}")
+        event = bursts[-1]
+        mark, color = {1: ("bold green", "red"), -1: ("bold red", "yellowgreen"), 0: ("bold yellow", "white")}[event.side]
+        self.show_flash_message(f"[{mark}]!![/{mark}] [white]高密度な[{color}]{BURST_LABELS[event.side]}[/{color}]を検知 ({event.trades}件/秒・基準比 {event.score:.1f}σ)[/white]")
+    def on_ticks_published(self, ticker_code: str, last_id: int) -> None:
+        """収集スクリプトの新着通知。表示中の銘柄で、まだ読んでいない id までの保存なら即座に更新する。"""
+        # ソケットのコールバックはアプリのメッセージ処理の外で呼ばれるため、更新はメッセージキュー経由で行う
+        if ticker_code == self.target_ticker and last_id > self.last_id and not self.is_paused: self.call_later(self.update_panels)
+        if self.dashboard is not None and self.dashboard.is_current and ticker_code in self.dashboard_stage.tickers: self.call_later(self.dashboard.request_update)
+
     def update_panels(self) -> None:
-        if self.is_paused or not self.db_connection: return
-        last_summary = self.analyzer.analyze(self.df_history) if not self.df_history.empty else None
-        new_df = pd.DataFrame()
+        """計算ステージに取得と分析を依頼する。実行中なら、終わった後にもう1回だけ実行するよう予約する。"""
+        if self.is_paused or not self.analysis_stage or (self.dashboard is not None and self.dashboard.is_current): return
+        if self.analysis_running:
+            self.refresh_requested = True; return
+        self.analysis_running = True
+        self.run_worker(self.run_analysis(), group="analysis")
+
+    async def run_analysis(self) -> None:
         try:
-            query = "SELECT id, jikoku AS 時刻, price AS 価格, dekidaka AS 出来高, baibai AS 方向 FROM ayumi WHERE ticker_code = ? AND id > ? ORDER BY id"
-            new_df = pd.read_sql_query(query, self.db_connection, params=(self.target_ticker, self.last_id))
-            status_message = f"最終確認: {pd.Timestamp.now().strftime('%H:%M:%S')} | 新規約定: {len(new_df)}件"
-            self.update_status(status_message, color="white" if not new_df.empty else "gray")
-        except sqlite3.Error as e:
-            self.show_flash_message(f"[bold red]!!! データベースエラー: {e}[/]"); self.log(f"!!! データベースエラー: {e}"); return
-        self.analyze_latest_ticks(new_df, last_summary)
+            while True:
+                self.refresh_requested = False
+                snapshot = await asyncio.wrap_future(self.analysis_stage.submit(self.target_ticker, self.generation))
+                self.apply_snapshot(snapshot)
+                # 計算中に届いた依頼は何件あっても1回の取り直しにまとめる
+                if not self.refresh_requested or self.is_paused: break
+        finally:
+            self.analysis_running = False
+
+    def apply_snapshot(self, snapshot: AnalysisSnapshot) -> None:
+        """計算ステージの結果を画面に反映する。銘柄切替前に依頼した結果は捨てる。"""
+        if snapshot.generation != self.generation: return
+        if snapshot.error:
+            self.show_flash_message(f"[bold red]!!! データベースエラー: {snapshot.error}[/]"); self.log(f"!!! データベースエラー: {snapshot.error}"); return
+        self.last_id = snapshot.last_id
+        status_message = f"最終確認: {pd.Timestamp.now().strftime('%H:%M:%S')} | 新規約定: {snapshot.new_count}件"
+        self.update_status(status_message, color="white" if snapshot.new_count else "gray")
         log_widget = self.query_one(TradeLogWidget); analysis_widget = self.query_one(TradeAnalysisWidget)
         log_widget.border_title = f"リアルタイム約定ログ [{self.target_ticker}]"; analysis_widget.border_title = f"インテリジェント約定分析 [{self.target_ticker}]"
-        if new_df.empty and self.df_history.empty:
-            analysis_widget.update_analysis(None)
+        if snapshot.ticks is not None:
+            with self.timings.time('log_render'): log_widget.update_log(snapshot.ticks)
+        summary = snapshot.summary
+        if summary is None:
+            if snapshot.new_count == 0: analysis_widget.update_analysis(None)
             return
-        elif not new_df.empty:
-            self.df_history = pd.concat([self.df_history, new_df]).tail(10000)
-            self.last_id = int(self.df_history['id'].max())
-        if not self.df_history.empty:
-            res = self.analyzer.analyze(self.df_history)
-            if res:
-                log_widget.update_log(res['detail_df']); analysis_widget.update_analysis(res['summary'])
-                summary = res['summary']
-                if summary['confidence'] >= 7 and "強い" in summary['signal']:
-                    self.app.bell(); original_style = analysis_widget.styles.border; alert_color = "green" if "買い" in summary['signal'] else "red"
-                    analysis_widget.styles.border = (alert_color, alert_color); self.set_timer(1.0, lambda: self.reset_border_style(analysis_widget, original_style))
+        self.last_summary = summary
+        if self.switched_at is not None:
+            self.timings.record('first_frame', sleep_timer.perf_counter() - self.switched_at); self.switched_at = None
+        self.show_bursts(snapshot.bursts)
+        analysis_widget.update_analysis(summary, snapshot.session)
+        if snapshot.ingest: self.call_after_refresh(self.record_latency, snapshot.ingest)
+        if summary['confidence'] >= 7 and "強い" in summary['signal']:
+            self.app.bell(); original_style = analysis_widget.styles.border; alert_color = "green" if "買い" in summary['signal'] else "red"
+            analysis_widget.styles.border = ("heavy", alert_color); self.set_timer(1.0, lambda: self.reset_border_style(analysis_widget, original_style))
     def reset_border_style(self, widget: Static, original_style) -> None: widget.styles.border = original_style
+    def record_latency(self, ingest: tuple) -> None:
+        """画面の更新後に呼ばれ、取り込みごとに シート(ブック更新)→画面 と DB挿入→画面 の遅延を記録する。"""
+        now = sleep_timer.time()
+        for sheet_mtime, _, ingested_at in ingest:
+            if sheet_mtime: self.timings.record('sheet_to_screen', now - sheet_mtime)
+            self.timings.record('db_to_screen', now - ingested_at)
+    def action_toggle_timings(self) -> None: self.query_one(TimingPanel).toggle()
+    def action_show_dashboard(self) -> None:
+        """銘柄一覧を開く。一覧の銘柄がなければ表示中の銘柄だけを並べる。"""
+        if self.db_connection is None or (self.dashboard is not None and self.dashboard.is_current): return
+        if self.dashboard is None:
+            try:
+                tickers = load_dashboard_tickers(self.db_connection)
+            except (OSError, sqlite3.Error) as e:
+                self.log(f"!!! 一覧の銘柄を読めません: {e}"); tickers = []
+            self.dashboard_stage = DashboardStage(DB_PATH, tickers or [self.target_ticker], timings=self.timings)
+            self.dashboard = DashboardScreen(self.dashboard_stage)
+            self.install_screen(self.dashboard, "dashboard")
+        self.push_screen("dashboard")
+    def close_dashboard(self, ticker_code: str | None = None) -> None:
+        """銘柄一覧を閉じて2画面表示に戻る。ticker_code があればその銘柄に切り替える。"""
+        self.pop_screen()
+        if ticker_code and ticker_code != self.target_ticker: self.process_ticker_change(ticker_code)
+        else: self.update_panels()
     def action_toggle_pause(self) -> None:
         self.is_paused = not self.is_paused
         if self.is_paused: self.show_flash_message("[yellow]一時停止中...[/]", duration=9999); self.update_timer.pause(); self.update_status("一時停止中", color="yellow")
@@ -320,54 +634,52 @@ class TraderApp(App):
         """銘柄変更モーダルを表示する"""
         def handle_new_ticker(new_ticker: str | None):
             if new_ticker:
-                # バックグラウンドで変更処理を実行
-                self.run_worker(self.process_ticker_change(new_ticker), exclusive=True)
+                self.process_ticker_change(new_ticker)
         self.push_screen(ChangeTickerScreen(), handle_new_ticker)
 
-    async def process_ticker_change(self, new_ticker: str):
-        """銘柄変更の全プロセスを管理する"""
-        # 1. 現在の処理を一時停止
-        self.show_flash_message(f"[yellow]銘柄を {new_ticker} に変更中...[/]", duration=9999)
-        if self.update_timer: self.update_timer.pause()
+    def collected_by_other_source(self, ticker_code: str) -> bool:
+        """main 以外の監視対象 (sources.json) がすでにこの銘柄を収集しているか。"""
+        row = self.db_connection.execute(
+            "SELECT 1 FROM collector_sources WHERE ticker_code = ? AND name != 'main' LIMIT 1", (ticker_code,)
+        ).fetchone()
+        return row is not None
+
+    def process_ticker_change(self, new_ticker: str):
+        """
+        表示する銘柄を切り替える。収集スクリプトは常駐したまま再起動せず、TUIは問い合わせる銘柄を変えるだけ。
+        他の監視対象が収集していない銘柄なら、main のExcel銘柄セルを書き換えて収集スクリプトに拾わせる。
+        """
+        self.log(f">>> 銘柄変更: {self.target_ticker} -> {new_ticker}")
+        if self.db_connection is None: return
+        try:
+            collected = self.collected_by_other_source(new_ticker)
+        except sqlite3.Error as e:
+            self.log(f"!!! 監視対象の確認に失敗しました: {e}"); collected = False
+        if not collected:
+            self.run_worker(self.update_excel(new_ticker), group="excel")
 
-        # 2. 既存のプロセスと接続をクリーンアップ
-        self.log(f">>> 銘柄変更開始: {self.target_ticker} -> {new_ticker}")
-        if self.background_process:
-            self.log(">>> 古いデータ収集スクリプトを終了します...")
-            self.background_process.terminate()
-            self.background_process.wait(timeout=3)
-        if self.db_connection:
-            self.log(">>> データベース接続を解放します...")
-            self.db_connection.close()
-            self.db_connection = None
-
-        # 3. TUIの状態をリセット
-        self.log(">>> UIの状態をリセットします...")
+        # TUIの状態を新しい銘柄に切り替える
         self.target_ticker = new_ticker
-        self.df_history = pd.DataFrame()
+        self.generation += 1
         self.last_id = 0
+        self.switched_at = sleep_timer.perf_counter()
+        self.last_summary = None
         self.query_one(TradeLogWidget).clear_log()
         self.query_one(TradeAnalysisWidget).clear_analysis()
         self.query_one(Header).header_title = f"統合トレーディング環境\n銘柄: [{self.target_ticker}]"
+        self.update_panels()
+        self.show_flash_message(f"[bold green]銘柄が {new_ticker} に変更されました。[/]", duration=5)
 
-        # 4. 新しい銘柄で環境を再起動
-        self.log(f">>> {new_ticker} で環境を再起動します...")
-        _, self.background_process = launch_environment(
-            ticker_code_to_set=new_ticker,
-            excel_instance=self.excel_instance
-        )
+    async def update_excel(self, ticker_code: str) -> None:
+        """main の銘柄セルを Excel 用のスレッドで書き換える (COM の呼び出しの間も入力を受け付ける)。切替が続いても依頼の順に処理される。"""
+        self.excel_thread_instance = await asyncio.wrap_future(self.excel_executor.submit(prepare_excel, ticker_code, self.excel_thread_instance))
 
-        # 5. DBに再接続し、ポーリングを再開
-        sleep_timer.sleep(3) # 新しいプロセスがDBを準備するのを少し待つ
-        try:
-            self.db_connection = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=10.0, check_same_thread=False)
-            self.db_connection.execute("PRAGMA journal_mode=WAL;")
-            self.log(">>> 新しいデータベース接続を確立しました。")
-            if self.update_timer: self.update_timer.resume()
-            self.clear_flash_message()
-            self.show_flash_message(f"[bold green]銘柄が {new_ticker} に変更されました。[/]", duration=5)
-        except sqlite3.Error as e:
-            self.show_flash_message(f"[bold red]!!! DB再接続エラー: {e}[/]", duration=9999)
+    def supervise_collector(self) -> None:
+        """収集スクリプトが終了していたら起動し直す。"""
+        if self.background_process is None or self.background_process.poll() is None: return
+        self.log(f"!!! データ収集スクリプトが終了しました (終了コード {self.background_process.returncode})。再起動します...")
+        self.background_process = start_collector()
+        if self.background_process: self.show_flash_message("[yellow]データ収集スクリプトを再起動しました。[/]")
 
     def action_quit(self) -> None:
         self.log("\n>>> アプリケーションを終了しています...")
@@ -383,21 +695,29 @@ class TraderApp(App):
             try:
                 self.log(">>> Excelへの接続を解放します...")
                 # 参照を解放
-                self.excel_instance = None
+                self.excel_instance = self.excel_thread_instance = None
             except Exception as e:
                 self.log(f"XXX Excelの解放中にエラー: {e}")
         self.exit("ユーザー操作により終了しました。")
 
 
-def launch_environment(ticker_code_to_set: str, excel_instance=None):
+def init_com_thread() -> None:
+    """Excel を操作するスレッドで COM を初期化する (pywin32 がない環境では何もしない)。"""
+    try:
+        import pythoncom
+    except ImportError:
+        return
+    pythoncom.CoInitialize()
+
+def prepare_excel(ticker_code_to_set: str, excel_instance=None):
     """
-    Excelを起動または再利用し、指定された銘柄コードをセルに書き込んでから、
-    データ収集スクリプトを起動し、それらのプロセス情報を返す。
+    Excelを起動または再利用し、指定された銘柄コードを main の銘柄セルに書き込む。
+    Excelのインスタンスを返す (操作に失敗した場合は渡されたものをそのまま返す)。
     """
-    print(f">>> ステップ1: Excelを操作し、銘柄コードを {ticker_code_to_set} に更新します...")
+    print(f">>> Excelを操作し、銘柄コードを {ticker_code_to_set} に更新します...")
     excel_app = excel_instance
-    background_proc = None
     try:
+        import win32com.client  # Windows 専用。Excelを操作するときだけ読み込む
         if excel_app is None:
             excel_app = win32com.client.Dispatch("Excel.Application")
             excel_app.Visible = True
@@ -432,18 +752,32 @@ def launch_environment(ticker_code_to_set: str, excel_instance=None):
         print(f">>> Excelシート '{EXCEL_SHEET_NAME_TICKER}' のセル {EXCEL_TICKER_CELL} を {ticker_code_to_set} に更新しました。")
     except Exception as e:
         print(f"XXX Excel操作中にエラーが発生しました: {e}")
+    return excel_app
 
-    print(">>> ステップ2: データ収集スクリプトをバックグラウンドで起動します...")
+def start_collector():
+    """常駐のデータ収集スクリプトをバックグラウンドで起動し、プロセスを返す (失敗時は None)。"""
     try:
         background_proc = subprocess.Popen(['pythonw', DATA_IMPORTER_SCRIPT_PATH])
         print(">>> データ収集スクリプトを起動しました。")
+        return background_proc
     except Exception as e:
         print(f"XXX スクリプト起動失敗: {e}")
-        
-    return excel_app, background_proc
+        return None
+
+def launch_environment(ticker_code_to_set: str, excel_instance=None):
+    """
+    Excelを起動または再利用し、指定された銘柄コードをセルに書き込んでから、
+    データ収集スクリプトを起動し、それらのプロセス情報を返す。
+    """
+    print(">>> ステップ1: Excelを準備します...")
+    excel_app = prepare_excel(ticker_code_to_set, excel_instance)
+    print(">>> ステップ2: データ収集スクリプトをバックグラウンドで起動します...")
+    return excel_app, start_collector()
 
 # --- メイン実行ブロック ---
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 銘柄一覧の分析ワーカー (別プロセス) を実行ファイル化しても起動できるように
+    ensure_base_dir()
     # ★★ ここが修正箇所 2/2 ★★
     ticker_pattern = re.compile(r"^\d{4}(\.(JNX|CIX))?$", re.IGNORECASE)
     while True:
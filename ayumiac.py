@@ -1,78 +1,111 @@
-import pandas as pd
-import hashlib
+# coding: utf-8
+"""
+ayumi.xlsm の歩み値シート (先頭300行) を5秒ごとに確認し、初めて見た行だけを updated_data.csv に追記する。
+既出かどうかは、行内容の64bitハッシュ (列ごとにまとめて計算) を SQLite の索引 ayumiac_index.db で引いて判定する。
+索引は直近 HASH_RETENTION_SEC 秒に見た行だけを保持し、出力は追記のみなので、1サイクルの時間は1日の累計件数によらない。
+"""
 import os
-import json
-from datetime import datetime
-from openpyxl import load_workbook
 import time
+import sqlite3
+import zipfile
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from ayumixlsx import AyumiWorkbookReader
+
+EXCEL_PATH = 'c:/ayumi/ayumi.xlsm'
+SHEET_NAME = 'Sheet2'
+INDEX_DB_PATH = 'c:/ayumi/ayumiac_index.db'
+OUTPUT_CSV_PATH = 'c:/ayumi/updated_data.csv'
+WATCH_ROWS = 300                # 見出しの次の行から何行を確認するか
+POLL_INTERVAL_SEC = 5
+HASH_RETENTION_SEC = 12 * 3600  # 翌日の同じ時刻・同じ内容の約定を既出扱いしないよう、1日より短くする
+PURGE_INTERVAL_SEC = 600
+
+def generate_hashes(df: pd.DataFrame) -> np.ndarray:
+    """行の内容から64bitハッシュ (int64) を行ごとに生成する。値は文字列にそろえてから列単位で計算する。"""
+    return pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().view(np.int64)
 
-def generate_hash(row):
-    """行の内容からハッシュ値を生成"""
-    row_str = ''.join(map(str, row.values))
-    return hashlib.sha256(row_str.encode()).hexdigest()
+class HashIndex:
+    """既出の行ハッシュの索引。最後に見た時刻を持ち、保持期間を過ぎたものは定期的に消す。"""
+    def __init__(self, path: str = INDEX_DB_PATH, retention_sec: float = HASH_RETENTION_SEC):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen_hashes (hash INTEGER PRIMARY KEY, seen_at REAL NOT NULL)")
+        self.retention_sec = retention_sec
+        self.purged_at = 0.0
 
-def check_for_new_data():
-    # JSONファイルのパス（以前のデータを保持）
-    json_file_path = 'c:/ayumi/data.json'
-    
-    # Excelファイルとシートのパス（読み込み用）
-    file_path = 'c:/ayumi/ayumi.xlsm'
-    sheet_name = 'Sheet2'
-    
-    # Excelファイルからデータを読み込む
+    def mark(self, hashes: np.ndarray, now: float | None = None) -> np.ndarray:
+        """hashes をすべて既出として記録し、今回初めて見た位置を True とするマスクを返す (同じサイクル内の重複は最初の1行だけ)。"""
+        now = now or time.time()
+        if len(hashes) == 0: return np.zeros(0, dtype=bool)
+        values = hashes.tolist()
+        known = {h for (h,) in self.conn.execute(f"SELECT hash FROM seen_hashes WHERE hash IN ({','.join('?' * len(values))})", values)}
+        is_new = np.fromiter((h not in known for h in values), dtype=bool, count=len(values)) & ~pd.Series(hashes).duplicated().to_numpy()
+        with self.conn:
+            # 表示され続けている行は保持期間を延ばす
+            self.conn.executemany(
+                "INSERT INTO seen_hashes (hash, seen_at) VALUES (?, ?) ON CONFLICT(hash) DO UPDATE SET seen_at = excluded.seen_at",
+                [(h, now) for h in values]
+            )
+            if now - self.purged_at >= PURGE_INTERVAL_SEC:
+                self.conn.execute("DELETE FROM seen_hashes WHERE seen_at < ?", (now - self.retention_sec,)); self.purged_at = now
+        return is_new
+
+    def close(self) -> None:
+        self.conn.close()
+
+def append_rows(path: str, df: pd.DataFrame) -> None:
+    """出力CSVの末尾に追記する。新規作成時だけ見出しを書く (Excelで開けるよう BOM 付き)。"""
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    df.to_csv(path, mode='a', header=new_file, index=False, encoding='utf-8-sig' if new_file else 'utf-8')
+
+def read_watched_rows(reader: AyumiWorkbookReader) -> pd.DataFrame | None:
+    """シートの1行目を見出しとして、続く WATCH_ROWS 行を返す。ブックが前回から変わっていなければ None。"""
     while True:
         try:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
+            result = reader.read()
             break
         except PermissionError:
             print("ファイルにアクセスできません。5秒後に再試行します...")
             time.sleep(5)
-    
-    # 最初の300行を選択（2行目から301行目に相当）
-    df = df.iloc[0:300]
-    
-    # ハッシュ値を計算して新しい列に追加
-    df['hash'] = df.apply(generate_hash, axis=1)
-    
-    # 既存のJSONファイルからデータを読み込む
-    if os.path.exists(json_file_path):
-        with open(json_file_path, 'r', encoding='utf-8') as file:
-            previous_data = json.load(file)
-        df_previous = pd.DataFrame(previous_data)
-        if 'hash' not in df_previous.columns:
-            df_previous['hash'] = [None] * len(df_previous)  # 'hash'列がない場合は追加
-    else:
-        df_previous = pd.DataFrame(columns=['hash'])  # 空のDataFrameに'hash'列を設定
-    
-    # 新しいデータのハッシュ値が以前のデータに存在しない場合、そのデータを新規追加として扱う
-    df_new_unique = df[~df['hash'].isin(df_previous['hash'])]
-    
-    # 新規データがあれば、それを処理
-    if not df_new_unique.empty:
-        print("新しいユニークなデータが検出されました。以下のデータが追加されました:")
-        print(df_new_unique.drop(columns=['hash']).to_string(index=False))
-        
-        # エクセルファイルのパス
-        excel_output_path = 'c:/ayumi/updated_data.xlsx'
-        
-        # 新しいシート名（例：現在の日時を使用）
-        new_sheet_name = datetime.now().strftime('Data_%Y-%m-%d_%H-%M-%S')
-        
-        # 無効な日時値をフィルタリング
-        df_new_unique = df_new_unique[~df_new_unique['時刻'].astype(str).str.contains('--------')]
-        
-        # エクセルファイルに新しいシートを追加
-        with pd.ExcelWriter(excel_output_path, engine='openpyxl', mode='a' if os.path.exists(excel_output_path) else 'w') as writer:
-            df_new_unique.drop(columns=['hash']).iloc[::-1].to_excel(writer, sheet_name=new_sheet_name, index=False)
-        
-        # 全データ（新旧）を統合してJSONファイルに保存
-        df_full = pd.concat([df_previous, df_new_unique[['hash']]])
-        df_full.to_json(json_file_path, orient='records', force_ascii=False)
-        print("データの処理が完了しました。")
-    else:
-        print("新しいユニークなデータは検出されませんでした。")
+        except (FileNotFoundError, zipfile.BadZipFile) as e:
+            # ブックがない・保存途中などで壊れている: 同じく待って読み直す
+            print(f"ファイルを読み込めません ({e})。5秒後に再試行します...")
+            time.sleep(5)
+    if result is None: return None
+    _, raw = result
+    if raw.empty: return raw
+    df = raw.iloc[1:WATCH_ROWS + 1].copy()
+    df.columns = [str(c) for c in raw.iloc[0]]
+    return df.reset_index(drop=True)
+
+def check_for_new_data(reader: AyumiWorkbookReader, index: HashIndex, output_path: str = OUTPUT_CSV_PATH) -> int:
+    """新規の行を出力に追記し、その件数を返す。"""
+    df = read_watched_rows(reader)
+    if df is None or df.empty:
+        print("新しいユニークなデータは検出されませんでした。"); return 0
+    df_new_unique = df[index.mark(generate_hashes(df))]
+    if df_new_unique.empty:
+        print("新しいユニークなデータは検出されませんでした。"); return 0
+    print("新しいユニークなデータが検出されました。以下のデータが追加されました:")
+    print(df_new_unique.to_string(index=False))
+    # 無効な日時値をフィルタリング
+    df_new_unique = df_new_unique[~df_new_unique['時刻'].astype(str).str.contains('--------')]
+    # シートは新しい順なので、古い順に直して取得時刻とともに追記する
+    df_out = df_new_unique.iloc[::-1]
+    df_out.insert(0, '取得時刻', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    append_rows(output_path, df_out)
+    print("データの処理が完了しました。")
+    return len(df_out)
 
-# 定期的にデータチェックを行うループ
-while True:
-    check_for_new_data()
-    time.sleep(5)  # 5秒待機
\ No newline at end of file
+if __name__ == "__main__":
+    reader = AyumiWorkbookReader(EXCEL_PATH, data_sheet=SHEET_NAME, data_columns=None)
+    index = HashIndex()
+    # 定期的にデータチェックを行うループ
+    try:
+        while True:
+            check_for_new_data(reader, index)
+            time.sleep(POLL_INTERVAL_SEC)
+    finally:
+        index.close()
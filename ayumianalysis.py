@@ -0,0 +1,401 @@
+# coding: utf-8
+"""
+DBからの取得と分析を行う計算ステージ (Textual に依存しない)。TUI と分析サーバー (ayumiserver.py) が共通で使う。
+複数銘柄の一覧 (ダッシュボード) は DashboardStage が、全銘柄まとめての取得とワーカープロセスでの並列分析で受け持つ。
+"""
+import os
+import time
+import sqlite3
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from tradeanalyzer import StreamingTradeAnalyzer, session_metrics, profile_thresholds, HISTORY_SIZE
+from ayumidb import connect, TickerDirectory, to_epoch_ns, load_bars, load_lot_profile, load_ingest_batches, load_bursts, PRICE_SCALE
+from burstdetector import BurstEvent
+from ayumimetrics import StageTimings
+
+# 計算ステージから呼び出し側 (TUI・分析サーバー) へ渡す分析結果。受け取った側では読むだけ。ingest は今回読んだ行の取り込みごとの (シート更新, 読み込み, 挿入) 時刻
+AnalysisSnapshot = namedtuple('AnalysisSnapshot', 'generation ticker last_id new_count new_buy_ratio summary ticks error session ingest bursts')
+
+class AnalysisStage:
+    """
+    DBからの取得と分析を、呼び出し側のイベントループ外の専用スレッド1本で行う計算ステージ。
+    analyzer とDB接続はこのスレッドだけが触り、呼び出し側には AnalysisSnapshot を返す。約定 (ticks) は前回渡した後に増えた行だけの写しで、
+    呼び出し側は TickRingBuffer.extend で手元のバッファに続ける (切替直後とロットの分け直し後は末尾 log_rows 件を丸ごと渡す)。新しい行がなければ None。
+    generation は銘柄切替のたびに呼び出し側で増やす番号で、変わっていれば分析状態を捨てて読み直す。
+    当日全体の指標 (session) は、収集スクリプトが保存時に更新している5分足から求める。
+    ロットのしきい値は、収集スクリプトが保存時に更新している約定代金の分布 (直近 LOT_PROFILE_DAYS 取引日分) から、
+    銘柄切替の直後 (最初の分析の前) と LOT_PROFILE_REFRESH_SEC 秒ごとに読み直す。
+    収集スクリプトが検知したバースト (bursts テーブル) のうち、前回より後のものを bursts に載せる (銘柄切替前の分は載せない)。
+    state_dir を指定すると、analyzer の状態を銘柄ごとに STATE_SAVE_INTERVAL_SEC 秒ごと・銘柄切替の前・close のときに書き出し、
+    銘柄切替 (起動直後を含む) ではその続きから分析を再開する。保存後の約定は差分だけを読むので、DBの大きさによらず最初の結果がすぐに出る。
+    取得 (fetch)・分析 (analyze)・ログ用の写し (snapshot)・状態の書き出し (state_save) の所要時間を timings に記録する。
+    """
+    SESSION_BAR_MS = 300_000
+    LOT_PROFILE_REFRESH_SEC = 300
+    STATE_SAVE_INTERVAL_SEC = 60
+    STATE_VERSION = 1
+    def __init__(self, db_path: str, log_rows: int = 5000, timings: StageTimings | None = None, state_dir: str | None = None):
+        self.db_path, self.log_rows, self.state_dir = db_path, log_rows, state_dir
+        self.timings = timings or StageTimings()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ayumi-analysis')
+        self.analyzer = StreamingTradeAnalyzer()
+        self.tickers = TickerDirectory()
+        self.conn = None
+        self.generation = None
+        self.last_id = 0
+        self.trade_date = None
+        self.session = None
+        self.profile_loaded_at = None
+        self.burst_id = None
+        self.ticker_code = None       # 分析中の銘柄 (状態の書き出し先)
+        self.state_saved_at = 0.0
+        self.state_dirty = False      # 最後に書き出してから新しい約定を取り込んだか
+        self.log_end_seq = None       # 呼び出し側に渡した約定の末尾の seq (None なら次は末尾 log_rows 件を丸ごと渡す)
+
+    def submit(self, ticker_code: str, generation: int):
+        """取得と分析を計算スレッドに依頼し、AnalysisSnapshot を返す Future を返す。"""
+        return self.executor.submit(self._run, ticker_code, generation)
+
+    def close(self) -> None:
+        self.executor.submit(self._close).result(); self.executor.shutdown()
+
+    def _close(self) -> None:
+        if self.state_dirty: self._save_state()
+        if self.conn: self.conn.close(); self.conn = None
+
+    def _state_path(self, ticker_code: str) -> str:
+        return os.path.join(self.state_dir, f"{ticker_code}.npz")
+
+    def _save_state(self) -> None:
+        """分析中の銘柄の analyzer の状態を書き出す。別名に書いてから置き換えるので、書きかけのファイルは残らない。"""
+        self.state_saved_at, self.state_dirty = time.monotonic(), False
+        if not self.state_dir or not self.ticker_code or not len(self.analyzer.ticks): return
+        started, path = time.perf_counter(), self._state_path(self.ticker_code)
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, **self.analyzer.state(), version=self.STATE_VERSION, last_id=self.last_id, trade_date=self.trade_date or 0)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            return  # 状態は起動を速くするためだけのものなので、書けなくても分析は続ける
+        self.timings.record('state_save', time.perf_counter() - started)
+
+    def _restore_state(self, ticker_code: str, ticker_id: int, oldest_id: int) -> bool:
+        """
+        書き出した状態を analyzer に戻し、その続きから読めるようにする。戻せたら True。
+        保存後の約定が analyzer のバッファに収まらない (保存した last_id が直近バッファ分の最古の id より前)・
+        保存した最後の約定がDBの同じ id の行と一致しない (DBの作り直しや保存期間による削除)・設定が違う、のいずれかなら使わない。
+        """
+        if not self.state_dir: return False
+        try:
+            with np.load(self._state_path(ticker_code)) as data: state = dict(data)
+            if int(state['version']) != self.STATE_VERSION or int(state['last_id']) < oldest_id - 1 or not len(state['ticks_id']): return False
+            tail_id, tail_t, tail_price = int(state['ticks_id'][-1]), int(state['ticks_t'][-1]), float(state['ticks_price'][-1])
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return False
+        row = self.conn.execute("SELECT ticker_id, trade_date, time_ms, price_x10 FROM ticks WHERE id = ?", (tail_id,)).fetchone()
+        if row is None or row[0] != ticker_id or int(to_epoch_ns(np.array([row[1]]), np.array([row[2]]))[0]) != tail_t or row[3] != round(tail_price * PRICE_SCALE):
+            return False
+        try:
+            self.analyzer.restore(state)
+        except (KeyError, ValueError):
+            self.analyzer.reset(); return False
+        self.last_id, self.trade_date = int(state['last_id']), int(state['trade_date']) or None
+        self.state_saved_at = time.monotonic()
+        return True
+
+    def _fetch_new_ticks(self, ticker_code: str) -> np.ndarray:
+        """last_id より後の約定を (id, trade_date, time_ms, price_x10, volume, side) の int64 配列で返す。"""
+        if self.conn is None:
+            self.conn = connect(self.db_path, 'reader')
+        ticker_id = self.tickers.get(self.conn, ticker_code)
+        if ticker_id is None: return np.empty((0, 6), dtype=np.int64)  # 収集スクリプトがまだこの銘柄を書き込んでいない
+        if self.last_id == 0:
+            # 切替直後は、書き出した状態があればその続きから、なければ分析バッファに収まる直近の約定だけを読む (それより古い行は読んでも押し出される)
+            row = self.conn.execute(
+                "SELECT id FROM ticks WHERE ticker_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?", (ticker_id, self.analyzer.ticks.capacity - 1)
+            ).fetchone()
+            if not self._restore_state(ticker_code, ticker_id, row[0] if row else 0) and row: self.last_id = row[0] - 1
+        rows = self.conn.execute(
+            "SELECT id, trade_date, time_ms, price_x10, volume, side FROM ticks WHERE ticker_id = ? AND id > ? ORDER BY id",
+            (ticker_id, self.last_id)
+        ).fetchall()
+        return np.array(rows, dtype=np.int64).reshape(-1, 6)
+
+    def _session_metrics(self, ticker_code: str) -> dict | None:
+        """表示中の取引日の5分足を合算した当日全体の指標。足のないDB (旧スキーマ) なら None。"""
+        try:
+            bars = load_bars(self.conn, self.tickers.get(self.conn, ticker_code), self.trade_date, self.SESSION_BAR_MS)
+        except sqlite3.Error:
+            return None
+        return session_metrics(bars) or None
+
+    def _refresh_lot_thresholds(self, ticker_code: str) -> None:
+        """約定代金の分布からロットのしきい値を求めて analyzer に設定する。分布が足りない・旧スキーマなら時間窓からのしきい値に戻す。"""
+        self.profile_loaded_at = time.monotonic()
+        try:
+            counts = load_lot_profile(self.conn, self.tickers.get(self.conn, ticker_code), self.trade_date)
+        except sqlite3.Error:
+            counts = None
+        thresholds = self.analyzer.lot_thresholds
+        self.analyzer.set_lot_thresholds(profile_thresholds(counts) if counts is not None else None)
+        if self.analyzer.lot_thresholds != thresholds: self.log_end_seq = None  # 保持中の行のロットが変わったので、ログを丸ごと渡し直す
+
+    def _ingest_times(self, ticker_code: str, first_id: int, last_id: int) -> tuple:
+        """今回読んだ行の取り込みごとの (シート更新, 読み込み, 挿入) 時刻。記録のないDB (旧スキーマ) なら空。"""
+        try:
+            rows = load_ingest_batches(self.conn, self.tickers.get(self.conn, ticker_code), first_id, last_id)
+        except sqlite3.Error:
+            return ()
+        return tuple((sheet_mtime, read_at, ingested_at) for _, _, sheet_mtime, read_at, ingested_at in rows)
+
+    def _new_bursts(self, ticker_code: str) -> tuple:
+        """前回から後に検知されたバースト。切替直後は既存の分を読み飛ばす。bursts のないDB (旧スキーマ) なら空。"""
+        ticker_id = self.tickers.get(self.conn, ticker_code)
+        if ticker_id is None: return ()
+        try:
+            if self.burst_id is None:
+                self.burst_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM bursts WHERE ticker_id = ?", (ticker_id,)).fetchone()[0]; return ()
+            rows = load_bursts(self.conn, ticker_id, self.burst_id)
+        except sqlite3.Error:
+            return ()
+        if rows: self.burst_id = rows[-1][0]
+        return tuple(BurstEvent(*row[1:8]) for row in rows)
+
+    def _run(self, ticker_code: str, generation: int) -> AnalysisSnapshot:
+        if generation != self.generation:
+            if self.state_dirty: self._save_state()
+            self.analyzer.reset(); self.last_id = 0; self.generation = generation; self.trade_date = self.session = self.profile_loaded_at = self.burst_id = self.log_end_seq = None
+            self.ticker_code = ticker_code
+        started, incremental, ingest = time.perf_counter(), self.last_id > 0, ()
+        try:
+            new_ticks = self._fetch_new_ticks(ticker_code)
+        except sqlite3.Error as e:
+            return AnalysisSnapshot(generation, ticker_code, self.last_id, 0, None, None, None, str(e), self.session, (), ())
+        if len(new_ticks):
+            # 切替直後に読む過去の行は遅延の計測に含めない
+            if incremental: ingest = self._ingest_times(ticker_code, int(new_ticks[0, 0]), int(new_ticks[-1, 0]))
+            self.last_id, self.trade_date = int(new_ticks[-1, 0]), int(new_ticks[-1, 1])
+            self.state_dirty = True
+        if self.trade_date is not None and (len(new_ticks) or not incremental):  # 状態を戻した直後は新しい約定がなくても求める
+            self.session = self._session_metrics(ticker_code)
+            if self.profile_loaded_at is None or time.monotonic() - self.profile_loaded_at >= self.LOT_PROFILE_REFRESH_SEC:
+                self._refresh_lot_thresholds(ticker_code)
+        bursts = self._new_bursts(ticker_code)
+        fetched = time.perf_counter()
+        ids, trade_date, time_ms, price_x10, volume, side = new_ticks.T
+        res = self.analyzer.update_arrays(ids, to_epoch_ns(trade_date, time_ms), price_x10 / PRICE_SCALE, volume, side.astype(np.int8))
+        new_count = self.analyzer.new_rows
+        new_buy_ratio = float((self.analyzer.ticks.tail('direction', new_count) > 0).mean()) if new_count else None
+        analyzed = time.perf_counter()
+        ticks, buffer = None, self.analyzer.ticks
+        if len(buffer) and (self.log_end_seq is None or buffer.end_seq != self.log_end_seq):
+            n = min(buffer.end_seq - self.log_end_seq, self.log_rows) if self.log_end_seq is not None and buffer.end_seq > self.log_end_seq else self.log_rows
+            ticks, self.log_end_seq = buffer.snapshot(n), buffer.end_seq
+        if len(new_ticks):
+            self.timings.record('fetch', fetched - started); self.timings.record('analyze', analyzed - fetched)
+            if ticks is not None: self.timings.record('snapshot', time.perf_counter() - analyzed)
+        if self.state_dirty and time.monotonic() - self.state_saved_at >= self.STATE_SAVE_INTERVAL_SEC: self._save_state()
+        return AnalysisSnapshot(
+            generation, ticker_code, self.last_id, len(new_ticks), new_buy_ratio,
+            res['summary'] if res else None, ticks, None, self.session, ingest, bursts,
+        )
+
+# ダッシュボードの1銘柄分の行。price は直近の約定価格、vwap_dev_bps はその時間窓VWAPからの乖離 (bp)、large_net は大口+超大口の買い−売り出来高、
+# bursts は前回から後に検知されたバースト。まだ約定のない銘柄は signal 以降が None
+DashboardRow = namedtuple('DashboardRow', 'ticker last_id new_count signal confidence buy_ratio price vwap vwap_dev_bps large_net bursts')
+DashboardSnapshot = namedtuple('DashboardSnapshot', 'generation rows error')
+DASHBOARD_WORKERS = min(4, (os.cpu_count() or 1) - 1)  # 分析を受け持つプロセス数 (0 なら取得スレッドで分析する)
+
+_worker_analyzers = {}  # ダッシュボードのワーカープロセス内: 銘柄コード -> (generation, StreamingTradeAnalyzer)
+
+def _dashboard_update(analyzers: dict, generation: int, batches: list) -> list:
+    """
+    batches の (銘柄コード, ロットのしきい値, 約定の配列) ごとに analyzers の analyzer を更新し、
+    (銘柄コード, 取り込んだ件数, シグナル, 信頼度, 買い比率, 直近価格, VWAP, 大口+超大口の差引) のリストを返す。分析できなければシグナル以降は None。
+    generation が違う analyzer (銘柄の組を変える前のもの) は捨てる。
+    """
+    for code in [code for code, (g, _) in analyzers.items() if g != generation]: del analyzers[code]
+    results = []
+    for code, thresholds, ticks in batches:
+        if code not in analyzers: analyzers[code] = (generation, StreamingTradeAnalyzer())
+        analyzer = analyzers[code][1]
+        analyzer.set_lot_thresholds(thresholds)
+        ids, trade_date, time_ms, price_x10, volume, side = ticks.T
+        res = analyzer.update_arrays(ids, to_epoch_ns(trade_date, time_ms), price_x10 / PRICE_SCALE, volume, side.astype(np.int8))
+        if not res or not res['summary']['metrics']:
+            results.append((code, analyzer.new_rows) + (None,) * 6); continue
+        summary = res['summary']
+        results.append((code, analyzer.new_rows, summary['signal'], summary['confidence'], float(summary['buy_ratio']),
+                        float(analyzer.ticks.tail('price', 1)[0]), float(summary['metrics']['vwap']), int(summary['breakdown']['差引'].to_numpy()[2:].sum())))
+    return results
+
+def _dashboard_worker(generation: int, batches: list) -> list:
+    return _dashboard_update(_worker_analyzers, generation, batches)
+
+class DashboardStage:
+    """
+    複数銘柄の一覧 (ダッシュボード) 用の計算ステージ。取得はポーリング1回につき全銘柄まとめて1本のクエリで行い、
+    銘柄ごとの analyzer は workers 個のワーカープロセスに銘柄を固定で割り振って並列に更新する (ワーカーには新しい約定だけを送る)。
+    DB接続と銘柄ごとの取得位置は取得スレッド1本だけが触る。銘柄の組は set_tickers で変え、そのたびに generation を増やす。
+    初回 (と銘柄が初めてDBに現れたとき) は、その銘柄の直近 analyzer のバッファに収まる分だけを読む。
+    ロットのしきい値は AnalysisStage と同じく約定代金の分布から、銘柄ごとに LOT_PROFILE_REFRESH_SEC 秒ごとに読み直す。
+    取得 (dashboard_fetch)・分析 (dashboard_analyze) の所要時間を timings に記録する。
+    """
+    LOT_PROFILE_REFRESH_SEC = AnalysisStage.LOT_PROFILE_REFRESH_SEC
+    def __init__(self, db_path: str, tickers: list, workers: int = DASHBOARD_WORKERS, timings: StageTimings | None = None):
+        self.db_path = db_path
+        self.timings = timings or StageTimings()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ayumi-dashboard')
+        self.workers = [ProcessPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.analyzers = {}  # workers が 0 のときの analyzer
+        self.directory = TickerDirectory()
+        self.conn = None
+        self.generation = 0
+        self._set_tickers(tickers)
+
+    def set_tickers(self, tickers: list):
+        """一覧に並べる銘柄を変える (取得スレッドで行い、新しい generation を返す Future を返す)。以前の銘柄の分析状態は捨てる。"""
+        return self.executor.submit(self._set_tickers, tickers)
+
+    def _set_tickers(self, tickers: list) -> int:
+        self.tickers, self.generation = list(dict.fromkeys(tickers)), self.generation + 1
+        # 次の割り振りで担当の銘柄がないワーカーにも、以前の analyzer を捨てさせる (ワーカーは依頼を順に処理するので待たなくてよい)
+        self.analyzers.clear()
+        for worker in self.workers: worker.submit(_dashboard_worker, self.generation, [])
+        self.last_id = None          # 全銘柄共通の取得位置 (ticks.id)
+        self.burst_id = None
+        self.ticker_ids = {}         # 銘柄コード -> ticker_id (DBに現れた銘柄だけ)
+        self.lot_thresholds = {}     # 銘柄コード -> (ロットのしきい値, 読んだ時刻)
+        self.rows = {code: DashboardRow(code, 0, 0, None, None, None, None, None, None, None, ()) for code in self.tickers}
+        return self.generation
+
+    def submit(self):
+        """全銘柄の取得と分析を取得スレッドに依頼し、DashboardSnapshot を返す Future を返す。"""
+        return self.executor.submit(self._run)
+
+    def close(self) -> None:
+        self.executor.submit(self._close).result(); self.executor.shutdown()
+        for worker in self.workers: worker.shutdown(cancel_futures=True)
+
+    def _close(self) -> None:
+        if self.conn: self.conn.close(); self.conn = None
+
+    def _fetch(self) -> dict:
+        """前回より後の約定を1本のクエリで読み、銘柄コード -> (id, trade_date, time_ms, price_x10, volume, side) の配列 に分ける。"""
+        if self.conn is None: self.conn = connect(self.db_path, 'reader')
+        if self.last_id is None:
+            self.last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM ticks").fetchone()[0]
+        batches = {}
+        for code in self.tickers:
+            if code in self.ticker_ids: continue
+            ticker_id = self.directory.get(self.conn, code)
+            if ticker_id is None: continue  # 収集スクリプトがまだこの銘柄を書き込んでいない
+            # 初めて見た銘柄は、共通の取得位置までのうち analyzer のバッファに収まる直近の約定を読む
+            self.ticker_ids[code] = ticker_id
+            rows = self.conn.execute(
+                "SELECT id, trade_date, time_ms, price_x10, volume, side FROM ticks WHERE ticker_id = ? AND id <= ? ORDER BY id DESC LIMIT ?",
+                (ticker_id, self.last_id, HISTORY_SIZE)
+            ).fetchall()
+            if rows: batches[code] = np.array(rows[::-1], dtype=np.int64)
+        codes = {ticker_id: code for code, ticker_id in self.ticker_ids.items()}
+        if not codes: return batches
+        rows = self.conn.execute(
+            f"SELECT ticker_id, id, trade_date, time_ms, price_x10, volume, side FROM ticks WHERE id > ? AND ticker_id IN ({', '.join('?' * len(codes))}) ORDER BY id",
+            (self.last_id, *codes)
+        ).fetchall()
+        if not rows: return batches
+        new_ticks = np.array(rows, dtype=np.int64)
+        self.last_id = int(new_ticks[-1, 1])
+        order = np.argsort(new_ticks[:, 0], kind='stable')
+        ticker_ids, starts = np.unique(new_ticks[order, 0], return_index=True)
+        for ticker_id, part in zip(ticker_ids.tolist(), np.split(new_ticks[order, 1:], starts[1:])):
+            code = codes[ticker_id]
+            batches[code] = np.concatenate((batches[code], part)) if code in batches else part
+        return batches
+
+    def _thresholds(self, code: str, trade_date: int):
+        """銘柄のロットのしきい値。LOT_PROFILE_REFRESH_SEC 秒ごとに約定代金の分布から読み直す。分布が足りない・旧スキーマなら None。"""
+        thresholds, loaded_at = self.lot_thresholds.get(code, (None, None))
+        if loaded_at is None or time.monotonic() - loaded_at >= self.LOT_PROFILE_REFRESH_SEC:
+            try:
+                counts = load_lot_profile(self.conn, self.ticker_ids[code], trade_date)
+            except sqlite3.Error:
+                counts = None
+            thresholds = profile_thresholds(counts) if counts is not None else None
+            self.lot_thresholds[code] = (thresholds, time.monotonic())
+        return thresholds
+
+    def _new_bursts(self) -> dict:
+        """前回から後に検知されたバーストを 銘柄コード -> BurstEvent のタプル で返す。初回は既存の分を読み飛ばす。"""
+        codes = {ticker_id: code for code, ticker_id in self.ticker_ids.items()}
+        try:
+            if self.burst_id is None:
+                self.burst_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM bursts").fetchone()[0]; return {}
+            rows = self.conn.execute(
+                "SELECT id, ticker_id, trade_date, time_ms, side, trades, volume, buy_ratio, score FROM bursts WHERE id > ? ORDER BY id", (self.burst_id,)
+            ).fetchall()
+        except sqlite3.Error:
+            return {}
+        bursts = {}
+        for row in rows:
+            self.burst_id = row[0]
+            if row[1] in codes: bursts.setdefault(codes[row[1]], []).append(BurstEvent(*row[2:]))
+        return {code: tuple(events) for code, events in bursts.items()}
+
+    def _run(self) -> DashboardSnapshot:
+        started = time.perf_counter()
+        try:
+            batches = self._fetch()
+            work = [(code, self._thresholds(code, int(ticks[-1, 1])), ticks) for code, ticks in batches.items()]
+            bursts = self._new_bursts()
+        except sqlite3.Error as e:
+            return DashboardSnapshot(self.generation, tuple(self.rows[code] for code in self.tickers), str(e))
+        fetched = time.perf_counter()
+        if self.workers:
+            shards = [[] for _ in self.workers]
+            for item in work: shards[self.tickers.index(item[0]) % len(self.workers)].append(item)
+            futures = [worker.submit(_dashboard_worker, self.generation, shard) for worker, shard in zip(self.workers, shards) if shard]
+            results = [result for future in futures for result in future.result()]
+        else:
+            results = _dashboard_update(self.analyzers, self.generation, work)
+        last_ids = {code: int(ticks[-1, 0]) for code, _, ticks in work}
+        for code, row in self.rows.items():
+            self.rows[code] = row._replace(new_count=0, bursts=bursts.get(code, ()))
+        for code, new_count, signal, confidence, buy_ratio, price, vwap, large_net in results:
+            values = dict(last_id=last_ids[code], new_count=new_count)
+            if signal is not None:
+                values.update(signal=signal, confidence=confidence, buy_ratio=buy_ratio, price=price, vwap=vwap,
+                              vwap_dev_bps=(price / vwap - 1) * 1e4 if vwap else None, large_net=large_net)
+            self.rows[code] = self.rows[code]._replace(**values)
+        if work:
+            self.timings.record('dashboard_fetch', fetched - started); self.timings.record('dashboard_analyze', time.perf_counter() - fetched)
+        return DashboardSnapshot(self.generation, tuple(self.rows[code] for code in self.tickers), None)
+
+def _plain(value):
+    """JSON / MessagePack に書ける値 (dict・list・str・int・float・None) に変換する。NaN は None。"""
+    if isinstance(value, dict): return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, pd.DataFrame): return {str(index): _plain(row.to_dict()) for index, row in value.iterrows()}
+    if isinstance(value, (list, tuple, np.ndarray)): return [_plain(v) for v in value]
+    if isinstance(value, np.generic): value = value.item()
+    if isinstance(value, float) and value != value: return None
+    return value
+
+def snapshot_payload(snapshot: AnalysisSnapshot, rows: int = 200) -> dict:
+    """
+    AnalysisSnapshot を外部に渡す辞書にする。summary (ロット別出来高は {ロット: {買い, 売り, 差引}}) と当日全体の指標に、
+    直近 rows 件の約定を列ごとのリスト (時刻はエポックミリ秒、方向は 1=買い/-1=売り、ロットは 0=小口〜3=超大口) で添える。
+    """
+    ticks = None
+    if snapshot.ticks is not None and rows > 0:
+        n = min(rows, len(snapshot.ticks))
+        ticks = {name: snapshot.ticks.tail(name, n).tolist() for name in ('id', 'price', 'volume', 'direction', 'lot')}
+        ticks['time_ms'] = (snapshot.ticks.tail('t', n) // 1_000_000).tolist()
+    return {
+        'ticker': snapshot.ticker, 'last_id': snapshot.last_id, 'new_count': snapshot.new_count, 'error': snapshot.error,
+        'summary': _plain(snapshot.summary), 'session': _plain(snapshot.session), 'ticks': ticks,
+        'bursts': [_plain(event._asdict()) for event in snapshot.bursts],
+    }
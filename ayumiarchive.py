@@ -0,0 +1,126 @@
+# coding: utf-8
+"""
+取引が終わった日の約定を、ホットなDB (market_data.db の ticks) から 取引日/銘柄 ごとの列指向ファイルへ移すアーカイブ。
+1列1ファイルの .npy なので np.load(mmap_mode='r') でコピーせずに読め、過去日の走査はディスクの読み出し速度で進む。
+DBには当日分 (と --keep-days の日数分、および銘柄ごとの最新の取引日) だけが残り、収集スクリプトとTUIが使う表は小さいまま保たれる。
+銘柄ごとの最新の取引日は、before より前でも移さない (寄り付き前はシートに前の取引日の歩み値が残っていて、
+収集スクリプトを起動し直すとDBに残った最新の約定と照合して取り込み済みの行を見分けるため)。
+
+    python ayumiarchive.py --compact c:/ayumi/market_data.db --archive c:/ayumi/archive
+
+配置:  <archive>/<YYYYMMDD>/<銘柄コード>/{id,time_ms,price_x10,volume,side,seq}.npy と meta.json
+各パーティションの行は (time_ms, seq) 順。価格は ticks と同じく PRICE_SCALE 倍の整数。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+from datetime import date, timedelta
+import numpy as np
+from ayumidb import date_to_int
+
+ARCHIVE_DIR = 'c:/ayumi/archive'
+ARCHIVE_VERSION = 1
+COLUMNS = {'id': np.int64, 'time_ms': np.int32, 'price_x10': np.int32, 'volume': np.int64, 'side': np.int8, 'seq': np.int32}
+
+def partition_path(archive_dir: str, ticker_code: str, trade_date: int) -> str:
+    return os.path.join(archive_dir, str(trade_date), ticker_code)
+
+def list_partitions(archive_dir: str = ARCHIVE_DIR) -> list:
+    """アーカイブにある (銘柄コード, 取引日) の組を、取引日・銘柄コード順に返す。"""
+    if not os.path.isdir(archive_dir): return []
+    parts = []
+    for day in sorted(os.listdir(archive_dir)):
+        if not day.isdigit(): continue
+        day_dir = os.path.join(archive_dir, day)
+        parts += [(code, int(day)) for code in sorted(os.listdir(day_dir)) if os.path.exists(os.path.join(day_dir, code, 'meta.json'))]
+    return parts
+
+def load_partition(ticker_code: str, trade_date: int, archive_dir: str = ARCHIVE_DIR, columns=None) -> dict | None:
+    """1銘柄・1日分を {列名: 配列} で返す。各列は読み取り専用の np.memmap で、読み込み時のコピーは発生しない。なければ None。"""
+    path = partition_path(archive_dir, ticker_code, trade_date)
+    if not os.path.exists(os.path.join(path, 'meta.json')): return None
+    return {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in (columns or COLUMNS)}
+
+def merge_columns(a: dict, b: dict) -> dict:
+    """2つの列集合を (time_ms, seq) 順に並べて結合し、同じキーの行は1行にする (a を優先)。"""
+    merged = {name: np.concatenate((np.asarray(a[name]), np.asarray(b[name]))).astype(dtype) for name, dtype in COLUMNS.items()}
+    order = np.lexsort((np.arange(len(merged['id'])), merged['seq'], merged['time_ms']))
+    merged = {name: values[order] for name, values in merged.items()}
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (np.diff(merged['time_ms']) != 0) | (np.diff(merged['seq']) != 0)
+    return {name: values[keep] for name, values in merged.items()}
+
+def write_partition(archive_dir: str, ticker_code: str, trade_date: int, columns: dict) -> None:
+    """一時ディレクトリに書いてから置き換える。途中で止まっても中途半端なパーティションは残らない。"""
+    path = partition_path(archive_dir, ticker_code, trade_date)
+    tmp, old = path + '.tmp', path + '.old'
+    shutil.rmtree(tmp, ignore_errors=True); os.makedirs(tmp)
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(tmp, f'{name}.npy'), np.ascontiguousarray(columns[name], dtype=dtype))
+    ids = columns['id']
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': ARCHIVE_VERSION, 'ticker': ticker_code, 'trade_date': trade_date, 'rows': len(ids),
+                   'min_id': int(ids.min()), 'max_id': int(ids.max()), 'written_at': time.time()}, f)
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path): os.replace(path, old)  # Windows ではディレクトリを上書きで置き換えられないため、一度退避する
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+def compact(conn, archive_dir: str = ARCHIVE_DIR, before: int | None = None, tickers: list | None = None) -> list:
+    """
+    trade_date が before (YYYYMMDD、省略時は今日) より前の約定をアーカイブへ移し、DBから消す。銘柄ごとの最新の取引日はDBに残す。
+    パーティションが既にあれば (日付をまたいで遅れて取り込まれた行など) 結合して書き直す。
+    書き出しの後、読み出した id までの行だけを消すので、その間に収集スクリプトが書いた行は次回に回る。tickers で銘柄を絞れる。
+    移した (銘柄コード, 取引日, 件数) のリストを返す。
+    """
+    before = before or date_to_int(date.today())
+    targets = conn.execute(
+        "SELECT k.code, d.ticker_id, d.trade_date FROM (SELECT DISTINCT ticker_id, trade_date FROM ticks WHERE trade_date < ?) d "
+        "JOIN tickers k ON k.ticker_id = d.ticker_id "
+        "JOIN (SELECT ticker_id, MAX(trade_date) AS latest FROM ticks GROUP BY ticker_id) m ON m.ticker_id = d.ticker_id "
+        "WHERE d.trade_date < m.latest ORDER BY d.trade_date, k.code", (before,)
+    ).fetchall()
+    moved = []
+    for code, ticker_id, trade_date in targets:
+        if tickers is not None and code not in tickers: continue
+        rows = conn.execute(
+            "SELECT id, time_ms, price_x10, volume, side, seq FROM ticks WHERE ticker_id = ? AND trade_date = ? ORDER BY time_ms, seq",
+            (ticker_id, trade_date)
+        ).fetchall()
+        if not rows: continue
+        columns = dict(zip(COLUMNS, np.array(rows, dtype=np.int64).T))
+        max_id = int(columns['id'].max())
+        existing = load_partition(code, trade_date, archive_dir)
+        if existing is not None: columns = merge_columns(existing, columns); del existing  # 置き換える前に memmap を閉じる
+        write_partition(archive_dir, code, trade_date, columns)
+        with conn:
+            conn.execute("DELETE FROM ticks WHERE ticker_id = ? AND trade_date = ? AND id <= ?", (ticker_id, trade_date, max_id))
+        moved.append((code, trade_date, len(rows)))
+    return moved
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="取引が終わった日の約定を列指向のアーカイブへ移し、DBを小さく保つ")
+    parser.add_argument('--compact', metavar='DB_PATH', required=True)
+    parser.add_argument('--archive', default=ARCHIVE_DIR, help="アーカイブの置き場所")
+    parser.add_argument('--keep-days', type=int, default=0, help="DBに残す過去の日数 (0 なら当日分と銘柄ごとの最新の取引日だけ残す)")
+    parser.add_argument('--vacuum', action='store_true', help="移した後に VACUUM してファイルを縮める (収集中は避ける)")
+    args = parser.parse_args()
+    if not os.path.exists(args.compact):
+        print(f"エラー: DBファイルが見つかりません: {args.compact}"); sys.exit(1)
+    size_before = os.path.getsize(args.compact)
+    conn = sqlite3.connect(args.compact, timeout=10.0)
+    try:
+        started = time.perf_counter()
+        moved = compact(conn, args.archive, before=date_to_int(date.today() - timedelta(days=args.keep_days)))
+        for code, trade_date, count in moved: print(f"  {trade_date} {code}: {count:,} 件")
+        print(f"{len(moved)} パーティション・{sum(m[2] for m in moved):,} 件を {args.archive} へ移しました ({time.perf_counter() - started:,.2f}秒)。")
+        if args.vacuum and moved:
+            print("VACUUM を実行しています...")
+            conn.execute("VACUUM"); conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # WALモードでは書き戻して初めてファイルが縮む
+    finally:
+        conn.close()
+    print(f"ファイルサイズ: {size_before / 1024 / 1024:,.1f}MB -> {os.path.getsize(args.compact) / 1024 / 1024:,.1f}MB")
@@ -0,0 +1,64 @@
+# coding: utf-8
+"""
+収集スクリプト -> TUI の新着通知チャネル (ローカルホストのUDP)。
+通知は「銘柄 T の約定が id N まで保存された」という1件のJSONで、受け手がいなくても送り手は止まらない。
+UDPなので取りこぼしはありうる。受け手は間隔を延ばしたポーリングを併用すること。
+1つのUDPポートで受けられるのは1プロセスだけなので、送り手は NOTIFY_PORT から NOTIFY_SLOTS 個の連続したポートすべてに送り、
+受け手 (TUI・分析サーバーなど) は空いている最初のポートで受ける。同時に受けられるのは NOTIFY_SLOTS 個までで、
+それを超えた受け手は subscribe が OSError になり、ポーリングだけで更新することになる。
+"""
+import json
+import socket
+import asyncio
+
+NOTIFY_HOST = '127.0.0.1'
+NOTIFY_PORT = 47301
+NOTIFY_SLOTS = 8  # 同時に通知を受けられる受け手の数 (NOTIFY_PORT から連続して使うポートの数)
+
+class TickPublisher:
+    """新着通知の送り手 (収集スクリプト側)。送信はノンブロッキングで、失敗しても無視する。"""
+    def __init__(self, host: str = NOTIFY_HOST, port: int = NOTIFY_PORT, slots: int = NOTIFY_SLOTS):
+        self.addrs = [(host, p) for p in range(port, port + slots)]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def publish(self, ticker_code: str, last_id: int) -> None:
+        message = json.dumps({'ticker': ticker_code, 'last_id': last_id}).encode('utf-8')
+        for addr in self.addrs:
+            try:
+                self.sock.sendto(message, addr)
+            except OSError:
+                pass  # 受け手がいない・バッファが一杯。次の通知かポーリングで追いつく
+
+    def close(self) -> None:
+        self.sock.close()
+
+class _SubscriberProtocol(asyncio.DatagramProtocol):
+    def __init__(self, callback):
+        self.callback = callback
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            message = json.loads(data)
+            ticker_code, last_id = str(message['ticker']), int(message['last_id'])
+        except (ValueError, KeyError, TypeError):
+            return
+        self.callback(ticker_code, last_id)
+
+    def error_received(self, exc) -> None:
+        pass  # Windowsでは ICMP の到達不能通知がここに来ることがある。受信は続ける
+
+async def subscribe(callback, host: str = NOTIFY_HOST, port: int = NOTIFY_PORT, slots: int = NOTIFY_SLOTS) -> asyncio.DatagramTransport:
+    """
+    通知を受けるたびに、イベントループ上で callback(銘柄コード, 最終id) を呼ぶ。
+    port から slots 個のポートのうち空いている最初のもので受ける。受信を止めるときは返した transport を close する。
+    すべて使用中なら OSError。
+    """
+    loop = asyncio.get_running_loop()
+    for p in range(port, port + slots):
+        try:
+            transport, _ = await loop.create_datagram_endpoint(lambda: _SubscriberProtocol(callback), local_addr=(host, p))
+            return transport
+        except OSError as e:
+            error = e
+    raise OSError(f"通知用のポート {port}-{port + slots - 1} がすべて使用中です") from error
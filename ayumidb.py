@@ -0,0 +1,397 @@
+# coding: utf-8
+"""
+market_data.db のスキーマ (バージョン6) と、旧 ayumi テーブルからの移行ツール。
+
+    python ayumidb.py --migrate c:/ayumi/market_data.db
+"""
+import os
+import sys
+import sqlite3
+import argparse
+from datetime import datetime, date, timedelta
+import numpy as np
+from tickbuffer import DIRECTION_CODES
+
+SCHEMA_VERSION = 6
+PRICE_SCALE = 10  # 価格は 0.1円 単位の整数で保存する (東証・PTSの最小呼値が 0.1円 のため)
+SIDE_LABELS = {code: label for label, code in DIRECTION_CODES.items()}
+BAR_RESOLUTIONS_MS = (1000, 60_000, 300_000)  # ticks への挿入と同時に更新する足の幅 (1秒/1分/5分)
+BAR_KEY_SCALE = 100_000  # 足の始値・終値を決める約定の順序キー = time_ms × BAR_KEY_SCALE + seq
+BAR_COLUMNS = ('start_ms', 'open_x10', 'high_x10', 'low_x10', 'close_x10', 'volume', 'buy_volume', 'sell_volume', 'trades',
+               'notional_x10', 'price_sum_x10', 'price_sq_sum', 'open_key', 'close_key')
+# 約定代金の対数ビン (1%刻み)。ビン i は約定代金×PRICE_SCALE が [LOT_BIN_EDGES_X10[i], LOT_BIN_EDGES_X10[i+1]) の約定 (ビン0 は下限未満も含む)
+# 境界は SCHEMA の notional_bins と同じ順序の掛け算で作るので、DB側と分析側で同じ約定が同じビンに入る
+LOT_BIN_BASE, LOT_BIN_MIN_YEN, LOT_BIN_COUNT = 1.01, 100, 2600
+LOT_BIN_EDGES_X10 = (np.multiply.accumulate(np.r_[float(LOT_BIN_MIN_YEN * PRICE_SCALE), np.full(LOT_BIN_COUNT - 1, LOT_BIN_BASE)]) + 0.5).astype(np.int64)
+LOT_PROFILE_DAYS = 20  # ロットのしきい値を求めるときに合算する直近の取引日数
+TIME_SKEW_MS = 60_000  # 約定時刻と取り込み時刻 (PCの時計) のずれとして許す幅。これより先の時刻の約定は前の取引日のもの
+SESSION_GAP_MS = 3_600_000  # 約定時刻がこれ以上戻ったら、そこで取引日が変わったとみなす
+# 接続の役割ごとの PRAGMA。書き手 (収集スクリプト) は WAL + synchronous=NORMAL (アプリの異常終了では失われず、
+# 電源断でだけ直近のコミットを失いうる) 、読み手 (TUI・計算ステージ・分析サーバー) は読み取り専用で、どちらもページを mmap で読む
+WRITER_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -65536, 'temp_store': 'MEMORY',
+                  'mmap_size': 268435456, 'journal_size_limit': 67108864}
+READER_PRAGMAS = {'query_only': 1, 'cache_size': -32768, 'temp_store': 'MEMORY', 'mmap_size': 268435456}
+STATEMENT_CACHE_SIZE = 256  # 接続ごとに使い回すプリペアドステートメントの数 (SQL文字列が同じなら再利用される)
+
+def _bar_upsert(tick: str, source: str) -> str:
+    """約定 tick (列を持つ行の別名) を各幅の足に加える UPSERT 文。トリガーと足の作り直しで共用する。"""
+    resolutions = ' UNION ALL '.join(f'SELECT {r} AS resolution_ms' for r in BAR_RESOLUTIONS_MS)
+    key = f"{tick}.time_ms * {BAR_KEY_SCALE} + {tick}.seq"
+    return f"""
+    INSERT INTO bars (ticker_id, trade_date, resolution_ms, start_ms, open_key, open_x10, high_x10, low_x10, close_key, close_x10,
+                      volume, buy_volume, sell_volume, trades, notional_x10, price_sum_x10, price_sq_sum)
+    SELECT {tick}.ticker_id, {tick}.trade_date, r.resolution_ms, {tick}.time_ms - {tick}.time_ms % r.resolution_ms,
+           {key}, {tick}.price_x10, {tick}.price_x10, {tick}.price_x10, {key}, {tick}.price_x10, {tick}.volume,
+           CASE WHEN {tick}.side > 0 THEN {tick}.volume ELSE 0 END, CASE WHEN {tick}.side < 0 THEN {tick}.volume ELSE 0 END,
+           1, {tick}.price_x10 * {tick}.volume, {tick}.price_x10, {tick}.price_x10 * {tick}.price_x10 * 1.0
+    FROM {source} JOIN ({resolutions}) r WHERE true
+    ON CONFLICT (ticker_id, trade_date, resolution_ms, start_ms) DO UPDATE SET
+        open_x10 = CASE WHEN excluded.open_key < open_key THEN excluded.open_x10 ELSE open_x10 END, open_key = MIN(open_key, excluded.open_key),
+        close_x10 = CASE WHEN excluded.close_key > close_key THEN excluded.close_x10 ELSE close_x10 END, close_key = MAX(close_key, excluded.close_key),
+        high_x10 = MAX(high_x10, excluded.high_x10), low_x10 = MIN(low_x10, excluded.low_x10),
+        volume = volume + excluded.volume, buy_volume = buy_volume + excluded.buy_volume, sell_volume = sell_volume + excluded.sell_volume,
+        trades = trades + 1, notional_x10 = notional_x10 + excluded.notional_x10,
+        price_sum_x10 = price_sum_x10 + excluded.price_sum_x10, price_sq_sum = price_sq_sum + excluded.price_sq_sum;
+    """
+
+def _lot_profile_upsert(tick: str, source: str) -> str:
+    """約定 tick を銘柄・取引日ごとの約定代金ビンの件数に加える UPSERT 文。トリガーと作り直しで共用する。"""
+    return f"""
+    INSERT INTO lot_profile (ticker_id, trade_date, bin, trades)
+    SELECT {tick}.ticker_id, {tick}.trade_date,
+           COALESCE((SELECT b.bin FROM notional_bins b WHERE b.lower_x10 <= {tick}.price_x10 * {tick}.volume ORDER BY b.lower_x10 DESC LIMIT 1), 0), 1
+    FROM {source} WHERE true
+    ON CONFLICT (ticker_id, trade_date, bin) DO UPDATE SET trades = trades + excluded.trades;
+    """
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickers (
+    ticker_id INTEGER PRIMARY KEY,
+    code TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS ticks (
+    id INTEGER PRIMARY KEY,
+    ticker_id INTEGER NOT NULL,
+    trade_date INTEGER NOT NULL,  -- YYYYMMDD
+    time_ms INTEGER NOT NULL,     -- 0時からのミリ秒
+    price_x10 INTEGER NOT NULL,   -- 価格 × PRICE_SCALE
+    volume INTEGER NOT NULL,
+    side INTEGER NOT NULL,        -- 1=買い, -1=売り, 0=不明
+    seq INTEGER NOT NULL          -- 同じ銘柄・日付・時刻の中での通し番号 (同一内容の約定を区別する)
+);
+CREATE TABLE IF NOT EXISTS collector_sources (
+    name TEXT PRIMARY KEY,        -- 収集スクリプトの監視対象名 (sources.json の name)
+    ticker_code TEXT,             -- その監視対象に現在表示されている銘柄
+    updated_at REAL NOT NULL      -- 最後に銘柄を確認した時刻 (UNIXエポック秒)
+);
+CREATE TABLE IF NOT EXISTS bars (
+    ticker_id INTEGER NOT NULL,
+    trade_date INTEGER NOT NULL,
+    resolution_ms INTEGER NOT NULL,  -- 足の幅 (BAR_RESOLUTIONS_MS)
+    start_ms INTEGER NOT NULL,       -- 足の開始時刻 (0時からのミリ秒)
+    open_key INTEGER NOT NULL, open_x10 INTEGER NOT NULL, high_x10 INTEGER NOT NULL, low_x10 INTEGER NOT NULL,
+    close_key INTEGER NOT NULL, close_x10 INTEGER NOT NULL,
+    volume INTEGER NOT NULL, buy_volume INTEGER NOT NULL, sell_volume INTEGER NOT NULL, trades INTEGER NOT NULL,
+    notional_x10 INTEGER NOT NULL,   -- Σ price_x10 × volume (VWAP用)
+    price_sum_x10 INTEGER NOT NULL,  -- Σ price_x10 (約定ごとの価格の標準偏差用)
+    price_sq_sum REAL NOT NULL,      -- Σ price_x10²
+    PRIMARY KEY (ticker_id, trade_date, resolution_ms, start_ms)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ingest_batches (
+    last_id INTEGER PRIMARY KEY,     -- 1回の取り込みで挿入した最後の ticks.id (その銘柄の前回の last_id の次からここまでが同じ取り込みの行)
+    ticker_id INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    sheet_mtime REAL,                -- 読んだブックの更新時刻 (約定がシートに現れた時刻の近似)。以下すべてUNIXエポック秒
+    read_at REAL NOT NULL,           -- 収集スクリプトがブックを読み始めた時刻
+    ingested_at REAL NOT NULL        -- 行を挿入し終えた時刻 (同じトランザクションで記録する)
+);
+CREATE TABLE IF NOT EXISTS notional_bins (
+    lower_x10 INTEGER PRIMARY KEY,   -- ビンの下限 (約定代金 × PRICE_SCALE)
+    bin INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lot_profile (
+    ticker_id INTEGER NOT NULL,
+    trade_date INTEGER NOT NULL,
+    bin INTEGER NOT NULL,            -- 約定代金のビン (notional_bins.bin)
+    trades INTEGER NOT NULL,         -- そのビンに入った約定の件数
+    PRIMARY KEY (ticker_id, trade_date, bin)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bursts (
+    id INTEGER PRIMARY KEY,
+    ticker_id INTEGER NOT NULL,
+    trade_date INTEGER NOT NULL,
+    time_ms INTEGER NOT NULL,        -- バーストを検知した秒の開始時刻 (約定時刻、0時からのミリ秒)
+    side INTEGER NOT NULL,           -- 1=買い, -1=売り, 0=偏りなし
+    trades INTEGER NOT NULL,         -- その秒の約定件数 (検知した時点まで)
+    volume INTEGER NOT NULL,
+    buy_ratio REAL NOT NULL,         -- その秒の出来高に占める買いの比率
+    score REAL NOT NULL,             -- 基準 (EWMA) から標準偏差の何倍多いか
+    detected_at REAL NOT NULL        -- 収集スクリプトが検知した時刻 (UNIXエポック秒)
+);
+WITH RECURSIVE e(bin, lower) AS (""" + f"SELECT 0, {LOT_BIN_MIN_YEN * PRICE_SCALE}.0 UNION ALL SELECT bin + 1, lower * {LOT_BIN_BASE} FROM e WHERE bin + 1 < {LOT_BIN_COUNT}" + """)
+    INSERT OR IGNORE INTO notional_bins (lower_x10, bin) SELECT CAST(lower + 0.5 AS INTEGER), bin FROM e;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ticks_key ON ticks (ticker_id, trade_date, time_ms, seq);
+CREATE INDEX IF NOT EXISTS idx_ticks_ticker_id ON ticks (ticker_id, id);
+CREATE INDEX IF NOT EXISTS idx_bursts_ticker_id ON bursts (ticker_id, id);
+-- 足は約定の挿入と同じトランザクションで更新する (INSERT OR IGNORE で無視された行では発火しない)
+CREATE TRIGGER IF NOT EXISTS trg_ticks_bars AFTER INSERT ON ticks BEGIN""" + _bar_upsert('NEW', '(SELECT 1)') + """END;
+-- ロット判定用の約定代金の分布。アーカイブで ticks から消した日の分も残す
+CREATE TRIGGER IF NOT EXISTS trg_ticks_lot_profile AFTER INSERT ON ticks BEGIN""" + _lot_profile_upsert('NEW', '(SELECT 1)') + """END;
+CREATE VIEW IF NOT EXISTS ayumi AS
+    SELECT t.id, k.code AS ticker_code, t.trade_date,
+           printf('%02d:%02d:%02d', t.time_ms / 3600000, t.time_ms / 60000 % 60, t.time_ms / 1000 % 60) AS jikoku,
+           t.price_x10 * 1.0 / 10 AS price, t.volume AS dekidaka,
+           CASE t.side WHEN 1 THEN '買い' WHEN -1 THEN '売り' ELSE '不明' END AS baibai
+    FROM ticks t JOIN tickers k ON k.ticker_id = t.ticker_id;
+"""
+
+def _legacy_source(conn) -> str | None:
+    """
+    移行元のテーブル名を返す。移行前の ayumi テーブル (ビューではなく実テーブル) が残っていれば 'ayumi'、
+    ayumi_legacy に改名した後で移行が途中で止まっている (legacy_migration が残っている) なら 'ayumi_legacy'、どちらでもなければ None。
+    """
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('ayumi', 'ayumi_legacy', 'legacy_migration')")}
+    if 'ayumi' in tables: return 'ayumi'
+    if {'ayumi_legacy', 'legacy_migration'} <= tables: return 'ayumi_legacy'
+    return None
+
+def has_legacy_table(conn) -> bool:
+    """旧 ayumi テーブルからの移行が必要か (移行前、または途中で止まった移行が残っている)。"""
+    return _legacy_source(conn) is not None
+
+def connect(path: str, role: str = 'writer', timeout: float = 10.0, **kwargs) -> sqlite3.Connection:
+    """役割 ('writer' / 'reader') に合わせた PRAGMA で接続する。reader は mode=ro で開く。kwargs は sqlite3.connect にそのまま渡す。"""
+    if role == 'reader':
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=timeout, cached_statements=STATEMENT_CACHE_SIZE, **kwargs)
+    else:
+        conn = sqlite3.connect(path, timeout=timeout, cached_statements=STATEMENT_CACHE_SIZE, **kwargs)
+        if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # 新しいDB。WAL に切り替える前でないと変えられない
+    for name, value in (READER_PRAGMAS if role == 'reader' else WRITER_PRAGMAS).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+def setup_database(conn):
+    """データベースとテーブル、インデックスをセットアップする。新しく作るDBは、消した行の領域を少しずつ返せる (incremental_vacuum) ようにする。"""
+    if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # テーブルを作る前 (かつ WAL に切り替える前) にしか変えられない
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.executescript(SCHEMA)
+    with conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION and not has_legacy_table(conn):
+            if version == 2:
+                print("足 (bars) を保存済みの約定から作成しています...")
+                rebuild_bars(conn)
+            if version in (2, 3):
+                print("ロット判定用の約定代金の分布 (lot_profile) を保存済みの約定から作成しています...")
+                rebuild_lot_profile(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    if has_legacy_table(conn):
+        print("注意: 旧形式の ayumi テーブル (または途中で止まった移行) が残っています。'python ayumidb.py --migrate <DBパス>' で移行してください。")
+
+def rebuild_bars(conn) -> None:
+    """足を ticks から作り直す (バージョン2からの移行時や、足の幅を変えたとき)。トランザクションは呼び出し側で管理する。"""
+    conn.execute("DELETE FROM bars")
+    conn.execute(_bar_upsert('t', 'ticks t'))
+
+def rebuild_lot_profile(conn) -> None:
+    """ticks にある銘柄・取引日の約定代金の分布を作り直す。アーカイブ済みで ticks にない日の分はそのまま残す。"""
+    conn.execute("DELETE FROM lot_profile WHERE (ticker_id, trade_date) IN (SELECT DISTINCT ticker_id, trade_date FROM ticks)")
+    conn.execute(_lot_profile_upsert('t', 'ticks t'))
+
+def load_lot_profile(conn, ticker_id: int, until_date: int, days: int = LOT_PROFILE_DAYS) -> np.ndarray:
+    """until_date (YYYYMMDD) 以前で記録のある直近 days 取引日分を合算した、約定代金ビンごとの約定件数 (長さ LOT_BIN_COUNT) を返す。"""
+    rows = conn.execute(
+        "SELECT bin, SUM(trades) FROM lot_profile WHERE ticker_id = ? AND trade_date IN "
+        "(SELECT DISTINCT trade_date FROM lot_profile WHERE ticker_id = ? AND trade_date <= ? ORDER BY trade_date DESC LIMIT ?) GROUP BY bin",
+        (ticker_id, ticker_id, until_date, days)
+    ).fetchall()
+    counts = np.zeros(LOT_BIN_COUNT, dtype=np.int64)
+    if rows:
+        bins, trades = np.array(rows, dtype=np.int64).T
+        counts[bins] = trades
+    return counts
+
+def load_ingest_batches(conn, ticker_id: int, first_id: int, last_id: int) -> list:
+    """最後の行の id が first_id 以上 last_id 以下の取り込みの (last_id, rows, sheet_mtime, read_at, ingested_at) を古い順に返す。"""
+    return conn.execute(
+        "SELECT last_id, rows, sheet_mtime, read_at, ingested_at FROM ingest_batches WHERE last_id BETWEEN ? AND ? AND ticker_id = ? ORDER BY last_id",
+        (first_id, last_id, ticker_id)
+    ).fetchall()
+
+def load_bursts(conn, ticker_id: int, after_id: int) -> list:
+    """id が after_id より後のバーストの (id, trade_date, time_ms, side, trades, volume, buy_ratio, score, detected_at) を古い順に返す。"""
+    return conn.execute(
+        "SELECT id, trade_date, time_ms, side, trades, volume, buy_ratio, score, detected_at FROM bursts WHERE ticker_id = ? AND id > ? ORDER BY id",
+        (ticker_id, after_id)
+    ).fetchall()
+
+def load_bars(conn, ticker_id: int, trade_date: int, resolution_ms: int, start_ms: int = 0, end_ms: int | None = None) -> dict:
+    """1銘柄・1日の足を開始時刻順に {列名: int64/float64 配列} (BAR_COLUMNS) で返す。start_ms 以上 end_ms 未満に絞れる。"""
+    rows = conn.execute(
+        f"SELECT {', '.join(BAR_COLUMNS)} FROM bars WHERE ticker_id = ? AND trade_date = ? AND resolution_ms = ? AND start_ms >= ? AND start_ms < ? ORDER BY start_ms",
+        (ticker_id, trade_date, resolution_ms, start_ms, end_ms if end_ms is not None else 86_400_000)
+    ).fetchall()
+    values = np.array(rows, dtype=np.float64).reshape(-1, len(BAR_COLUMNS))
+    return {name: values[:, i] if name == 'price_sq_sum' else values[:, i].astype(np.int64) for i, name in enumerate(BAR_COLUMNS)}
+
+# --- 値の変換 ---
+def encode_jikoku(jikoku: str) -> int | None:
+    """'HH:MM:SS' (小数秒も可) を0時からのミリ秒にする。解釈できなければ None。"""
+    try:
+        h, m, s = jikoku.split(':')
+        return (int(h) * 3600 + int(m) * 60) * 1000 + round(float(s) * 1000)
+    except (AttributeError, ValueError):
+        return None
+
+def decode_jikoku(time_ms: int) -> str:
+    return f"{time_ms // 3_600_000:02d}:{time_ms // 60_000 % 60:02d}:{time_ms // 1000 % 60:02d}"
+
+def encode_price(price: float) -> int:
+    return round(price * PRICE_SCALE)
+
+def date_to_int(d: date) -> int:
+    return d.year * 10000 + d.month * 100 + d.day
+
+def int_to_date(value: int) -> date:
+    return date(value // 10000, value // 100 % 100, value % 100)
+
+def to_epoch_ns(trade_date: np.ndarray, time_ms: np.ndarray) -> np.ndarray:
+    """trade_date (YYYYMMDD) と time_ms の配列から、イベント時刻 (エポックからのナノ秒, int64) を作る。"""
+    dates, inverse = np.unique(trade_date, return_inverse=True)
+    base = np.array([np.datetime64(int_to_date(int(d)), 'ns').astype(np.int64) for d in dates], dtype=np.int64)
+    return base[inverse] + time_ms.astype(np.int64) * 1_000_000
+
+def trade_dates_for(time_ms: np.ndarray, now: datetime | None = None, last_date: int | None = None) -> np.ndarray:
+    """
+    時系列順に並んだ新しい約定 (time_ms の配列) の取引日を決める。基本は取り込み時刻 now の日付。
+    ただし寄り付き前などシートに前の取引日の歩み値が残っている間は、新しい取引日の最初の約定が現れるまで前の取引日のままにする:
+    now より先の時刻 (時計のずれは TIME_SKEW_MS まで許す) の約定は今日のものではありえないので前の取引日のもので、
+    それより前に並ぶ約定と、時刻が SESSION_GAP_MS 以上戻る位置 (取引日の切れ目) より前の約定も同じ取引日とする。
+    前の取引日は、last_date (同じ銘柄でDBにある最新の取引日) が今日より前ならその日、なければ前の営業日。
+    """
+    now = now or datetime.now()
+    now_ms, today = (now.hour * 3600 + now.minute * 60 + now.second) * 1000, date_to_int(now.date())
+    dates = np.full(len(time_ms), today, dtype=np.int64)
+    future, back = np.flatnonzero(time_ms > now_ms + TIME_SKEW_MS), np.flatnonzero(np.diff(time_ms) < -SESSION_GAP_MS)
+    last_previous = max(future[-1] if len(future) else -1, back[-1] if len(back) else -1)
+    if last_previous >= 0:
+        dates[:last_previous + 1] = last_date if last_date and last_date < today else date_to_int(_previous_business_day(now.date()))
+    return dates
+
+class TickerDirectory:
+    """銘柄コード <-> ticker_id の対応をキャッシュする。"""
+    def __init__(self):
+        self._ids = {}
+
+    def get(self, conn, code: str, create: bool = False) -> int | None:
+        if code in self._ids: return self._ids[code]
+        row = conn.execute("SELECT ticker_id FROM tickers WHERE code = ?", (code,)).fetchone()
+        if row is None and create:
+            conn.execute("INSERT OR IGNORE INTO tickers (code) VALUES (?)", (code,))
+            row = conn.execute("SELECT ticker_id FROM tickers WHERE code = ?", (code,)).fetchone()
+        if row is not None: self._ids[code] = row[0]
+        return row[0] if row else None
+
+# --- 旧スキーマからの移行 ---
+def _previous_business_day(d: date) -> date:
+    d -= timedelta(days=1)
+    while d.weekday() >= 5: d -= timedelta(days=1)
+    return d
+
+def migrate_legacy(conn, last_date: date | None = None, fixed_date: date | None = None, rollover_ms: int = 3_600_000, chunk: int = 50_000, drop_legacy: bool = True) -> int:
+    """
+    旧 ayumi テーブル (ticker_code, jikoku TEXT, price REAL, dekidaka, baibai TEXT) を ticks へ移す。
+    旧形式には日付がないため、銘柄ごとに id 順で時刻が rollover_ms 以上巻き戻った箇所を日付の切り替わりとみなし、
+    最後の日を last_date (省略時はDBファイルの更新日) として営業日(土日を除く)単位で遡って日付を割り当てる。
+    fixed_date を指定した場合は全行をその日付とする。移行した行数を返す。
+    行は INSERT OR IGNORE で入れ、日付と seq は旧テーブルの id 順から決まるので、途中で止まった移行は ayumi_legacy から最初からやり直せる。
+    日付の割り当てが変わらないよう、最初の実行時の last_date / fixed_date を legacy_migration に記録し、再開時はそちらを使う。
+    """
+    source = _legacy_source(conn)
+    if source is None: return 0
+    # 改名より先に記録する (legacy_migration があるうちは移行の途中とみなす)
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS legacy_migration (last_date INTEGER NOT NULL, fixed_date INTEGER)")
+        saved = conn.execute("SELECT last_date, fixed_date FROM legacy_migration").fetchone()
+        if saved:
+            last_date, fixed_date = int_to_date(saved[0]), int_to_date(saved[1]) if saved[1] else None
+        else:
+            last_date = last_date or date.today()
+            conn.execute("INSERT INTO legacy_migration (last_date, fixed_date) VALUES (?, ?)", (date_to_int(last_date), date_to_int(fixed_date) if fixed_date else None))
+    if source == 'ayumi':
+        conn.execute("ALTER TABLE ayumi RENAME TO ayumi_legacy")
+        conn.execute("DROP INDEX IF EXISTS idx_ticker_id")
+        conn.executescript(SCHEMA)
+    # 1回目の走査: 銘柄ごとの日付の切り替わり回数を数える
+    rollovers, last_time = {}, {}
+    for code, jikoku in conn.execute("SELECT ticker_code, jikoku FROM ayumi_legacy ORDER BY id"):
+        t = encode_jikoku(jikoku)
+        if t is None: continue
+        if code in last_time and t < last_time[code] - rollover_ms: rollovers[code] = rollovers.get(code, 0) + 1
+        last_time[code] = t
+    # 2回目の走査: 日付を割り当てながら書き込む
+    directory, state, migrated, batch = TickerDirectory(), {}, 0, []
+    for code, jikoku, price, dekidaka, baibai in conn.cursor().execute("SELECT ticker_code, jikoku, price, dekidaka, baibai FROM ayumi_legacy ORDER BY id"):
+        t = encode_jikoku(jikoku)
+        if t is None: continue
+        if code not in state:
+            d = last_date
+            for _ in range(rollovers.get(code, 0)): d = _previous_business_day(d)
+            state[code] = {'date': d, 'last_time': t, 'seen': {}}
+        st = state[code]
+        if fixed_date is None and t < st['last_time'] - rollover_ms:
+            d = st['date'] + timedelta(days=1)
+            while d.weekday() >= 5: d += timedelta(days=1)
+            st['date'] = d; st['seen'] = {}
+        st['last_time'] = t
+        trade_date = date_to_int(fixed_date or st['date'])
+        # 旧データは取り込み単位ごとに新しい順で並んでいることがあるため、同じ時刻の件数を日ごとに数えて seq とする
+        seq = st['seen'].get(t, 0); st['seen'][t] = seq + 1
+        batch.append((directory.get(conn, code, create=True), trade_date, t, encode_price(price), int(dekidaka), DIRECTION_CODES.get(baibai, 0), seq))
+        if len(batch) >= chunk:
+            migrated += _flush(conn, batch); batch = []
+    migrated += _flush(conn, batch)
+    with conn:
+        if drop_legacy: conn.execute("DROP TABLE ayumi_legacy")
+        conn.execute("DROP TABLE legacy_migration")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return migrated
+
+def _flush(conn, batch: list) -> int:
+    if not batch: return 0
+    with conn:
+        cursor = conn.executemany("INSERT OR IGNORE INTO ticks (ticker_id, trade_date, time_ms, price_x10, volume, side, seq) VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+    return cursor.rowcount
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="market_data.db を新しいスキーマへ移行する")
+    parser.add_argument('--migrate', metavar='DB_PATH', required=True)
+    parser.add_argument('--last-date', help="旧データの最終日 (YYYY-MM-DD)。省略時はDBファイルの更新日")
+    parser.add_argument('--date', help="全行に割り当てる日付 (YYYY-MM-DD)。1日分のDBの場合に使う")
+    parser.add_argument('--keep-legacy', action='store_true', help="旧テーブルを ayumi_legacy として残す")
+    parser.add_argument('--no-vacuum', action='store_true', help="移行後の VACUUM を行わない")
+    args = parser.parse_args()
+    if not os.path.exists(args.migrate):
+        print(f"エラー: DBファイルが見つかりません: {args.migrate}"); sys.exit(1)
+    last_date = datetime.strptime(args.last_date, '%Y-%m-%d').date() if args.last_date else datetime.fromtimestamp(os.path.getmtime(args.migrate)).date()
+    fixed_date = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else None
+    size_before = os.path.getsize(args.migrate)
+    conn = sqlite3.connect(args.migrate, timeout=10.0)
+    try:
+        source = _legacy_source(conn)
+        if source is None:
+            print("旧形式の ayumi テーブルはありません。移行は不要です。"); sys.exit(0)
+        if source == 'ayumi_legacy':
+            print(f"途中で止まった移行を ayumi_legacy から再開します (日付は前回の指定のまま): {args.migrate}")
+        else:
+            print(f"移行を開始します: {args.migrate}")
+        count = migrate_legacy(conn, last_date=last_date, fixed_date=fixed_date, drop_legacy=not args.keep_legacy)
+        print(f"{count:,} 件を移行しました。")
+        if not args.no_vacuum and not args.keep_legacy:
+            print("VACUUM を実行しています...")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)"); conn.execute("VACUUM")
+    finally:
+        conn.close()
+    print(f"ファイルサイズ: {size_before / 1024 / 1024:,.1f}MB -> {os.path.getsize(args.migrate) / 1024 / 1024:,.1f}MB")
@@ -0,0 +1,136 @@
+# coding: utf-8
+"""
+処理段階ごとの所要時間・遅延の計測。収集スクリプトとTUIが、それぞれのプロセス内で StageTimings に記録する。
+各段階の直近 WINDOW 件を保持し、分位点 (p50/p95/p99) をその場で求める。
+結果は Prometheus のテキスト形式で、ローカルのファイル (node_exporter の textfile collector でも読める) か
+localhost のHTTPエンドポイント (/metrics) に書き出す。
+
+    timings = StageTimings()
+    with timings.time('read'): ...
+    timings.record('sheet_to_screen', 0.42)
+"""
+import os
+import re
+import time
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+METRICS_DIR = 'c:/ayumi/metrics'
+WINDOW = 1000                      # 段階ごとに保持する直近の計測数
+QUANTILES = (0.5, 0.95, 0.99)
+EXPORT_INTERVAL_SEC = 10
+
+class _Timer:
+    __slots__ = ('timings', 'stage', 'started')
+    def __init__(self, timings, stage: str):
+        self.timings, self.stage = timings, stage
+    def __enter__(self):
+        self.started = time.perf_counter(); return self
+    def __exit__(self, *exc):
+        self.timings.record(self.stage, time.perf_counter() - self.started)
+
+class StageTimings:
+    """段階名 -> 直近の所要時間 (秒) 。記録と集計は別スレッドから呼んでよい。"""
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self._samples = {}   # 段階名 -> deque (記録順)
+        self._totals = {}    # 段階名 -> [件数, 合計秒] (起動からの累計)
+        self._lock = threading.Lock()
+
+    def time(self, stage: str) -> _Timer:
+        """with 文の間の経過時間を stage に記録する。"""
+        return _Timer(self, stage)
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage not in self._samples: self._samples[stage] = deque(maxlen=self.window); self._totals[stage] = [0, 0.0]
+            self._samples[stage].append(seconds); total = self._totals[stage]; total[0] += 1; total[1] += seconds
+
+    def summary(self) -> dict:
+        """{段階名: {'count', 'sum', 'last', 'max', 0.5, 0.95, 0.99}} (分位点・最大は直近 window 件、件数・合計は累計)。"""
+        with self._lock:
+            samples = {stage: np.fromiter(values, dtype=float, count=len(values)) for stage, values in self._samples.items()}
+            totals = {stage: tuple(total) for stage, total in self._totals.items()}
+        result = {}
+        for stage, values in samples.items():
+            q = np.quantile(values, QUANTILES) if len(values) else [float('nan')] * len(QUANTILES)
+            result[stage] = {'count': totals[stage][0], 'sum': totals[stage][1], 'last': values[-1], 'max': values.max(), **dict(zip(QUANTILES, q))}
+        return result
+
+def prometheus_text(timings: StageTimings, component: str) -> str:
+    """summary 型のメトリクス ayumi_stage_seconds{component, stage, quantile} として書き出す。"""
+    lines = ['# HELP ayumi_stage_seconds 処理段階ごとの所要時間・遅延 (秒)', '# TYPE ayumi_stage_seconds summary']
+    for stage, s in sorted(timings.summary().items()):
+        labels = f'component="{component}",stage="{stage}"'
+        lines += [f'ayumi_stage_seconds{{{labels},quantile="{q}"}} {s[q]:.6f}' for q in QUANTILES]
+        lines += [f'ayumi_stage_seconds_sum{{{labels}}} {s["sum"]:.6f}', f'ayumi_stage_seconds_count{{{labels}}} {s["count"]}']
+    return '\n'.join(lines) + '\n'
+
+_SAMPLE = re.compile(r'^ayumi_stage_seconds(_sum|_count)?\{([^}]*)\} (\S+)$')
+_LABEL = re.compile(r'(\w+)="([^"]*)"')
+
+def read_prometheus_file(path: str) -> dict:
+    """prometheus_text で書き出したファイルを {段階名: {'count', 'sum', 0.5, 0.95, 0.99}} に読み戻す。ファイルがなければ空。"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    result = {}
+    for line in lines:
+        m = _SAMPLE.match(line)
+        if not m: continue
+        labels = dict(_LABEL.findall(m.group(2)))
+        key = m.group(1)[1:] if m.group(1) else float(labels.get('quantile', 'nan'))
+        result.setdefault(labels.get('stage'), {})[key] = float(m.group(3))
+    return result
+
+class MetricsExporter:
+    """
+    StageTimings を Prometheus のテキスト形式で書き出す。
+    path があれば maybe_write のたびに (interval 秒おきに) ファイルを置き換え、port があれば 127.0.0.1:port/metrics で返す。
+    """
+    def __init__(self, timings: StageTimings, component: str, path: str | None = None, port: int | None = None, interval: float = EXPORT_INTERVAL_SEC):
+        self.timings, self.component, self.path, self.interval = timings, component, path, interval
+        self.written_at = 0.0
+        self.server = None
+        if port: self._serve(port)
+
+    def _serve(self, port: int) -> None:
+        exporter = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404); return
+                body = prometheus_text(exporter.timings, exporter.component).encode('utf-8')
+                self.send_response(200); self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body))); self.end_headers(); self.wfile.write(body)
+            def log_message(self, *args):
+                pass  # アクセスごとの標準エラー出力は不要
+        try:
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        except OSError as e:
+            print(f"メトリクスのエンドポイントを開けません (ポート {port}): {e}"); return
+        threading.Thread(target=self.server.serve_forever, name='ayumi-metrics', daemon=True).start()
+
+    def write(self) -> None:
+        """一時ファイルに書いてから置き換える (読み手が書きかけのファイルを見ないように)。"""
+        if not self.path: return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(prometheus_text(self.timings, self.component))
+        os.replace(tmp, self.path)
+        self.written_at = time.monotonic()
+
+    def maybe_write(self) -> None:
+        if self.path and time.monotonic() - self.written_at >= self.interval:
+            try:
+                self.write()
+            except OSError as e:
+                print(f"メトリクスを書き出せません: {e}"); self.written_at = time.monotonic()
+
+    def close(self) -> None:
+        if self.server: self.server.shutdown(); self.server.server_close(); self.server = None
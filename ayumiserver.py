@@ -0,0 +1,339 @@
+# coding: utf-8
+"""
+ヘッドレスの分析サーバー。銘柄ごとに取得と分析を1回だけ行い、結果 (summary と直近の約定) を
+ローカルのHTTP/WebSocketで複数のクライアント (TUI以外の端末・スクリプト) に配る。
+クライアントごとにSQLiteを読み直して analyze をやり直す必要がなくなる。Textual・win32com には依存しないので Linux でも動く。
+
+    python ayumiserver.py --db c:/ayumi/market_data.db            # 収集スクリプトが監視中の銘柄を配信
+    python ayumiserver.py --tickers 7203 9984 --collect            # 収集も同じプロセスで行う (Excel が必要)
+    python ayumiserver.py --watch 7203                             # 配信中のサーバーに繋いでシグナルを表示
+
+エンドポイント (既定 http://127.0.0.1:47380):
+    GET /tickers                         配信中の銘柄と最終id
+    GET /snapshot/<銘柄>?rows=N&format=json|msgpack   最新の結果 (msgpack は msgpack パッケージがあるときだけ)
+    GET /stream/<銘柄>?rows=N            新しい結果が出るたびに送る Server-Sent Events
+    GET /ws/<銘柄>?rows=N&format=...     同じ内容を WebSocket で (json はテキスト、msgpack はバイナリのフレーム)
+    GET /metrics                         取得・分析の所要時間 (Prometheus テキスト形式)
+"""
+import os
+import sys
+import json
+import time
+import base64
+import struct
+import asyncio
+import hashlib
+import sqlite3
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from ayumianalysis import AnalysisStage, snapshot_payload
+from ayumichannel import subscribe
+from ayumidb import connect, TickerDirectory
+from burstdetector import BurstEvent, describe
+from tickbuffer import TickRingBuffer
+from ayumimetrics import StageTimings, prometheus_text
+
+DB_PATH = 'c:/ayumi/market_data.db'
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 47380
+DEFAULT_ROWS = 200          # 1回の結果に載せる直近の約定の件数 (クライアントは rows= でこれ以下に絞れる)
+POLL_INTERVAL_SEC = 0.5     # 新着通知を受けられないときに読みに行く間隔
+FALLBACK_POLL_SEC = 5.0     # 新着通知を受けているときの取りこぼし対策のポーリング間隔
+TICKER_REFRESH_SEC = 5.0    # collector_sources (収集スクリプトが監視中の銘柄) を読み直す間隔
+STREAM_QUEUE_SIZE = 4       # 遅いクライアントには古い結果を捨てて最新だけを送る
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+def _load_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+def trim_payload(payload: dict, rows: int) -> dict:
+    """約定の列を直近 rows 件に絞った写しを返す (元の payload は共有しているので書き換えない)。"""
+    ticks = payload.get('ticks')
+    if ticks is None or rows >= len(ticks['id']): return payload
+    return {**payload, 'ticks': {name: values[len(values) - rows:] if rows > 0 else [] for name, values in ticks.items()}}
+
+def encode_payload(payload: dict, fmt: str) -> bytes:
+    if fmt == 'msgpack': return _load_msgpack().packb(payload, use_bin_type=True)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class TickerFeed:
+    """1銘柄分の計算ステージと最新の結果。更新の依頼は同時に1件までにまとめ、結果を購読中のキューへ配る。"""
+    def __init__(self, code: str, db_path: str, rows: int, timings: StageTimings, state_dir: str | None = None):
+        self.code, self.rows = code, rows
+        self.stage = AnalysisStage(db_path, log_rows=rows, timings=timings, state_dir=state_dir)
+        self.ticks = TickRingBuffer(max(rows, 1))  # 計算ステージから届いた新しい行を続けた直近 rows 件
+        self.payload = None
+        self.last_id = 0
+        self.updated_at = None
+        self.listeners = set()
+        self.running = False
+        self.pending = False
+
+    def request(self) -> None:
+        """更新を依頼する。実行中なら終わった後にもう1回だけ走らせる (通知が続いても依頼は溜まらない)。"""
+        if self.running: self.pending = True; return
+        self.running = True
+        asyncio.ensure_future(self._refresh())
+
+    async def _refresh(self) -> None:
+        try:
+            while True:
+                self.pending = False
+                snapshot = await asyncio.wrap_future(self.stage.submit(self.code, 0))
+                if snapshot.ticks is not None: self.ticks.extend(snapshot.ticks)
+                if snapshot.error: print(f"[{self.code}] 取得エラー: {snapshot.error}")
+                # 新しい約定がなければ、キャッシュされた同じ結果を配り直さない (新しい購読者には listen で最新の結果を渡す)
+                elif snapshot.summary is not None and (snapshot.new_count > 0 or snapshot.last_id != self.last_id or self.payload is None): self._publish(snapshot)
+                if not self.pending: break
+        finally:
+            self.running = False
+
+    def _publish(self, snapshot) -> None:
+        self.payload = snapshot_payload(snapshot._replace(ticks=self.ticks), self.rows)
+        self.last_id, self.updated_at = snapshot.last_id, time.time()
+        for queue in self.listeners:
+            if queue.full(): queue.get_nowait()
+            queue.put_nowait(self.payload)
+
+    def listen(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        if self.payload is not None: queue.put_nowait(self.payload)
+        self.listeners.add(queue)
+        return queue
+
+    def close(self) -> None:
+        self.stage.close()
+
+class AnalysisServer:
+    """
+    銘柄ごとの TickerFeed を持ち、新着通知 (ayumichannel) とポーリングで更新して HTTP/WebSocket で返す。
+    配信する銘柄は tickers で固定するか、省略時は collector_sources から読み、リクエストされた銘柄も都度加える。
+    state_dir を指定すると、銘柄ごとの分析状態をそこに書き出し、再起動時はその続きから分析する (AnalysisStage)。
+    """
+    def __init__(self, db_path: str = DB_PATH, tickers: list | None = None, rows: int = DEFAULT_ROWS, state_dir: str | None = None):
+        self.db_path, self.fixed_tickers, self.rows, self.state_dir = db_path, tickers, rows, state_dir
+        self.timings = StageTimings()
+        self.feeds = {}
+        self.channel = None
+        self.server = None
+
+    def feed(self, code: str) -> TickerFeed:
+        if code not in self.feeds:
+            self.feeds[code] = TickerFeed(code, self.db_path, self.rows, self.timings, self.state_dir)
+            self.feeds[code].request()
+            print(f"[{code}] 配信を開始します。")
+        return self.feeds[code]
+
+    def _ticker_exists(self, code: str) -> bool:
+        """code がDBの銘柄表にあるか。任意のパスで計算ステージ (スレッドとDB接続) を作らないように、配信を始める前に確かめる。"""
+        try:
+            conn = connect(self.db_path, 'reader')
+        except sqlite3.Error:
+            return False
+        try:
+            return TickerDirectory().get(conn, code) is not None
+        except sqlite3.Error:
+            return False
+        finally:
+            conn.close()
+
+    def _collector_tickers(self) -> list:
+        try:
+            conn = connect(self.db_path, 'reader')
+        except sqlite3.Error:
+            return []
+        try:
+            return [row[0] for row in conn.execute("SELECT DISTINCT ticker_code FROM collector_sources WHERE ticker_code IS NOT NULL")]
+        except sqlite3.Error:
+            return []  # 収集スクリプトがまだDBを作っていない
+        finally:
+            conn.close()
+
+    def on_ticks_published(self, ticker_code: str, last_id: int) -> None:
+        feed = self.feeds.get(ticker_code)
+        if feed is not None and last_id > feed.last_id: feed.request()
+        elif feed is None and self.fixed_tickers is None: self.feed(ticker_code)
+
+    async def _poll(self) -> None:
+        listed_at = 0.0
+        while True:
+            if self.fixed_tickers is None and time.monotonic() - listed_at >= TICKER_REFRESH_SEC:
+                listed_at = time.monotonic()
+                for code in await asyncio.to_thread(self._collector_tickers): self.feed(code)
+            for feed in list(self.feeds.values()): feed.request()
+            await asyncio.sleep(FALLBACK_POLL_SEC if self.channel else POLL_INTERVAL_SEC)
+
+    async def start(self, host: str = SERVER_HOST, port: int = SERVER_PORT) -> None:
+        for code in self.fixed_tickers or (): self.feed(code)
+        try:
+            self.channel = await subscribe(self.on_ticks_published)
+        except OSError as e:
+            print(f"新着通知を受けられません (受け手が多すぎるなど): {e}。{POLL_INTERVAL_SEC}秒ごとに読みに行きます。")
+        self.server = await asyncio.start_server(self._handle, host, port)
+        print(f"分析サーバーを開始しました: http://{host}:{port}/ (DB: {self.db_path})")
+        asyncio.ensure_future(self._poll())
+
+    def close(self) -> None:
+        if self.channel: self.channel.close()
+        if self.server: self.server.close()
+        for feed in self.feeds.values(): feed.close()
+
+    # --- HTTP ---
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            lines = request.decode('latin-1').split('\r\n')
+            method, target = lines[0].split(' ')[:2]
+            headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(':') for line in lines[1:] if line)}
+            url = urlsplit(target)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            parts = [p for p in url.path.split('/') if p]
+            if method != 'GET': await self._respond(writer, 405, b'method not allowed'); return
+            if parts == ['tickers']:
+                body = {code: {'last_id': f.last_id, 'updated_at': f.updated_at} for code, f in sorted(self.feeds.items())}
+                await self._respond(writer, 200, encode_payload(body, 'json'), 'application/json'); return
+            if parts == ['metrics']:
+                await self._respond(writer, 200, prometheus_text(self.timings, 'server').encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'); return
+            if len(parts) != 2 or parts[0] not in ('snapshot', 'stream', 'ws'):
+                await self._respond(writer, 404, b'not found'); return
+            fmt, rows = query.get('format', 'json'), query.get('rows', str(self.rows))
+            if not rows.isascii() or not rows.isdigit():
+                await self._respond(writer, 400, f'bad rows {rows}'.encode('utf-8')); return
+            rows = int(rows)
+            if fmt not in ('json', 'msgpack') or (fmt == 'msgpack' and _load_msgpack() is None):
+                await self._respond(writer, 406, f'format {fmt} is not available'.encode('utf-8')); return
+            if parts[1] not in self.feeds and not await asyncio.to_thread(self._ticker_exists, parts[1]):
+                await self._respond(writer, 404, f'unknown ticker {parts[1]}'.encode('utf-8')); return
+            feed = self.feed(parts[1])
+            if parts[0] == 'snapshot':
+                if feed.payload is None: await self._respond(writer, 503, b'no data yet'); return
+                content_type = 'application/msgpack' if fmt == 'msgpack' else 'application/json'
+                await self._respond(writer, 200, encode_payload(trim_payload(feed.payload, rows), fmt), content_type)
+            elif parts[0] == 'stream':
+                await self._stream_sse(reader, writer, feed, rows)
+            elif headers.get('upgrade', '').lower() == 'websocket' and 'sec-websocket-key' in headers:
+                await self._stream_websocket(reader, writer, feed, rows, fmt, headers['sec-websocket-key'])
+            else:
+                await self._respond(writer, 400, b'websocket upgrade required')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass  # 途中で切断された・壊れたリクエスト
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status: int, body: bytes, content_type: str = 'text/plain; charset=utf-8') -> None:
+        writer.write(f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\nContent-Type: {content_type}\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+    async def _stream_sse(self, reader, writer, feed: TickerFeed, rows: int) -> None:
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n')
+        await writer.drain()
+        frame = lambda payload: b'event: snapshot\ndata: ' + encode_payload(trim_payload(payload, rows), 'json') + b'\n\n'
+        await self._forward(writer, feed, reader.read(), frame)  # クライアントは何も送らないので、読み終わり = 切断
+
+    async def _stream_websocket(self, reader, writer, feed: TickerFeed, rows: int, fmt: str, key: str) -> None:
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('latin-1')).digest()).decode('latin-1')
+        writer.write(f'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n'.encode('latin-1'))
+        await writer.drain()
+        opcode = 0x2 if fmt == 'msgpack' else 0x1
+        await self._forward(writer, feed, _ws_wait_close(reader, writer), lambda payload: ws_frame(opcode, encode_payload(trim_payload(payload, rows), fmt)))
+
+    async def _forward(self, writer, feed: TickerFeed, closing, frame) -> None:
+        """feed の新しい結果を frame で包んで送り続ける。closing (クライアントの切断待ち) が終わったらやめる。"""
+        queue = feed.listen()
+        closed = asyncio.ensure_future(closing)
+        try:
+            while True:
+                get = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait((get, closed), return_when=asyncio.FIRST_COMPLETED)
+                if closed in done: get.cancel(); break
+                writer.write(frame(get.result()))
+                await writer.drain()
+        finally:
+            feed.listeners.discard(queue)
+            closed.cancel()
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 406: 'Not Acceptable', 503: 'Service Unavailable'}
+
+def ws_frame(opcode: int, payload: bytes) -> bytes:
+    """サーバーから送る (マスクなしの) WebSocket フレーム1つ。"""
+    n = len(payload)
+    if n < 126: header = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536: header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else: header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return header + payload
+
+async def _ws_wait_close(reader, writer) -> None:
+    """クライアントからのフレームを読み捨て、ping には pong を返し、close か切断で終わる。"""
+    while True:
+        b0, b1 = await reader.readexactly(2)
+        n = b1 & 0x7f
+        if n == 126: n = struct.unpack('!H', await reader.readexactly(2))[0]
+        elif n == 127: n = struct.unpack('!Q', await reader.readexactly(8))[0]
+        mask = await reader.readexactly(4) if b1 & 0x80 else b'\0\0\0\0'
+        data = bytes(c ^ mask[i % 4] for i, c in enumerate(await reader.readexactly(n)))
+        opcode = b0 & 0x0f
+        if opcode == 0x8: writer.write(ws_frame(0x8, data[:2])); return
+        if opcode == 0x9: writer.write(ws_frame(0xA, data))
+
+def start_collector(db_path: str) -> threading.Thread:
+    """収集スクリプト (ayumisql.Collector) を同じプロセスの別スレッドで動かす。Excel を読むので、ここで初めて読み込む。"""
+    import ayumisql
+    def run():
+        conn = connect(db_path)
+        ayumisql.setup_database(conn)
+        storage = ayumisql.StorageManager(conn, ayumisql.RETENTION_DAYS, ayumisql.RETENTION_ARCHIVE_DIR, ayumisql.ingestor.timings)
+        collector = ayumisql.Collector(conn, ayumisql.load_sources(), storage=storage)
+        try:
+            collector.run()
+        finally:
+            collector.close(); conn.close()
+    thread = threading.Thread(target=run, name='ayumi-collector', daemon=True)
+    thread.start()
+    return thread
+
+def watch(code: str, host: str = SERVER_HOST, port: int = SERVER_PORT) -> None:
+    """配信中のサーバーの /stream に繋ぎ、結果が届くたびに1行で表示する。"""
+    from urllib.request import urlopen
+    with urlopen(f'http://{host}:{port}/stream/{code}?rows=0') as response:
+        for line in response:
+            if not line.startswith(b'data: '): continue
+            payload = json.loads(line[6:])
+            summary = payload['summary'] or {}
+            print(f"[{time.strftime('%H:%M:%S')}] {code} id={payload['last_id']} 新規{payload['new_count']}件 "
+                  f"シグナル: {summary.get('signal', '-')} (確信度 {summary.get('confidence', '-')}) {summary.get('condition', '')}")
+            for event in payload.get('bursts') or ():
+                print(f"    !! {describe(BurstEvent(**event))}")
+
+async def _serve(args) -> None:
+    server = AnalysisServer(args.db, args.tickers, args.rows, args.state_dir)
+    await server.start(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="取得・分析を1回だけ行い、結果をローカルのHTTP/WebSocketで複数のクライアントに配る")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--tickers', nargs='+', help="配信する銘柄 (省略時は収集スクリプトが監視中の銘柄)")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="1回の結果に載せる直近の約定の件数")
+    parser.add_argument('--state-dir', help="銘柄ごとの分析状態の保存先 (再起動時に続きから分析する)")
+    parser.add_argument('--collect', action='store_true', help="収集スクリプトも同じプロセスで動かす (Windows・Excel が必要)")
+    parser.add_argument('--watch', metavar='TICKER', help="サーバーは起動せず、配信中のサーバーに繋いで結果を表示する")
+    args = parser.parse_args()
+    try:
+        if args.watch: watch(args.watch, args.host, args.port); sys.exit(0)
+        if not args.collect and not os.path.exists(args.db):
+            print(f"エラー: DBファイルが見つかりません: {args.db}"); sys.exit(1)
+        if args.collect: start_collector(args.db)
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        print("\n終了します。")
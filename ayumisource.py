@@ -0,0 +1,155 @@
+# coding: utf-8
+"""
+収集スクリプトに約定を渡す監視対象 (ソース)。どのソースも read() で TickBatch を返し、
+整形・方向の推定・DBへの挿入は ayumisql.TickIngestor が共通で行う。
+
+    excel   ayumi.xlsm の歩み値シート (直近の約定が並んだ表全体を毎回読む。既存行との重なりは取り込み側で除く)
+    csv     追記されていくCSV/TSV (前回読んだバイト位置から後ろだけを読む)
+    replay  保存済みのDB・アーカイブの1銘柄・1日分を、約定時刻に合わせて speed 倍速で流す
+
+sources.json の各要素の type で選ぶ (省略時は excel)。例:
+    {"name": "feed", "type": "csv", "path": "c:/ayumi/7203.csv", "ticker": "7203"}
+    {"name": "sim", "type": "replay", "db_path": "c:/ayumi/market_data.db", "ticker": "7203", "trade_date": 20261016, "speed": 10}
+"""
+import io
+import os
+import time
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from ayumixlsx import AyumiWorkbookReader
+from ayumidb import connect, decode_jikoku, PRICE_SCALE, SIDE_LABELS
+
+# data は 時刻・価格・出来高・方向 の順の列を持つ DataFrame (方向は省略可。値の形式はシートと同じく文字列・数値が混ざってよい)
+# append が True なら data はすべて前回より後の約定 (重なりの照合をしない)。trade_date が None なら取り込み時刻から決める
+TickBatch = namedtuple('TickBatch', 'ticker data read_at modified_at append trade_date')
+
+def tick_frame(times, prices, volumes, directions=None) -> pd.DataFrame:
+    columns = {'時刻': times, '価格': prices, '出来高': volumes}
+    if directions is not None: columns['方向'] = directions
+    return pd.DataFrame(columns)
+
+class TickSource:
+    """監視対象の共通部分。read はスレッドプール上で呼ばれる。ticker_code は収集器が記録した表示中の銘柄。"""
+    def __init__(self, name: str):
+        self.name = name
+        self.ticker_code = None
+        self.retry_at = 0.0  # ファイルがない場合などに、次に読みに行く時刻 (monotonic)
+        self.read_at = None  # 最後に読みに行った時刻 (UNIXエポック秒)
+
+    def read(self) -> TickBatch | None:
+        """新しい約定を TickBatch で返す。変化がない・待機中なら None。"""
+        raise NotImplementedError
+
+    def invalidate(self) -> None:
+        """直前の read の結果をDBに入れられなかったので、次の read で同じ内容をもう一度返す。"""
+
+    def _wait_for(self, path: str, label: str) -> bool:
+        """path がなければ10秒後まで待機にして例外を出す (他の監視対象は止めない)。"""
+        if time.monotonic() < self.retry_at: return False
+        self.read_at = time.time()
+        if not os.path.exists(path):
+            self.retry_at = time.monotonic() + 10
+            raise FileNotFoundError(f"{label}が見つかりません: {path}")
+        return True
+
+class WorkbookSource(TickSource):
+    """1つのブック (歩み値シート + 銘柄セル)。"""
+    def __init__(self, name: str, path: str, data_sheet: str, ticker_sheet: str, ticker_cell: str):
+        super().__init__(name)
+        self.path = path
+        self.reader = AyumiWorkbookReader(path, data_sheet, ticker_sheet, ticker_cell)
+
+    def read(self) -> TickBatch | None:
+        if not self._wait_for(self.path, 'Excelファイル'): return None
+        result = self.reader.read()
+        if result is None: return None
+        ticker_code, df_data = result
+        return TickBatch(ticker_code, df_data, self.read_at, self.reader.modified_at, False, None)
+
+    def invalidate(self) -> None:
+        self.reader.invalidate()
+
+class CsvTailSource(TickSource):
+    """
+    約定が1行ずつ追記されるCSV/TSV (時刻, 価格, 出来高[, 方向]。見出し行は読めない行として取り込み側で捨てられる)。
+    前回の位置から後ろだけを読み、書きかけの最終行は次回に回す。ファイルが縮んだら (作り直された) 先頭から読み直す。
+    起動後の最初の読み込み (ファイル全体) は保存済みの行と重なりうるので、シートと同じく照合してから取り込む。
+    """
+    def __init__(self, name: str, path: str, ticker: str, delimiter: str | None = None, encoding: str = 'utf-8'):
+        super().__init__(name)
+        self.path, self.ticker, self.encoding = path, str(ticker), encoding
+        self.delimiter = delimiter or ('\t' if path.lower().endswith(('.tsv', '.txt')) else ',')
+        self.offset = 0         # 次に読むバイト位置
+        self.batch_offset = 0   # 直前の read で読み始めた位置 (invalidate で戻る)
+        self.rewound = True     # 次の read がファイルの先頭からか
+
+    def read(self) -> TickBatch | None:
+        if not self._wait_for(self.path, 'CSVファイル'): return None
+        st = os.stat(self.path)
+        if st.st_size < self.offset: self.offset, self.rewound = 0, True
+        if st.st_size == self.offset: return None
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset); chunk = f.read(st.st_size - self.offset)
+        end = chunk.rfind(b'\n') + 1
+        if end == 0: return None  # 書きかけの1行だけ
+        self.batch_offset, self.offset = self.offset, self.offset + end
+        append, self.rewound = not self.rewound, False
+        df_data = pd.read_csv(io.BytesIO(chunk[:end]), sep=self.delimiter, header=None, dtype=str, encoding=self.encoding,
+                              skip_blank_lines=True, on_bad_lines='skip', engine='c')
+        return TickBatch(self.ticker, df_data, self.read_at, st.st_mtime, append, None)
+
+    def invalidate(self) -> None:
+        self.rewound = self.rewound or self.batch_offset == 0
+        self.offset = self.batch_offset
+
+class ReplaySource(TickSource):
+    """
+    保存済みの1銘柄・1日分 (DBに残っている分とアーカイブ) を、最初の read からの経過時間 × speed だけ約定時刻を進めて流す。
+    speed が 0 以下なら全件を1回で返す。約定は元の取引日 (trade_date) のまま取り込むので、流し先は別のDBにすること。
+    """
+    def __init__(self, name: str, db_path: str, ticker: str, trade_date: int, speed: float = 1.0, archive_dir: str | None = None):
+        super().__init__(name)
+        self.db_path, self.ticker, self.trade_date, self.speed, self.archive_dir = db_path, str(ticker), int(trade_date), speed, archive_dir
+        self.day = None        # (id, time_ms, price_x10, volume, side) の配列
+        self.position = 0      # 次に流す行
+        self.batch_position = 0
+        self.started = None
+
+    def _load(self) -> None:
+        from replay import load_day
+        conn = connect(self.db_path, 'reader')
+        try:
+            self.day = load_day(conn, self.ticker, self.trade_date, self.archive_dir)
+        finally:
+            conn.close()
+        self.started = time.monotonic()
+        print(f"[{self.name}] {self.ticker} {self.trade_date} の {len(self.day):,} 件を {self.speed} 倍速で流します。")
+
+    def read(self) -> TickBatch | None:
+        if self.day is None:
+            if not self._wait_for(self.db_path, 'DBファイル'): return None
+            self._load()
+        self.read_at = time.time()
+        if self.position >= len(self.day): return None
+        time_ms = self.day[:, 1]
+        if self.speed > 0:
+            until = time_ms[0] + (time.monotonic() - self.started) * 1000 * self.speed
+            end = int(np.searchsorted(time_ms, until, side='right'))
+        else:
+            end = len(self.day)
+        if end <= self.position: return None
+        rows = self.day[self.position:end]
+        self.batch_position, self.position = self.position, end
+        df_data = tick_frame([decode_jikoku(int(t)) for t in rows[:, 1]], rows[:, 2] / PRICE_SCALE, rows[:, 3], [SIDE_LABELS.get(int(s)) for s in rows[:, 4]])
+        return TickBatch(self.ticker, df_data, self.read_at, None, True, self.trade_date)
+
+    def invalidate(self) -> None:
+        self.position = self.batch_position
+
+SOURCE_TYPES = {'excel': WorkbookSource, 'csv': CsvTailSource, 'replay': ReplaySource}
+
+def make_source(type: str = 'excel', **options) -> TickSource:
+    """sources.json の1要素から監視対象を作る。"""
+    if type not in SOURCE_TYPES: raise ValueError(f"監視対象の type が不明です: {type} (使えるのは {', '.join(SOURCE_TYPES)})")
+    return SOURCE_TYPES[type](**options)
@@ -1,9 +1,20 @@
 # coding: utf-8
 import pandas as pd
+import numpy as np
 import sqlite3
 from datetime import datetime, time
 import time as sleep_timer
 import os
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from ayumisource import make_source
+from ayumichannel import TickPublisher
+from ayumimetrics import StageTimings, MetricsExporter, METRICS_DIR
+from ayumistore import StorageManager
+from burstdetector import BurstMonitor, describe
+from ayumidb import connect, setup_database, TickerDirectory, decode_jikoku, trade_dates_for, PRICE_SCALE, SIDE_LABELS
+from tickbuffer import DIRECTION_CODES
 
 # --- 設定項目 ---
 EXCEL_FILE_PATH = 'c:/ayumi/ayumi.xlsm'
@@ -11,123 +22,373 @@ SHEET_NAME_DATA = 'Sheet2'
 SHEET_NAME_TICKER = "Sheet1"
 TICKER_CODE_CELL_ADDRESS = 'E4'
 DB_PATH = 'c:/ayumi/market_data.db'
+SOURCES_CONFIG_PATH = 'c:/ayumi/sources.json'  # 複数の銘柄・シートを同時に監視する場合の設定 (なければ上記の1件のみ)
+POLL_INTERVAL_SEC = 0.25  # 変化がなければ os.stat 1回で終わるので、短くして表示までの遅延を抑える
+IDLE_POLL_INTERVAL_SEC = 2  # どの監視対象も IDLE_AFTER_SEC 秒変化しなければ (場が閉じている間など)、この間隔に落として起床を減らす
+IDLE_AFTER_SEC = 30
+METRICS_PATH = os.path.join(METRICS_DIR, 'collector.prom')  # 段階ごとの所要時間 (Prometheus テキスト形式)
+METRICS_PORT = None  # ポート番号を入れると http://127.0.0.1:<ポート>/metrics でも返す
+INGEST_LOG_RETENTION_SEC = 24 * 3600  # ingest_batches (取り込みごとの時刻) を残す期間
+RETENTION_DAYS = {}  # 銘柄コード -> DBに残す取引日数 ('*' は全銘柄の既定値)。空なら消さない (過去日は ayumiarchive.py で移す)
+RETENTION_ARCHIVE_DIR = None  # 指定すると、保存期間を過ぎた日は消す代わりにこのアーカイブへ移す
+DEFAULT_SOURCE = {'name': 'main', 'path': EXCEL_FILE_PATH, 'data_sheet': SHEET_NAME_DATA, 'ticker_sheet': SHEET_NAME_TICKER, 'ticker_cell': TICKER_CODE_CELL_ADDRESS}
 
-def setup_database(conn):
-    """データベースとテーブル、インデックスをセットアップする。"""
-    with conn:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS ayumi (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ticker_code TEXT NOT NULL,
-            jikoku TEXT NOT NULL,
-            price REAL NOT NULL,
-            dekidaka INTEGER NOT NULL,
-            baibai TEXT NOT NULL,
-            UNIQUE(ticker_code, jikoku, price, dekidaka, baibai)
-        )
-        """)
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_ticker_id ON ayumi (ticker_code, id)")
+DIRECTION_MAP = {'2': '買い', '1': '売り', '02': '買い', '01': '売り', '買い': '買い', '売り': '売り'}
+NUMERIC_DIRECTIONS = {2: '買い', 1: '売り'}  # 数値として読める方向セル ('2', 2.0, '02' など)
 
-def check_for_new_data(conn):
-    """Excelファイルを監視し、新しい約定データを読み込んでDBに保存する。"""
-    try:
-        if not os.path.exists(EXCEL_FILE_PATH):
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] エラー: Excelファイルが見つかりません: {EXCEL_FILE_PATH}")
-            sleep_timer.sleep(10) # 10秒待ってリトライ
-            return
-
-        df_ticker = pd.read_excel(
-            EXCEL_FILE_PATH,
-            sheet_name=SHEET_NAME_TICKER,
-            header=None,
-            usecols="E",
-            skiprows=3,
-            nrows=1
-        )
-        ticker_code = str(df_ticker.iloc[0, 0])
-        
-        df_data = pd.read_excel(EXCEL_FILE_PATH, sheet_name=SHEET_NAME_DATA, header=None)
+def format_jikoku(value) -> str:
+    """時刻セルの値を 'HH:MM:SS' 文字列にする。"""
+    return value.strftime('%H:%M:%S') if isinstance(value, (datetime, time)) else str(value)
 
-    except Exception as e:
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] Excel読み込みエラー: {e}")
-        return
-
-    # --- 売買方向の高度な判定ロジック ---
-    if df_data.empty or len(df_data.columns) < 3:
-        return # 必要な列がない場合はスキップ
-        
-    df_cleaned = df_data.iloc[:, [0, 1, 2]].copy()
-    df_cleaned.columns = ['時刻', '価格', '出来高']
-    df_cleaned['価格'] = pd.to_numeric(df_cleaned['価格'], errors='coerce')
-    df_cleaned['出来高'] = pd.to_numeric(df_cleaned['出来高'], errors='coerce')
-    df_cleaned.dropna(subset=['価格', '出来高'], inplace=True)
-    df_cleaned = df_cleaned[df_cleaned['出来高'] > 0].reset_index(drop=True)
-    if df_cleaned.empty:
-        return
-
-    if len(df_data.columns) >= 4:
-        df_cleaned['方向'] = df_data.iloc[:, 3].astype(str).map({'2': '買い', '1': '売り', '02': '買い', '01': '売り'})
-
-    if '方向' not in df_cleaned.columns or df_cleaned['方向'].isnull().any():
-        price_diff = df_cleaned['価格'].diff()
-        inferred_direction = pd.Series(index=df_cleaned.index, dtype=object)
-        inferred_direction[price_diff > 0] = '買い'
-        inferred_direction[price_diff < 0] = '売り'
-        inferred_direction.ffill(inplace=True)
-        inferred_direction.fillna('買い', inplace=True)
-        
-        if '方向' in df_cleaned.columns:
-            df_cleaned['方向'] = df_cleaned['方向'].combine_first(inferred_direction)
-        else:
-            df_cleaned['方向'] = inferred_direction
+def _format_jikoku_column(values: np.ndarray) -> np.ndarray:
+    """時刻列をまとめて 'HH:MM:SS' 文字列にする (format_jikoku を列に対して行う)。型が混在する列だけ1値ずつ変換する。"""
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind == 'time': return values.astype('<U8')  # str(time) の先頭8文字が 'HH:MM:SS'
+    if kind in ('string', 'empty'): return values.astype(str)
+    column = pd.Series(values, dtype=object)
+    if kind in ('datetime', 'datetime64'): return pd.to_datetime(column).dt.strftime('%H:%M:%S').fillna(column.astype(str)).to_numpy()
+    return column.map(format_jikoku).to_numpy()
 
-    df_final = df_cleaned[['時刻', '価格', '出来高', '方向']].dropna()
-    
-    # --- データベースへの挿入 ---
-    if df_final.empty:
-        return
-        
-    try:
-        records_to_insert = []
-        for _, row in df_final.iterrows():
-            time_val = row['時刻']
-            jikoku_str = time_val.strftime('%H:%M:%S') if isinstance(time_val, (datetime, time)) else str(time_val)
-            records_to_insert.append(
-                (ticker_code, jikoku_str, float(row['価格']), int(row['出来高']), str(row['方向']))
+def _encode_jikoku_column(jikoku: np.ndarray) -> np.ndarray:
+    """'HH:MM:SS' (小数秒も可) の列をまとめて0時からのミリ秒にする (encode_jikoku の列版)。解釈できない行は NaN。"""
+    return np.round(pd.to_timedelta(jikoku, errors='coerce').total_seconds().to_numpy() * 1000)
+
+def _to_numbers(values: np.ndarray) -> np.ndarray:
+    """pd.to_numeric(errors='coerce') で列をまとめて数値にする。変換できない値は NaN。"""
+    return pd.to_numeric(values, errors='coerce').astype(float)
+
+def _direction_labels(values: np.ndarray) -> np.ndarray:
+    """方向列の値 ('2', 2, 2.0, '02', '買い' など) をまとめて '買い'/'売り' に変換する。判別できない行は None。"""
+    numbers, labels = _to_numbers(values), np.full(len(values), None, dtype=object)
+    for number, label in NUMERIC_DIRECTIONS.items(): labels[numbers == number] = label
+    text = np.flatnonzero(np.isnan(numbers))  # '買い' など数値でない値だけ文字列で引く
+    if text.size: labels[text] = pd.Series(values[text].astype(str)).map(DIRECTION_MAP).to_numpy(dtype=object, na_value=None)
+    return labels
+
+def _row_keys(columns: list, positions: np.ndarray) -> list:
+    """行位置 positions (この順) の (行位置, キー (時刻, 価格, 出来高)) を列ごとにまとめて作る。価格・出来高が無効な行は除く。"""
+    prices, volumes = _to_numbers(columns[1][positions]), _to_numbers(columns[2][positions])
+    valid = np.isfinite(prices) & np.isfinite(volumes) & (volumes > 0)
+    if not valid.any(): return []
+    jikoku = _format_jikoku_column(columns[0][positions[valid]])
+    return list(zip(positions[valid].tolist(), zip(jikoku.tolist(), prices[valid].tolist(), volumes[valid].astype(np.int64).tolist())))
+
+class TickIngestor:
+    """
+    シート上の歩み値のうち、まだDBに入っていない行だけを変換・挿入する。
+    銘柄ごとに「最後に取り込んだ数件の約定キー (時刻, 価格, 出来高)」をアンカーとして持ち、
+    シートを新しい側から走査してアンカーの並びが見つかった位置より新しい行だけを新規とみなす。
+    起動直後・銘柄切替後・アンカーがシートから外れた場合は、DBに保存済みの直近の約定 (永続化された最高水位) から
+    状態を復元し、キーごとの保存件数を超えた行だけを新規とする。INSERT OR IGNORE は最後の安全策として残す。
+    各取り込みの 整形 (clean)・方向の推定 (direction)・挿入 (insert) の所要時間を timings に記録し、
+    挿入した行の範囲とブックの更新・読み込み・挿入の時刻を ingest_batches に残す (TUIがシート→画面の遅延を測るのに使う)。
+    bursts があれば、実際に挿入された約定 (重複で無視された行を除く) を同じトランザクションでバースト検知に渡し、検知したバーストを bursts テーブルに書く (burst に所要時間を記録)。
+    """
+    def __init__(self, anchor_len: int = 8, recent_keys: int = 5000, timings: StageTimings | None = None, bursts: BurstMonitor | None = None):
+        self.anchor_len, self.recent_keys = anchor_len, recent_keys
+        self.bursts = bursts
+        self.timings = timings or StageTimings()
+        self.purged_at = 0.0
+        self.tickers = TickerDirectory()
+        self._newest_first = {}  # 銘柄コード -> シートが新しい順に並んでいたか (先頭と末尾が同じ秒で決まらないときに使う)
+        # 銘柄コード -> {'anchor': [key...], 'last_price': float, 'last_direction': str, 'last_date': 最後に取り込んだ約定の取引日, 'next_seq': {(日付, 時刻ms): 次のseq}}
+        self._state = {}
+
+    def _seed_from_db(self, conn, ticker_code: str) -> tuple:
+        rows = conn.execute(
+            "SELECT trade_date, time_ms, price_x10, volume, side FROM ticks WHERE ticker_id = ? ORDER BY id DESC LIMIT ?",
+            (self.tickers.get(conn, ticker_code, create=True), self.recent_keys)
+        ).fetchall()[::-1]
+        keys = [(decode_jikoku(t), p / PRICE_SCALE, v) for _, t, p, v, _ in rows]
+        state = {
+            'anchor': keys[-self.anchor_len:], 'last_price': keys[-1][1] if rows else None,
+            'last_direction': SIDE_LABELS.get(rows[-1][4]) if rows else None, 'last_date': rows[-1][0] if rows else None,
+            'next_seq': Counter((d, t) for d, t, _, _, _ in rows),
+        }
+        return state, Counter(keys)
+
+    @staticmethod
+    def _end_keys(columns: list, n: int) -> tuple:
+        """シートの先頭と末尾それぞれで最初の有効な行のキー。なければ (None, None)。変換する区間は両端から倍々に広げる。"""
+        size = 16
+        while True:
+            positions = np.unique(np.concatenate([np.arange(min(size, n)), np.arange(max(n - size, 0), n)]))
+            rows = _row_keys(columns, positions)
+            if rows and rows[0][0] < size and rows[-1][0] >= n - size or size >= n: return (rows[0][1], rows[-1][1]) if rows else (None, None)
+            size *= 2
+
+    def _new_rows_by_anchor(self, columns: list, order: np.ndarray, anchor: list) -> list | None:
+        """
+        時系列順の行位置 order を新しい側から区間ごとにまとめて変換し、アンカーより後の (行位置, キー) を返す。見つからなければ None。
+        区間は見つかるまで倍々に広げるので、変換するのはほぼ新規の行とアンカーの分だけ。
+        """
+        rows, end, size = [], len(order), max(4 * len(anchor), 64)
+        while end > 0:
+            start = max(0, end - size)
+            rows = _row_keys(columns, order[start:end]) + rows
+            # 有効な行の並びの中で、アンカーと一致する最も新しい位置を探す
+            for i in range(len(rows) - 1, len(anchor) - 2, -1):
+                if rows[i][1] == anchor[-1] and [key for _, key in rows[i - len(anchor) + 1:i + 1]] == anchor: return rows[i + 1:]
+            end, size = start, size * 2
+        return None
+
+    @staticmethod
+    def _new_rows_by_count(columns: list, order: np.ndarray, known: Counter) -> list:
+        """キーごとにDBの保存件数を差し引き、超えた分の (行位置, キー) を新規として返す。"""
+        new_rows = []
+        for pos, key in _row_keys(columns, order):
+            if known[key] > 0: known[key] -= 1
+            else: new_rows.append((pos, key))
+        return new_rows
+
+    def ingest(self, conn, ticker_code: str, df_data: pd.DataFrame, read_at: float | None = None, sheet_mtime: float | None = None,
+               append: bool = False, trade_date: int | None = None) -> int:
+        """
+        df_data (Sheet2 の先頭列) から新規の約定だけをDBに挿入し、挿入件数を返す。
+        read_at・sheet_mtime はブックを読み始めた時刻とブックの更新時刻 (UNIXエポック秒)。省略時は挿入時刻で代用する。
+        append なら df_data は時系列順ですべて新規 (追記型の監視対象) とみなし、既存行との照合を省く。
+        trade_date (YYYYMMDD) を渡すと、取り込み時刻から日付を決める代わりにその日の約定とする。
+        """
+        if df_data.empty or len(df_data.columns) < 3: return 0
+        started = sleep_timer.perf_counter()
+        columns = [df_data.iloc[:, i].to_numpy() for i in range(min(4, len(df_data.columns)))]
+        n = len(df_data)
+        head, tail = self._end_keys(columns, n)
+        if head is None: return 0
+        # 歩み値シートは新しい約定が上に来る。時系列順 (古い→新しい) の行位置で扱う
+        # 先頭と末尾が同じ秒なら時刻では決まらないので、前回の向き (初回はシートの既定の新しい順) を使う
+        if not append:
+            newest_first = head[0] > tail[0] if head[0] != tail[0] else self._newest_first.get(ticker_code, True)
+            self._newest_first[ticker_code] = newest_first
+        order = np.arange(n - 1, -1, -1) if not append and newest_first else np.arange(n)
+        state = self._state.get(ticker_code)
+        if append:
+            if state is None: state, _ = self._seed_from_db(conn, ticker_code)
+            new_rows = _row_keys(columns, order)
+        else:
+            new_rows = self._new_rows_by_anchor(columns, order, state['anchor']) if state and state['anchor'] else None
+        if new_rows is None:
+            # 再同期: DB上の直近の約定から状態を作り直す
+            state, known = self._seed_from_db(conn, ticker_code)
+            new_rows = self._new_rows_by_count(columns, order, known)
+        if not new_rows:
+            self._state[ticker_code] = state
+            self.timings.record('clean', sleep_timer.perf_counter() - started)
+            return 0
+        positions = np.array([pos for pos, _ in new_rows])
+        jikoku, prices, volumes = (list(c) for c in zip(*(key for _, key in new_rows)))
+        direction_started = sleep_timer.perf_counter()
+        directions = self._directions(columns[3][positions] if len(columns) >= 4 else None, np.array(prices), state)
+        records_started = sleep_timer.perf_counter()
+        ticker_id, now, next_seq, records = self.tickers.get(conn, ticker_code, create=True), datetime.now(), state['next_seq'], []
+        times_ms = _encode_jikoku_column(np.array(jikoku, dtype=object))
+        kept = np.flatnonzero(~np.isnan(times_ms))
+        prices_x10 = np.round(np.array(prices)[kept] * PRICE_SCALE).astype(np.int64).tolist()
+        labels = np.array(directions, dtype=object)[kept]
+        sides = np.select([labels == label for label in DIRECTION_CODES], list(DIRECTION_CODES.values()), 0).tolist()
+        times_ms = times_ms[kept].astype(np.int64)
+        dates = np.full(len(times_ms), trade_date) if trade_date else trade_dates_for(times_ms, now, state['last_date'])
+        for d, time_ms, p, v, side in zip(dates.tolist(), times_ms.tolist(), prices_x10, np.array(volumes)[kept].tolist(), sides):
+            seq = next_seq.get((d, time_ms), 0); next_seq[(d, time_ms)] = seq + 1
+            records.append((ticker_id, d, time_ms, p, v, side, seq))
+        insert_started = sleep_timer.perf_counter()
+        with conn:
+            high_water = conn.execute("SELECT COALESCE(MAX(id), 0) FROM ticks").fetchone()[0]
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO ticks (ticker_id, trade_date, time_ms, price_x10, volume, side, seq) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                records
             )
+            inserted = cursor.rowcount
+            if inserted > 0: self._log_batch(conn, ticker_id, inserted, read_at, sheet_mtime)
+            bursts, burst_sec = [], 0.0
+            if inserted > 0 and self.bursts:
+                burst_started = sleep_timer.perf_counter()
+                # 重複で無視された行を数えないよう、実際に挿入された行 (最高水位より後の id) だけを渡す
+                observed = records if inserted == len(records) else conn.execute(
+                    "SELECT ticker_id, trade_date, time_ms, price_x10, volume, side, seq FROM ticks WHERE id > ? AND ticker_id = ? ORDER BY id",
+                    (high_water, ticker_id)
+                ).fetchall()
+                bursts = self.bursts.observe(conn, ticker_id, observed)
+                burst_sec = sleep_timer.perf_counter() - burst_started; self.timings.record('burst', burst_sec)
+        finished = sleep_timer.perf_counter()
+        for event in bursts: print(f"[{_stamp()}] [{ticker_code}] {describe(event)}")
+        self.timings.record('clean', (direction_started - started) + (insert_started - records_started))
+        self.timings.record('direction', records_started - direction_started); self.timings.record('insert', finished - insert_started - burst_sec)
+        self._state[ticker_code] = {
+            'anchor': (state['anchor'] + [key for _, key in new_rows])[-self.anchor_len:],
+            'last_price': prices[-1], 'last_direction': directions[-1], 'last_date': records[-1][1] if records else state['last_date'],
+            # 次の取り込みと重なりうるのは最後の時刻だけなので、それ以外の件数は捨てる
+            'next_seq': {records[-1][1:3]: next_seq[records[-1][1:3]]} if records else {},
+        }
+        return inserted
+
+    def _log_batch(self, conn, ticker_id: int, rows: int, read_at: float | None, sheet_mtime: float | None) -> None:
+        """挿入と同じトランザクションで、この取り込みの行範囲と時刻を ingest_batches に記録する (古い記録は時々消す)。"""
+        ingested_at = sleep_timer.time()
+        last_id = conn.execute("SELECT MAX(id) FROM ticks WHERE ticker_id = ?", (ticker_id,)).fetchone()[0]
+        conn.execute(
+            "INSERT OR REPLACE INTO ingest_batches (last_id, ticker_id, rows, sheet_mtime, read_at, ingested_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (last_id, ticker_id, rows, sheet_mtime, read_at or ingested_at, ingested_at)
+        )
+        if ingested_at - self.purged_at >= 600:
+            conn.execute("DELETE FROM ingest_batches WHERE ingested_at < ?", (ingested_at - INGEST_LOG_RETENTION_SEC,)); self.purged_at = ingested_at
+        if sheet_mtime: self.timings.record('sheet_to_db', ingested_at - sheet_mtime)
+
+    def _directions(self, raw, prices: np.ndarray, state: dict) -> list:
+        """方向列があればそれを使い、欠けている行は直前の価格・方向を引き継いだティックテストで推定する。"""
+        directions = _direction_labels(raw) if raw is not None else np.full(len(prices), None, dtype=object)
+        missing = np.equal(directions, None)
+        if not missing.any(): return directions.tolist()
+        # 上昇なら買い、下落なら売り、変化なしは直前の方向を引き継ぐ
+        prev_price = state['last_price'] if state['last_price'] is not None else prices[0]
+        sign = np.sign(np.diff(prices, prepend=prev_price))
+        last_move = np.maximum.accumulate(np.where(sign != 0, np.arange(len(sign)), -1))
+        inferred = np.where(last_move >= 0, np.where(sign[last_move] > 0, '買い', '売り'), state['last_direction'] or '買い')
+        return np.where(missing, inferred, directions).tolist()
+
+# 銘柄ごとの取り込み状態 (プロセス内で保持)
+ingestor = TickIngestor(bursts=BurstMonitor())
 
+def _stamp() -> str:
+    return datetime.now().strftime('%H:%M:%S')
+
+def load_sources(path: str = SOURCES_CONFIG_PATH) -> list:
+    """
+    監視対象の一覧を返す。設定ファイル (JSONの配列) がなければ ayumi.xlsm の1件だけ。
+    各要素は name, path, data_sheet, ticker_sheet, ticker_cell を持ち、省略したキーは既定値になる。
+    TUIの銘柄変更で書き換えるのは name が 'main' の監視対象の銘柄セル。
+    type が excel 以外 (csv・replay) の要素には既定値を補わない (キーは ayumisource の各クラスの引数)。
+    """
+    if not os.path.exists(path): return [dict(DEFAULT_SOURCE)]
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    sources = [{**(DEFAULT_SOURCE if entry.get('type', 'excel') == 'excel' else {}), 'name': 'main' if i == 0 else f'source{i}', **entry}
+               for i, entry in enumerate(entries)]
+    names = [s['name'] for s in sources]
+    if len(set(names)) != len(names): raise ValueError(f"監視対象の name が重複しています: {names}")
+    return sources
+
+class Collector:
+    """
+    複数の監視対象をスレッドプールで並行して読み込み、1本の接続で順にDBへ書き込む常駐収集器。
+    ブックの解析は監視対象ごとに独立しているので並行させ、SQLiteへの書き込み (単一ライター) と
+    銘柄ごとの取り込み状態の更新はこのスレッドだけで行う。1つの監視対象のエラーは他に波及させない。
+    保存するたびに publisher で「銘柄と最終id」を通知し、TUIはそれを受けて読みに来る。
+    ブックの解析 (read)・1回の確認全体 (poll) の所要時間は ingestor と同じ timings に記録し、exporter で書き出す。
+    監視対象ごとの 読み込み+取り込み の所要時間も source:<name> として記録する (取り込み件数と合わせて監視対象別の処理速度になる)。
+    storage があれば、確認の合間にWALの書き戻しと保存期間の処理を行わせる (約定が続いている間は避ける)。
+    """
+    def __init__(self, conn, sources: list, ingestor: TickIngestor = ingestor, max_workers: int | None = None, publisher: TickPublisher | None = None,
+                 exporter: MetricsExporter | None = None, storage: StorageManager | None = None):
+        self.conn, self.ingestor = conn, ingestor
+        self.storage = storage
+        self.last_insert_at = 0.0  # 最後に約定を保存した時刻 (monotonic)
+        self.last_change_at = 0.0  # 最後にいずれかの監視対象が変化していた時刻 (monotonic)
+        self.timings = ingestor.timings
+        self.publisher = publisher or TickPublisher()
+        self.exporter = exporter
+        self.sources = [make_source(**source) for source in sources]
+        self.pool = ThreadPoolExecutor(max_workers=max_workers or min(8, len(self.sources)), thread_name_prefix='ayumi-reader')
         with conn:
-            cursor = conn.cursor()
-            cursor.executemany(
-                "INSERT OR IGNORE INTO ayumi (ticker_code, jikoku, price, dekidaka, baibai) VALUES (?, ?, ?, ?, ?)",
-                records_to_insert
+            conn.execute(f"DELETE FROM collector_sources WHERE name NOT IN ({','.join('?' * len(self.sources))})", [s.name for s in self.sources])
+
+    def _record_ticker(self, source, ticker_code: str) -> None:
+        """監視対象に表示中の銘柄をDBに記録する (TUIが銘柄切替時に参照する)。"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO collector_sources (name, ticker_code, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET ticker_code = excluded.ticker_code, updated_at = excluded.updated_at",
+                (source.name, ticker_code, sleep_timer.time())
             )
-            new_data_count = cursor.rowcount
-    
-        if new_data_count > 0:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] [{ticker_code}] 新規データ {new_data_count} 件をDBに保存。")
+        if source.ticker_code is not None:
+            print(f"[{_stamp()}] [{source.name}] 銘柄が {source.ticker_code} から {ticker_code} に変わりました。")
+        source.ticker_code = ticker_code
 
-    except sqlite3.Error as e:
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] データベースエラー: {e}")
-    except Exception as e:
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] データ処理エラー: {e}")
+    def _publish(self, ticker_code: str) -> None:
+        ticker_id = self.ingestor.tickers.get(self.conn, ticker_code)
+        last_id = self.conn.execute("SELECT MAX(id) FROM ticks WHERE ticker_id = ?", (ticker_id,)).fetchone()[0]
+        if last_id is not None: self.publisher.publish(ticker_code, last_id)
+
+    def _timed_read(self, source) -> tuple:
+        """source.read を呼び、(TickBatch, 所要時間) を返す。解析まで進んだ (変化があった) 回だけ所要時間を記録する。"""
+        started = sleep_timer.perf_counter()
+        batch = source.read()
+        elapsed = sleep_timer.perf_counter() - started
+        if batch is not None: self.timings.record('read', elapsed)
+        return batch, elapsed
+
+    def poll_once(self) -> int:
+        """全監視対象を1回ずつ確認し、新規に保存した件数の合計を返す。"""
+        started = sleep_timer.perf_counter()
+        futures = [(source, self.pool.submit(self._timed_read, source)) for source in self.sources]
+        total, changed = 0, False
+        for source, future in futures:
+            try:
+                batch, read_sec = future.result()
+            except Exception as e:
+                print(f"[{_stamp()}] [{source.name}] 読み込みエラー: {e}")
+                continue
+            if batch is None: continue  # 前回から変化なし
+            ticker_code = batch.ticker
+            changed = True
+            try:
+                if ticker_code != source.ticker_code: self._record_ticker(source, ticker_code)
+                ingest_started = sleep_timer.perf_counter()
+                new_data_count = self.ingestor.ingest(self.conn, ticker_code, batch.data, batch.read_at, batch.modified_at, batch.append, batch.trade_date)
+                self.timings.record(f'source:{source.name}', read_sec + sleep_timer.perf_counter() - ingest_started)
+                if new_data_count > 0:
+                    self.last_insert_at = sleep_timer.monotonic()
+                    print(f"[{_stamp()}] [{source.name}:{ticker_code}] 新規データ {new_data_count} 件をDBに保存。")
+                    self._publish(ticker_code)
+                total += new_data_count
+            except sqlite3.Error as e:
+                print(f"[{_stamp()}] [{source.name}] データベースエラー: {e}")
+                source.invalidate() # 次のサイクルで同じ内容を読み直して再投入する
+            except Exception as e:
+                print(f"[{_stamp()}] [{source.name}] データ処理エラー: {e}")
+        if changed:
+            self.timings.record('poll', sleep_timer.perf_counter() - started)
+            self.last_change_at = sleep_timer.monotonic()
+        return total
+
+    def run(self, interval: float = POLL_INTERVAL_SEC, idle_interval: float = IDLE_POLL_INTERVAL_SEC) -> None:
+        """
+        Ctrl+C (KeyboardInterrupt) まで interval 秒ごとに poll_once を繰り返す。
+        IDLE_AFTER_SEC 秒どの監視対象も変化しなければ idle_interval 秒ごとに落とし、変化を見つけたら interval に戻す。
+        """
+        while True:
+            started = sleep_timer.monotonic()
+            self.poll_once()
+            if self.exporter: self.exporter.maybe_write()
+            if self.storage: self.storage.maybe_run(self.last_insert_at)
+            wait = interval if sleep_timer.monotonic() - self.last_change_at < IDLE_AFTER_SEC else idle_interval
+            sleep_timer.sleep(max(0.0, wait - (sleep_timer.monotonic() - started)))
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+        self.publisher.close()
+        if self.exporter: self.exporter.close()
 
 if __name__ == "__main__":
     print("データ収集スクリプトを開始します。")
-    print(f"監視対象Excel: {EXCEL_FILE_PATH}")
+    sources = load_sources()
+    for source in sources:
+        if source.get('type', 'excel') == 'excel':
+            print(f"監視対象: [{source['name']}] {source['path']} ({source['data_sheet']}, 銘柄セル {source['ticker_sheet']}!{source['ticker_cell']})")
+        else:
+            print(f"監視対象: [{source['name']}] {source['type']}: " + ', '.join(f"{k}={v}" for k, v in source.items() if k not in ('name', 'type')))
     print(f"保存先DB: {DB_PATH}")
     print("Ctrl+Cで終了します。")
     
     conn = None
+    collector = None
     try:
         # スクリプト開始時に一度だけ接続
-        conn = sqlite3.connect(DB_PATH, timeout=10.0)
+        conn = connect(DB_PATH)
         setup_database(conn)
-        
-        while True:
-            check_for_new_data(conn)
-            sleep_timer.sleep(2) # ポーリング間隔を短縮
+        storage = StorageManager(conn, RETENTION_DAYS, RETENTION_ARCHIVE_DIR, ingestor.timings)
+        collector = Collector(conn, sources, exporter=MetricsExporter(ingestor.timings, 'collector', METRICS_PATH, METRICS_PORT), storage=storage)
+        collector.run()
 
     except KeyboardInterrupt:
         print("\nスクリプトを終了します。")
@@ -135,6 +396,8 @@ if __name__ == "__main__":
         print(f"致命的なエラーが発生しました: {e}")
     finally:
         # スクリプト終了時に接続を閉じる
+        if collector:
+            collector.close()
         if conn:
             conn.close()
-            print("データベース接続を解放しました。")
\ No newline at end of file
+            print("データベース接続を解放しました。")
@@ -0,0 +1,157 @@
+# coding: utf-8
+"""
+market_data.db の保守 (収集スクリプトの書き込み用接続で動かす)。
+- WALの書き戻し (チェックポイント): 約定が途切れている間に PASSIVE を定期的に、TRUNCATE (WALファイルを空にする) をまれに行う。
+  約定が続いていても、WALが WAL_LIMIT_BYTES を超えたら PASSIVE だけは行う。
+- 保存期間: 銘柄ごとに直近 N 取引日より前の約定・足・バーストを、少しずつ (DELETE_CHUNK_ROWS 件ずつ) 消し、空いたページを incremental_vacuum で返す。
+  archive_dir を指定すると、消す代わりに ayumiarchive のアーカイブへ移す。
+
+    python ayumistore.py c:/ayumi/market_data.db --retention 20 --ticker-retention 7203=60 --checkpoint TRUNCATE
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from ayumidb import connect, TickerDirectory
+from ayumimetrics import StageTimings
+import ayumiarchive
+
+CHECKPOINT_INTERVAL_SEC = 30      # PASSIVE の間隔
+TRUNCATE_INTERVAL_SEC = 900       # TRUNCATE の間隔
+QUIET_SEC = 2.0                   # この秒数新しい約定がなければ、バーストの外とみなす
+WAL_LIMIT_BYTES = 64 * 1024 * 1024
+RETENTION_INTERVAL_SEC = 3600     # 保存期間を過ぎた行を探し直す間隔
+DELETE_CHUNK_ROWS = 20000         # 1回 (1トランザクション) で消す行数。書き込みを長く止めないように小分けにする
+VACUUM_PAGES = 2000               # 1回の incremental_vacuum で返すページ数
+
+def parse_retention(default_days: int | None, overrides: list) -> dict:
+    """--retention と --ticker-retention (銘柄=日数) を {銘柄コード or '*': 日数} にする。"""
+    retention = {} if default_days is None else {'*': default_days}
+    for item in overrides or ():
+        code, _, days = item.partition('=')
+        retention[code] = int(days)
+    return retention
+
+class StorageManager:
+    """
+    書き込み用接続の保守を、収集の合間 (maybe_run) に少しずつ行う。
+    retention は {銘柄コード: 保存する取引日数} で、'*' は指定のない銘柄の既定値 (なければその銘柄は消さない)。
+    チェックポイント (checkpoint) と保存期間の処理 (retention) の所要時間を timings に記録する。
+    自動チェックポイントは止め、書き戻しはすべてここで行う。
+    """
+    def __init__(self, conn, retention: dict | None = None, archive_dir: str | None = None, timings: StageTimings | None = None):
+        self.conn, self.retention, self.archive_dir = conn, retention or {}, archive_dir
+        self.timings = timings or StageTimings()
+        self.tickers = TickerDirectory()
+        self.path = next((row[2] for row in conn.execute("PRAGMA database_list") if row[1] == 'main'), '')
+        self.checkpointed_at = self.truncated_at = time.monotonic()
+        self.retained_at = 0.0
+        self.pending = []  # 消す予定の (ticker_id, 残す最初の取引日)
+        conn.execute("PRAGMA wal_autocheckpoint = 0")
+
+    def wal_bytes(self) -> int:
+        try:
+            return os.path.getsize(self.path + '-wal')
+        except OSError:
+            return 0
+
+    def checkpoint(self, mode: str = 'PASSIVE') -> tuple:
+        """(読み手が使用中で書き戻せなかったか, WALのページ数, 書き戻したページ数) を返す。"""
+        started = time.perf_counter()
+        result = self.conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        self.timings.record('checkpoint', time.perf_counter() - started)
+        self.checkpointed_at = time.monotonic()
+        if mode == 'TRUNCATE': self.truncated_at = self.checkpointed_at
+        return tuple(result)
+
+    def maybe_run(self, last_insert_at: float) -> None:
+        """収集の1周ごとに呼ぶ。last_insert_at は最後に約定を保存した時刻 (monotonic)。"""
+        now = time.monotonic()
+        quiet = now - last_insert_at >= QUIET_SEC
+        try:
+            if now - self.checkpointed_at >= CHECKPOINT_INTERVAL_SEC and (quiet or self.wal_bytes() > WAL_LIMIT_BYTES):
+                self.checkpoint('PASSIVE')
+            if not quiet: return
+            if now - self.truncated_at >= TRUNCATE_INTERVAL_SEC:
+                self.checkpoint('TRUNCATE')
+            elif self.retention and (self.pending or now - self.retained_at >= RETENTION_INTERVAL_SEC):
+                self.retain_step()
+        except sqlite3.Error as e:
+            print(f"DBの保守でエラーが発生しました: {e}"); self.checkpointed_at = self.retained_at = now
+
+    def _plan(self) -> list:
+        """保存期間を過ぎた行のある (ticker_id, 銘柄コード, 残す最初の取引日) を列挙する。"""
+        plan = []
+        for ticker_id, code in self.conn.execute("SELECT ticker_id, code FROM tickers").fetchall():
+            days = self.retention.get(code, self.retention.get('*'))
+            if not days: continue
+            row = self.conn.execute(
+                "SELECT trade_date FROM (SELECT DISTINCT trade_date FROM ticks WHERE ticker_id = ?) ORDER BY trade_date DESC LIMIT 1 OFFSET ?",
+                (ticker_id, days - 1)
+            ).fetchone()
+            if row and self.conn.execute("SELECT 1 FROM ticks WHERE ticker_id = ? AND trade_date < ? LIMIT 1", (ticker_id, row[0])).fetchone():
+                plan.append((ticker_id, code, row[0]))
+        return plan
+
+    def retain_step(self) -> int:
+        """保存期間を過ぎた行を1回分 (最大 DELETE_CHUNK_ROWS 件、アーカイブ時は1銘柄分) 消し、消した件数を返す。"""
+        started = time.perf_counter()
+        if not self.pending:
+            self.pending, self.retained_at = self._plan(), time.monotonic()
+        removed = 0
+        if self.pending:
+            ticker_id, code, keep_from = self.pending[0]
+            if self.archive_dir:
+                removed = sum(count for _, _, count in ayumiarchive.compact(self.conn, self.archive_dir, before=keep_from, tickers=[code]))
+                done = True
+            else:
+                with self.conn:
+                    removed = self.conn.execute(
+                        "DELETE FROM ticks WHERE id IN (SELECT id FROM ticks WHERE ticker_id = ? AND trade_date < ? LIMIT ?)",
+                        (ticker_id, keep_from, DELETE_CHUNK_ROWS)
+                    ).rowcount
+                done = removed < DELETE_CHUNK_ROWS
+            if done:
+                with self.conn:
+                    self.conn.execute("DELETE FROM bars WHERE ticker_id = ? AND trade_date < ?", (ticker_id, keep_from))
+                    self.conn.execute("DELETE FROM bursts WHERE ticker_id = ? AND trade_date < ?", (ticker_id, keep_from))
+                self.pending.pop(0)
+        if self.conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            self.conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+        if removed or self.pending: self.timings.record('retention', time.perf_counter() - started)
+        return removed
+
+    def retain_all(self) -> int:
+        """保存期間の処理を最後まで行い、消した (移した) 件数の合計を返す。"""
+        self.pending, total = self._plan(), 0
+        while self.pending: total += self.retain_step()
+        return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="market_data.db の保存期間の適用・WALの書き戻し・空き領域の回収")
+    parser.add_argument('db_path')
+    parser.add_argument('--retention', type=int, help="全銘柄に適用する保存期間 (取引日数)")
+    parser.add_argument('--ticker-retention', nargs='+', metavar='CODE=DAYS', help="銘柄ごとの保存期間 (取引日数)")
+    parser.add_argument('--archive', help="消す代わりにこのアーカイブへ移す")
+    parser.add_argument('--checkpoint', choices=['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'], default='TRUNCATE')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="既存のDBを auto_vacuum=INCREMENTAL にする (VACUUM でファイル全体を書き直すので、収集を止めてから行う)")
+    args = parser.parse_args()
+    if not os.path.exists(args.db_path):
+        print(f"エラー: DBファイルが見つかりません: {args.db_path}"); sys.exit(1)
+    size_before = os.path.getsize(args.db_path)
+    conn = connect(args.db_path)
+    try:
+        if args.enable_incremental_vacuum and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            print("auto_vacuum を INCREMENTAL にして VACUUM を実行しています...")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL"); conn.execute("VACUUM")
+        manager = StorageManager(conn, parse_retention(args.retention, args.ticker_retention), args.archive)
+        if manager.retention:
+            started = time.perf_counter()
+            print(f"保存期間を過ぎた {manager.retain_all():,} 件を{'移しました' if args.archive else '消しました'} ({time.perf_counter() - started:,.2f}秒)。")
+        busy, log_pages, written = manager.checkpoint(args.checkpoint)
+        print(f"チェックポイント ({args.checkpoint}): WAL {log_pages} ページ中 {written} ページを書き戻しました" + (" (読み手が使用中のため一部未完了)" if busy else "") + "。")
+    finally:
+        conn.close()
+    print(f"ファイルサイズ: {size_before / 1024 / 1024:,.1f}MB -> {os.path.getsize(args.db_path) / 1024 / 1024:,.1f}MB")
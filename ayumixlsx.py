@@ -0,0 +1,167 @@
+# coding: utf-8
+import os
+import re
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+import pandas as pd
+
+# --- OOXML 名前空間 ---
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# 日付・時刻として扱う組み込み書式ID (日本語ロケールの 27-36, 50-58 を含む)
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | set(range(27, 37)) | {45, 46, 47} | set(range(50, 59))
+EXCEL_EPOCH = datetime(1899, 12, 30)
+MAX_COLUMNS = 16384  # Excel の列数の上限 (XFD)
+
+def split_cell_ref(ref: str) -> tuple:
+    """'E4' のようなセル番地を (列番号0始まり, 行番号1始まり) に分解する。"""
+    m = re.match(r"([A-Z]+)(\d+)$", ref)
+    col = 0
+    for ch in m.group(1): col = col * 26 + (ord(ch) - 64)
+    return col - 1, int(m.group(2))
+
+def _is_date_format(code: str) -> bool:
+    code = re.sub(r'"[^"]*"|\\.|\[(?!h\]|m\]|s\])[^\]]*\]', '', code.lower())
+    return re.search(r'[dmyhs]', code) is not None
+
+def excel_serial_to_datetime(value: float):
+    """Excelのシリアル値を、1未満なら time、それ以外は datetime に変換する。"""
+    dt = EXCEL_EPOCH + timedelta(microseconds=round(value * 86_400_000_000))
+    return dt.time() if 0 <= value < 1 else dt
+
+class AyumiWorkbookReader:
+    """
+    ayumi.xlsm から 銘柄コードセル と 歩み値シートの先頭列 だけをストリーム解析で読み込むリーダー。
+    data_columns は歩み値シートの先頭から読む列数。None なら見出し行 (最初の行) の列数に合わせる。
+    ファイルの更新時刻・サイズ、およびzip内の各シートXMLのCRCが前回と同じなら解析をスキップして None を返す。
+    アーカイブは1サイクルにつき1回だけ開き、必要なパート(シート・共有文字列・書式)のみを iterparse する。
+    """
+    def __init__(self, path: str, data_sheet: str = 'Sheet2', ticker_sheet: str = 'Sheet1', ticker_cell: str = 'E4', data_columns: int = 4):
+        self.path, self.data_sheet, self.ticker_sheet, self.data_columns = path, data_sheet, ticker_sheet, data_columns
+        self.ticker_col, self.ticker_row = split_cell_ref(ticker_cell)
+        self._stat_key = None
+        self._part_keys = {}    # パート名 -> (CRC, サイズ) 。最後に解析した時点のもの
+        self._sheet_parts = {}  # シート名 -> zip内のパート名
+        self._shared_strings = []
+        self._date_styles = set()
+
+    @property
+    def modified_at(self) -> float | None:
+        """最後に読んだ時点のブックの更新時刻 (UNIXエポック秒)。まだ読んでいなければ None。"""
+        return self._stat_key[0] / 1e9 if self._stat_key else None
+
+    def invalidate(self) -> None:
+        """キャッシュを破棄し、次回の read で必ず全体を読み直させる。"""
+        self._stat_key = None; self._part_keys = {}; self._sheet_parts = {}
+
+    def _changed(self, zf: zipfile.ZipFile, part: str) -> bool:
+        info = zf.getinfo(part)
+        return self._part_keys.get(part) != (info.CRC, info.file_size)
+
+    def _mark(self, zf: zipfile.ZipFile, part: str) -> None:
+        info = zf.getinfo(part); self._part_keys[part] = (info.CRC, info.file_size)
+
+    def _load_workbook_map(self, zf: zipfile.ZipFile) -> None:
+        rels = {}
+        for rel in ET.fromstring(zf.read('xl/_rels/workbook.xml.rels')).iter(f'{NS_PKG_REL}Relationship'):
+            target = rel.get('Target')
+            rels[rel.get('Id')] = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        self._sheet_parts = {s.get('name'): rels[s.get(f'{NS_REL}id')] for s in ET.fromstring(zf.read('xl/workbook.xml')).iter(f'{NS_MAIN}sheet')}
+
+    def _load_shared_strings(self, zf: zipfile.ZipFile) -> None:
+        strings = []
+        with zf.open('xl/sharedStrings.xml') as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag != f'{NS_MAIN}si': continue
+                # ふりがな(rPh)は除き、t と リッチテキスト r/t を連結する
+                parts = [child.text or '' for child in elem if child.tag == f'{NS_MAIN}t']
+                parts += [t.text or '' for r in elem if r.tag == f'{NS_MAIN}r' for t in r if t.tag == f'{NS_MAIN}t']
+                strings.append(''.join(parts)); elem.clear()
+        self._shared_strings = strings
+
+    def _load_styles(self, zf: zipfile.ZipFile) -> None:
+        root = ET.fromstring(zf.read('xl/styles.xml'))
+        custom = {int(f.get('numFmtId')): f.get('formatCode', '') for f in root.iter(f'{NS_MAIN}numFmt')}
+        cell_xfs = root.find(f'{NS_MAIN}cellXfs')
+        self._date_styles = set()
+        for i, xf in enumerate(cell_xfs if cell_xfs is not None else []):
+            fmt_id = int(xf.get('numFmtId', 0))
+            if fmt_id in BUILTIN_DATE_FORMATS or (fmt_id in custom and _is_date_format(custom[fmt_id])): self._date_styles.add(i)
+
+    def _cell_value(self, c):
+        t, v = c.get('t', 'n'), c.find(f'{NS_MAIN}v')
+        if t == 'inlineStr':
+            return ''.join(x.text or '' for x in c.iter(f'{NS_MAIN}t'))
+        if v is None or v.text is None: return None
+        if t == 's': return self._shared_strings[int(v.text)]
+        if t in ('str', 'e'): return v.text
+        if t == 'b': return v.text == '1'
+        num = float(v.text)
+        if int(c.get('s', 0)) in self._date_styles: return excel_serial_to_datetime(num)
+        return int(num) if num.is_integer() else num
+
+    def _iter_cells(self, zf: zipfile.ZipFile, part: str, max_col: int, max_row: int | None = None):
+        """シートXMLを行単位で iterparse し、max_col 未満の列のセルを (行, 列, 値) で返す。max_row を超えたら打ち切る。"""
+        row_tag, col_cache = f'{NS_MAIN}row', {}
+        with zf.open(part) as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag != row_tag: continue
+                row = int(elem.get('r'))
+                for c in elem:
+                    ref = c.get('r'); letters = ref.rstrip('0123456789')
+                    col = col_cache.get(letters)
+                    if col is None: col = col_cache[letters] = split_cell_ref(ref)[0]
+                    if col < max_col: yield row, col, self._cell_value(c)
+                if max_row is not None and row >= max_row: return
+                elem.clear()
+
+    def _read_data_sheet(self, zf: zipfile.ZipFile) -> pd.DataFrame:
+        rows, width = {}, 0
+        for row, col, value in self._iter_cells(zf, self._sheet_parts[self.data_sheet], self.data_columns or MAX_COLUMNS):
+            if value is None: continue
+            rows.setdefault(row, {})[col] = value; width = max(width, col + 1)
+        if not rows: return pd.DataFrame()
+        # data_columns=None なら、最初の行 (見出し) の右端までを列とする
+        if self.data_columns is None: width = max(rows[min(rows)]) + 1
+        # pd.read_excel(header=None) と同じく、1行目から最終行までを空行も含めて並べる
+        empty = {}
+        df = pd.DataFrame([[rows.get(r, empty).get(c) for c in range(width)] for r in range(1, max(rows) + 1)])
+        # read_excel と同様、数字だけの文字列列 ('2', '1' など) は数値列として扱う
+        for col in df.columns:
+            if df[col].dtype == object or pd.api.types.is_string_dtype(df[col]):
+                try: df[col] = pd.to_numeric(df[col])
+                except (ValueError, TypeError): pass
+        return df
+
+    def _read_ticker(self, zf: zipfile.ZipFile) -> str:
+        for row, col, value in self._iter_cells(zf, self._sheet_parts[self.ticker_sheet], self.ticker_col + 1, self.ticker_row):
+            if row == self.ticker_row and col == self.ticker_col and value is not None: return str(value)
+        return 'nan'  # pd.read_excel で空セルを読んだときの str(NaN) に合わせる
+
+    def read(self) -> tuple | None:
+        """(銘柄コード, 歩み値DataFrame) を返す。前回から変化がなければ None。"""
+        st = os.stat(self.path)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        if stat_key == self._stat_key: return None
+        with zipfile.ZipFile(self.path) as zf:
+            if self._changed(zf, 'xl/workbook.xml') or not self._sheet_parts:
+                self._load_workbook_map(zf); self._mark(zf, 'xl/workbook.xml')
+            ticker_part, data_part = self._sheet_parts[self.ticker_sheet], self._sheet_parts[self.data_sheet]
+            names = set(zf.namelist())
+            watched = [ticker_part, data_part] + (['xl/sharedStrings.xml'] if 'xl/sharedStrings.xml' in names else [])
+            if not any(self._changed(zf, part) for part in watched):
+                self._stat_key = stat_key
+                return None
+            if 'xl/sharedStrings.xml' in names and self._changed(zf, 'xl/sharedStrings.xml'):
+                self._load_shared_strings(zf); self._mark(zf, 'xl/sharedStrings.xml')
+            if 'xl/styles.xml' in names and self._changed(zf, 'xl/styles.xml'):
+                self._load_styles(zf); self._mark(zf, 'xl/styles.xml')
+            # 銘柄セルは4行目までで打ち切るので安価。共有文字列の番号が振り直される場合に備えて毎回読む
+            ticker_code = self._read_ticker(zf); self._mark(zf, ticker_part)
+            df_data = self._read_data_sheet(zf); self._mark(zf, data_part)
+        self._stat_key = stat_key
+        return ticker_code, df_data
@@ -0,0 +1,422 @@
+# coding: utf-8
+"""
+ホットパスのベンチマーク。合成した約定・ayumi.xlsm を使うので Excel / MarketSpeed2 / win32com は不要 (Linux でも動く)。
+
+    python benchmark.py                                  # 全ステージを 1k/10k/100k 件 × 1/10/50 銘柄で計測
+    python benchmark.py --stages analyze query --sizes 10000 --output after.json --compare before.json
+
+件数 (rows) は全銘柄の合計で、銘柄数 (tickers) の軸を持つステージは合計を銘柄数で等分して使う。
+--output には環境情報と {stage, rows, tickers, metric, value} のレコード列を JSON で書き出す。
+値は *_ms がミリ秒 (repeat 回の中央値)、*_kb がKB。--compare で前回のJSONと突き合わせ、今回/前回の比を表示する。
+"""
+import io
+import os
+import json
+import time
+import asyncio
+import warnings
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import sqlite3
+import numpy as np
+import pandas as pd
+import synthetic
+import ayumidb
+import ayumiarchive
+from ayumixlsx import AyumiWorkbookReader
+from ayumisql import TickIngestor, Collector, DEFAULT_SOURCE
+from tradeanalyzer import TradeAnalyzer, StreamingTradeAnalyzer
+
+LEGACY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ayumi (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, ticker_code TEXT NOT NULL, jikoku TEXT NOT NULL, price REAL NOT NULL,
+    dekidaka INTEGER NOT NULL, baibai TEXT NOT NULL, UNIQUE(ticker_code, jikoku, price, dekidaka, baibai)
+);
+CREATE INDEX IF NOT EXISTS idx_ticker_id ON ayumi (ticker_code, id);
+"""
+BENCH_DATE = 20261016  # 合成データに割り当てる取引日
+NEW_ROWS = 50          # 1回のポーリングで届く新規約定の件数 (想定)
+warnings.filterwarnings('ignore', category=UserWarning, module='openpyxl')  # 合成ブックに既定スタイルがない旨の警告
+
+def timeit(func, repeat: int, setup=None) -> float:
+    """func を repeat 回実行し、中央値(ミリ秒)を返す。setup があれば毎回の実行前に (計測外で) 呼ぶ。"""
+    samples = []
+    for _ in range(repeat):
+        if setup: setup()
+        t0 = time.perf_counter(); func(); samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+def sheet_windows(ticks: pd.DataFrame, window: int = 300, step: int = NEW_ROWS) -> list:
+    """シートに直近 window 件が新しい順で表示され、ポーリングごとに step 件ずつ進む様子を DataFrame のリストで返す。"""
+    windows = []
+    for end in range(step, len(ticks) + step, step):
+        w = ticks.iloc[max(0, end - window):end].iloc[::-1].reset_index(drop=True); w.columns = range(4); windows.append(w)
+    return windows
+
+def tick_arrays(ticks: pd.DataFrame) -> tuple:
+    """合成約定を analyzer.update_arrays に渡す (id, 時刻ns, 価格, 出来高, 方向) の配列にする。"""
+    time_ms = np.array([ayumidb.encode_jikoku(t) for t in ticks['時刻']], dtype=np.int64)
+    return (np.arange(1, len(ticks) + 1, dtype=np.int64), ayumidb.to_epoch_ns(np.full(len(ticks), BENCH_DATE), time_ms),
+            ticks['価格'].to_numpy(dtype=float), ticks['出来高'].to_numpy(dtype=np.int64), np.where(ticks['方向'] == '2', 1, -1).astype(np.int8))
+
+def fill_database(conn, tick_sets: dict, trade_date: int = BENCH_DATE) -> None:
+    """{銘柄コード: 合成約定} を ticks テーブルへ直接書き込む (取り込み処理を通さない下準備)。"""
+    directory = ayumidb.TickerDirectory()
+    for code, ticks in tick_sets.items():
+        ticker_id, seen, records = directory.get(conn, code, create=True), {}, []
+        for jikoku, price, volume, direction in ticks.itertuples(index=False):
+            time_ms = ayumidb.encode_jikoku(jikoku); seq = seen.get(time_ms, 0); seen[time_ms] = seq + 1
+            records.append((ticker_id, trade_date, time_ms, ayumidb.encode_price(price), int(volume), 1 if direction == '2' else -1, seq))
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO ticks (ticker_id, trade_date, time_ms, price_x10, volume, side, seq) VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+
+# --- ステージ (いずれも (件数, 銘柄数, 繰り返し回数, 作業ディレクトリ) を受け取り、指標の辞書を返す) ---
+def bench_excel_read(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """Sheet1!E4 と Sheet2 の読み込み: 従来の pd.read_excel 2回 と AyumiWorkbookReader (初回/変更なし) を比較する。"""
+    path = os.path.join(workdir, f"ayumi_{n_rows}.xlsm")
+    synthetic.write_ayumi_xlsm(path, synthetic.generate_ticks(n_rows, seed=n_rows), extra_columns=4)
+
+    def read_pandas():
+        pd.read_excel(path, sheet_name='Sheet1', header=None, usecols="E", skiprows=3, nrows=1)
+        pd.read_excel(path, sheet_name='Sheet2', header=None)
+    def read_cold():
+        AyumiWorkbookReader(path).read()
+    reader = AyumiWorkbookReader(path); reader.read()
+    def read_unchanged_stat():
+        reader.read()
+    def read_unchanged_part():
+        os.utime(path)  # 更新時刻だけ変わり、中身は同じ (Excelの上書き保存に相当)
+        reader.read()
+    return {
+        'file_kb': os.path.getsize(path) / 1024,
+        'pandas_ms': timeit(read_pandas, repeat), 'reader_cold_ms': timeit(read_cold, repeat),
+        'reader_unchanged_part_ms': timeit(read_unchanged_part, repeat), 'reader_unchanged_stat_ms': timeit(read_unchanged_stat, repeat),
+    }
+
+def bench_schema(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """
+    旧 ayumi テーブルと ticks テーブルで、挿入時間・ファイルサイズ・範囲検索の時間を比較する。
+    シートには直近300件が新しい順に表示され、ポーリングごとに NEW_ROWS 件ずつ進む想定。
+    """
+    windows = sheet_windows(synthetic.generate_ticks(n_rows, seed=n_rows))
+    legacy_path, v2_path = os.path.join(workdir, f"legacy_{n_rows}.db"), os.path.join(workdir, f"v2_{n_rows}.db")
+    legacy, v2 = sqlite3.connect(legacy_path), sqlite3.connect(v2_path)
+    legacy.execute("PRAGMA journal_mode=WAL;"); legacy.executescript(LEGACY_SCHEMA); ayumidb.setup_database(v2)
+    direction = {'2': '買い', '1': '売り'}
+    t0 = time.perf_counter()
+    for w in windows:
+        with legacy:
+            legacy.executemany("INSERT OR IGNORE INTO ayumi (ticker_code, jikoku, price, dekidaka, baibai) VALUES (?, ?, ?, ?, ?)",
+                               [('7203', t, float(p), int(v), direction[d]) for t, p, v, d in w.itertuples(index=False)])
+    legacy_insert = (time.perf_counter() - t0) * 1000
+    ingestor = TickIngestor()
+    t0 = time.perf_counter()
+    for w in windows: ingestor.ingest(v2, '7203', w)
+    v2_insert = (time.perf_counter() - t0) * 1000
+    for conn in (legacy, v2): conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    ticker_id = ayumidb.TickerDirectory().get(v2, '7203')
+    tail = min(10000, n_rows)
+    result = {
+        'legacy_insert_ms': legacy_insert, 'v2_insert_ms': v2_insert,
+        'legacy_kb': os.path.getsize(legacy_path) / 1024, 'v2_kb': os.path.getsize(v2_path) / 1024,
+        'legacy_scan_ms': timeit(lambda: legacy.execute("SELECT id, jikoku, price, dekidaka, baibai FROM ayumi WHERE ticker_code = ? AND id > ? ORDER BY id", ('7203', n_rows - tail)).fetchall(), repeat),
+        'v2_scan_ms': timeit(lambda: v2.execute("SELECT id, trade_date, time_ms, price_x10, volume, side FROM ticks WHERE ticker_id = ? AND id > ? ORDER BY id", (ticker_id, n_rows - tail)).fetchall(), repeat),
+    }
+    legacy.close(); v2.close()
+    return result
+
+def bench_analyze(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """TradeAnalyzer.analyze (n_rows 件の一括分析) と、StreamingTradeAnalyzer への NEW_ROWS 件の追加を比較する。"""
+    arrays = tick_arrays(synthetic.generate_ticks(n_rows + NEW_ROWS * repeat, seed=n_rows))
+    ids, t_ns, prices, volumes, directions = (a[:n_rows] for a in arrays)
+    batch_df = pd.DataFrame({'id': ids, '時刻': pd.to_datetime(t_ns), '価格': prices, '出来高': volumes, '方向': np.where(directions > 0, '買い', '売り')})
+    analyzer, position = StreamingTradeAnalyzer(), [n_rows]
+    analyzer.update_arrays(ids, t_ns, prices, volumes, directions)
+    def stream_update():
+        a = position[0]; position[0] += NEW_ROWS
+        analyzer.update_arrays(*(x[a:a + NEW_ROWS] for x in arrays))
+    result = {'batch_analyze_ms': timeit(lambda: TradeAnalyzer().analyze(batch_df), repeat), 'stream_update_ms': timeit(stream_update, repeat)}
+    # 差分更新の結果は、保持中の約定を一括分析した結果と一致すること
+    a, b = max(0, position[0] - analyzer.ticks.capacity), position[0]
+    held = pd.DataFrame({'id': arrays[0][a:b], '時刻': pd.to_datetime(arrays[1][a:b]), '価格': arrays[2][a:b], '出来高': arrays[3][a:b],
+                         '方向': np.where(arrays[4][a:b] > 0, '買い', '売り')})
+    stream, batch = analyzer.last_result['summary'], TradeAnalyzer().analyze(held)['summary']
+    columns = list(StreamingTradeAnalyzer.PIVOT_COLUMNS)
+    if not np.array_equal(stream['breakdown'][columns].to_numpy(dtype=float), batch['breakdown'][columns].to_numpy(dtype=float)) or \
+            any(stream[k] != batch[k] for k in ('total_volume', 'signal', 'confidence', 'condition')):
+        raise RuntimeError(f"差分更新と一括分析の結果が一致しません: {stream['signal']} / {batch['signal']}")
+    return result
+
+def bench_ingest(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """銘柄ごとのシート (直近300件・NEW_ROWS 件ずつ進む) を、銘柄を順に回りながら取り込む。合計と1回あたりの時間を測る。"""
+    windows = [sheet_windows(ticks) for ticks in synthetic.generate_multi_ticks(n_rows, n_tickers, seed=n_rows).values()]
+    codes = synthetic.ticker_codes(n_tickers)
+    conn = sqlite3.connect(os.path.join(workdir, f"ingest_{n_rows}_{n_tickers}.db")); ayumidb.setup_database(conn)
+    ingestor, polls = TickIngestor(), 0
+    t0 = time.perf_counter()
+    for i in range(max(len(w) for w in windows)):
+        for code, w in zip(codes, windows):
+            if i < len(w): ingestor.ingest(conn, code, w[i]); polls += 1
+    total = (time.perf_counter() - t0) * 1000
+    conn.close()
+    return {'total_ms': total, 'per_poll_ms': total / max(polls, 1)}
+
+def bench_collector(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """
+    銘柄ごとのブック (約定 rows/tickers 件) を Collector.poll_once で読む。初回 (全件の取り込み)、
+    全ブックに NEW_ROWS 件ずつ追加された後、何も変わっていないとき、の3通りを測る。
+    """
+    tick_sets = synthetic.generate_multi_ticks(n_rows + NEW_ROWS * n_tickers * repeat, n_tickers, seed=n_rows)
+    sources = [{**DEFAULT_SOURCE, 'name': 'main' if i == 0 else f'source{i}', 'path': os.path.join(workdir, f"collector_{n_rows}_{n_tickers}_{i}.xlsm")}
+               for i in range(n_tickers)]
+    shown = [max(1, n_rows // n_tickers)]
+    def write_books():
+        for source, (code, ticks) in zip(sources, tick_sets.items()):
+            synthetic.write_ayumi_xlsm(source['path'], ticks.iloc[:shown[0]], ticker=code)
+    def add_rows():
+        shown[0] += NEW_ROWS; write_books()
+    write_books()
+    conn = sqlite3.connect(os.path.join(workdir, f"collector_{n_rows}_{n_tickers}.db")); ayumidb.setup_database(conn)
+    collector = Collector(conn, sources, ingestor=TickIngestor())
+    with contextlib.redirect_stdout(io.StringIO()):  # 取り込みごとのログ出力は計測に含めない
+        cold = timeit(collector.poll_once, 1)
+        new_rows = timeit(collector.poll_once, repeat, setup=add_rows)
+        idle = timeit(collector.poll_once, repeat)
+    collector.close(); conn.close()
+    return {'cold_poll_ms': cold, 'poll_new_rows_ms': new_rows, 'idle_poll_ms': idle}
+
+def bench_sources(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """
+    監視対象の種類ごとに、n_rows 件を Collector.poll_once で読み込んでDBに入れる速さ (件/秒) を測る。
+    excel はブック全体、csv はファイル全体 (初回) と NEW_ROWS 行ずつの追記、replay は保存済みの1日分を一括 (speed=0) で流す。
+    """
+    ticks = synthetic.generate_ticks(n_rows + NEW_ROWS * repeat, seed=n_rows)
+    base, extra = ticks.iloc[:n_rows], ticks.iloc[n_rows:]
+    book, csv_path, stored = (os.path.join(workdir, f"sources_{n_rows}.{ext}") for ext in ('xlsm', 'csv', 'db'))
+    synthetic.write_ayumi_xlsm(book, base, ticker='7203')
+    base.to_csv(csv_path, index=False)
+    conn = sqlite3.connect(stored); ayumidb.setup_database(conn); fill_database(conn, {'7203': base}); conn.close()
+    def ingest_rate(name: str, source: dict, setup=None) -> tuple:
+        """(件/秒, poll_once 1回あたりのミリ秒) 。setup があれば追記してから poll_once を repeat 回。"""
+        conn = sqlite3.connect(os.path.join(workdir, f"sources_{n_rows}_{name}.db")); ayumidb.setup_database(conn)
+        collector = Collector(conn, [{'name': 'main', **source}], ingestor=TickIngestor())
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter(); inserted = collector.poll_once(); elapsed = time.perf_counter() - t0
+            tail_ms = timeit(collector.poll_once, repeat, setup=setup) if setup else None
+        collector.close(); conn.close()
+        return inserted / elapsed, tail_ms
+    def append_csv(position=[0]):
+        a = position[0]; position[0] += NEW_ROWS
+        extra.iloc[a:a + NEW_ROWS].to_csv(csv_path, mode='a', header=False, index=False)
+    result = {'excel_rows_per_sec': ingest_rate('excel', {**DEFAULT_SOURCE, 'path': book})[0]}
+    result['csv_rows_per_sec'], result['csv_tail_poll_ms'] = ingest_rate('csv', {'type': 'csv', 'path': csv_path, 'ticker': '7203'}, append_csv)
+    result['replay_rows_per_sec'] = ingest_rate('replay', {'type': 'replay', 'db_path': stored, 'ticker': '7203', 'trade_date': BENCH_DATE, 'speed': 0})[0]
+    return result
+
+def bench_storage(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """
+    n_rows 件を NEW_ROWS 件ずつ取り込む長いセッションで、既定の接続 (before) と ayumidb.connect + StorageManager (after) を比べる。
+    挿入1回の p50/p99、取り込みの途中で読み手が直近1万件を読む時間、WALの最大・終了時の大きさを測る。
+    after は 200 回の取り込みごとに約定が途切れたとみなして PASSIVE で、終了時に TRUNCATE で書き戻す (収集スクリプトでは maybe_run が行う)。
+    """
+    from ayumistore import StorageManager
+    ticks = synthetic.generate_ticks(n_rows, seed=n_rows)
+    batches = [ticks.iloc[a:a + NEW_ROWS].reset_index(drop=True) for a in range(0, n_rows, NEW_ROWS)]
+    result = {}
+    for label in ('before', 'after'):
+        path = os.path.join(workdir, f"storage_{n_rows}_{label}.db")
+        if label == 'before':
+            writer = sqlite3.connect(path); ayumidb.setup_database(writer); storage = None
+            reader = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        else:
+            writer = ayumidb.connect(path); ayumidb.setup_database(writer); storage = StorageManager(writer)
+            reader = ayumidb.connect(path, 'reader')
+        ingestor, inserts, queries, wal_peak = TickIngestor(), [], [], 0
+        wal_size = lambda: os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0
+        ticker_id = ayumidb.TickerDirectory().get(writer, '7203', create=True)
+        query = "SELECT id, trade_date, time_ms, price_x10, volume, side FROM ticks WHERE ticker_id = ? AND id > ? ORDER BY id"
+        for i, batch in enumerate(batches):
+            t0 = time.perf_counter(); ingestor.ingest(writer, '7203', batch, append=True, trade_date=BENCH_DATE); inserts.append(time.perf_counter() - t0)
+            if i % 100 == 99: wal_peak = max(wal_peak, wal_size())
+            if storage and i % 200 == 199: storage.checkpoint('PASSIVE')
+            if i % 100 == 99:
+                t0 = time.perf_counter(); reader.execute(query, (ticker_id, (i + 1) * NEW_ROWS - 10000)).fetchall(); queries.append(time.perf_counter() - t0)
+        reader.close()
+        if storage: storage.checkpoint('TRUNCATE')
+        wal = wal_size(); writer.close()
+        result.update({f'{label}_insert_p50_ms': np.percentile(inserts, 50) * 1000, f'{label}_insert_p99_ms': np.percentile(inserts, 99) * 1000,
+                       f'{label}_query_ms': np.median(queries) * 1000 if queries else 0.0,
+                       f'{label}_wal_peak_kb': max(wal_peak, wal) / 1024, f'{label}_wal_kb': wal / 1024})
+    return result
+
+def bench_query(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """
+    TUIの update_panels が計算ステージ (AnalysisStage) に依頼する 取得+分析 を測る。
+    銘柄切替直後 (直近1万件までを読んで分析)、書き出した分析状態から再開する銘柄切替直後、NEW_ROWS 件が届いた後の差分取得の3通り。
+    """
+    from ayumianalysis import AnalysisStage
+    tick_sets = synthetic.generate_multi_ticks(n_rows, n_tickers, seed=n_rows)
+    db_path = os.path.join(workdir, f"query_{n_rows}_{n_tickers}.db")
+    conn = sqlite3.connect(db_path); ayumidb.setup_database(conn); fill_database(conn, tick_sets)
+    # compact は銘柄ごとの最新の取引日をDBに残すので、翌日のセッションを少し入れて BENCH_DATE を移せるようにする
+    fill_database(conn, {c: ticks.iloc[:100] for c, ticks in tick_sets.items()}, trade_date=BENCH_DATE + 1)
+    code = next(iter(tick_sets))
+    extra = synthetic.generate_ticks(NEW_ROWS * repeat, seed=n_rows + 1)
+    stage, generation, position = AnalysisStage(db_path), [0], [0]
+    def switch():
+        generation[0] += 1; stage.submit(code, generation[0]).result()
+    def add_rows():
+        a = position[0]; position[0] += NEW_ROWS
+        fill_database(conn, {code: extra.iloc[a:a + NEW_ROWS]}, trade_date=BENCH_DATE + 1)
+    state_stage, state_generation = AnalysisStage(db_path, state_dir=os.path.join(workdir, f"state_{n_rows}_{n_tickers}")), [0]
+    def state_switch():
+        state_generation[0] += 1; state_stage.submit(code, state_generation[0]).result()
+    state_switch()  # 状態を書き出す
+    result = {'switch_ms': timeit(switch, repeat), 'state_switch_ms': timeit(state_switch, repeat), 'incremental_ms': timeit(lambda: stage.submit(code, generation[0]).result(), repeat, setup=add_rows)}
+    stage.close(); state_stage.close(); conn.close()
+    return result
+
+def bench_dashboard(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """
+    全銘柄に NEW_ROWS 件ずつ届いた後の1回のポーリングを、銘柄一覧 (DashboardStage: まとめて1回の取得 + ワーカーでの分析) と、
+    銘柄ごとに別々の AnalysisStage (銘柄数ぶんTUIを起動するのに相当) とで比べる。
+    """
+    from ayumianalysis import AnalysisStage, DashboardStage, DASHBOARD_WORKERS
+    tick_sets = synthetic.generate_multi_ticks(n_rows, n_tickers, seed=n_rows)
+    db_path = os.path.join(workdir, f"dashboard_{n_rows}_{n_tickers}.db")
+    conn = sqlite3.connect(db_path); ayumidb.setup_database(conn); fill_database(conn, tick_sets)
+    extra = {code: synthetic.generate_ticks(NEW_ROWS * repeat * 2, seed=n_rows + i) for i, code in enumerate(tick_sets)}
+    position = [0]
+    def add_rows():
+        a = position[0]; position[0] += NEW_ROWS
+        fill_database(conn, {code: ticks.iloc[a:a + NEW_ROWS] for code, ticks in extra.items()}, trade_date=BENCH_DATE + 1)
+    dashboard = DashboardStage(db_path, list(tick_sets))
+    stages = {code: AnalysisStage(db_path) for code in tick_sets}
+    result = {'dashboard_cold_ms': timeit(lambda: dashboard.submit().result(), 1)}
+    result['dashboard_poll_ms'] = timeit(lambda: dashboard.submit().result(), repeat, setup=add_rows)
+    for code, stage in stages.items(): stage.submit(code, 1).result()
+    result['separate_poll_ms'] = timeit(lambda: [future.result() for future in [stage.submit(code, 1) for code, stage in stages.items()]], repeat, setup=add_rows)
+    result['workers'] = DASHBOARD_WORKERS
+    dashboard.close(); conn.close()
+    for stage in stages.values(): stage.close()
+    return result
+
+def bench_log(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """約定ログ (TradeLogWidget) の更新と、画面に見えている行の描画を、ヘッドレスのTextualアプリ上で測る。"""
+    from textual.app import App
+    from TUI_App import TradeLogWidget, TradeLogView
+    arrays = tick_arrays(synthetic.generate_ticks(n_rows + NEW_ROWS * repeat, seed=n_rows))
+    analyzer, position = StreamingTradeAnalyzer(), [n_rows]
+    analyzer.update_arrays(*(a[:n_rows] for a in arrays))
+    def add_rows():
+        a = position[0]; position[0] += NEW_ROWS
+        analyzer.update_arrays(*(x[a:a + NEW_ROWS] for x in arrays))
+
+    class LogApp(App):
+        def compose(self): yield TradeLogWidget()
+
+    async def run() -> dict:
+        app = LogApp()
+        async with app.run_test(size=(80, 50)) as pilot:
+            widget, view = app.query_one(TradeLogWidget), app.query_one(TradeLogView)
+            widget.update_log(analyzer.ticks.snapshot(view.max_rows)); await pilot.pause()
+            def render_visible():
+                for y in range(view.size.height): view.render_line(y)
+            return {
+                'update_log_ms': timeit(lambda: widget.update_log(analyzer.ticks.snapshot(view.max_rows)), repeat, setup=add_rows),
+                'render_visible_ms': timeit(render_visible, repeat),
+            }
+    return asyncio.run(run())
+
+def bench_archive(n_rows: int, n_tickers: int, repeat: int, workdir: str) -> dict:
+    """
+    過去日の走査: DBから1銘柄・1日分を読む場合と、アーカイブ (.npy の memmap) から読む場合を比較する。
+    あわせて、全銘柄分をアーカイブへ移す時間と、移した後のDBのサイズを測る。
+    """
+    tick_sets = synthetic.generate_multi_ticks(n_rows, n_tickers, seed=n_rows)
+    db_path, archive_dir = os.path.join(workdir, f"archive_{n_rows}_{n_tickers}.db"), os.path.join(workdir, f"archive_{n_rows}_{n_tickers}")
+    conn = sqlite3.connect(db_path); ayumidb.setup_database(conn); fill_database(conn, tick_sets)
+    # compact は銘柄ごとの最新の取引日をDBに残すので、翌日のセッションを少し入れて BENCH_DATE を移せるようにする
+    fill_database(conn, {c: ticks.iloc[:100] for c, ticks in tick_sets.items()}, trade_date=BENCH_DATE + 1)
+    code = next(iter(tick_sets))
+    ticker_id = ayumidb.TickerDirectory().get(conn, code)
+    def scan_db():
+        rows = conn.execute("SELECT id, time_ms, price_x10, volume, side FROM ticks WHERE ticker_id = ? AND trade_date = ? ORDER BY time_ms, seq", (ticker_id, BENCH_DATE)).fetchall()
+        np.array(rows, dtype=np.int64)[:, 2].sum()
+    def scan_archive():
+        int(ayumiarchive.load_partition(code, BENCH_DATE, archive_dir, columns=('price_x10',))['price_x10'].sum())
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db_kb = os.path.getsize(db_path) / 1024
+    result = {'db_scan_ms': timeit(scan_db, repeat)}
+    t0 = time.perf_counter(); ayumiarchive.compact(conn, archive_dir, before=BENCH_DATE + 1); result['compact_ms'] = (time.perf_counter() - t0) * 1000
+    if ayumiarchive.load_partition(code, BENCH_DATE, archive_dir) is None: raise RuntimeError(f"{BENCH_DATE} {code} がアーカイブされていません: {archive_dir}")
+    conn.execute("VACUUM"); conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    result.update({'archive_scan_ms': timeit(scan_archive, repeat), 'db_kb_before': db_kb, 'db_kb_after': os.path.getsize(db_path) / 1024})
+    conn.close()
+    return result
+
+# ステージ名 -> (関数, 銘柄数の軸を持つか)
+STAGES = {
+    'excel': (bench_excel_read, False), 'schema': (bench_schema, False), 'analyze': (bench_analyze, False), 'ingest': (bench_ingest, True),
+    'collector': (bench_collector, True), 'query': (bench_query, True), 'log': (bench_log, False), 'archive': (bench_archive, True),
+    'sources': (bench_sources, False), 'storage': (bench_storage, False), 'dashboard': (bench_dashboard, True),
+}
+
+def environment() -> dict:
+    """結果を比べるときに必要な実行環境の情報。"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+        'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__, 'sqlite': sqlite3.sqlite_version,
+    }
+
+def run_benchmarks(stages: list, sizes: list, ticker_counts: list, repeat: int, workdir: str) -> list:
+    """各ステージを 件数 × 銘柄数 の組み合わせで実行して表を表示し、{stage, rows, tickers, metric, value} のレコードを返す。"""
+    records = []
+    for stage in stages:
+        func, per_ticker = STAGES[stage]
+        table = []
+        for n_rows in sizes:
+            for n_tickers in (ticker_counts if per_ticker else [1]):
+                if n_tickers > n_rows: continue
+                result = func(n_rows, n_tickers, repeat, workdir)
+                table.append({'rows': n_rows, 'tickers': n_tickers, **result})
+                records += [{'stage': stage, 'rows': n_rows, 'tickers': n_tickers, 'metric': k, 'value': float(v)} for k, v in result.items()]
+        print(f"--- {stage} ---")
+        print(pd.DataFrame(table).to_string(index=False, float_format=lambda v: f"{v:,.2f}"), flush=True)
+    return records
+
+def compare(records: list, baseline_path: str) -> pd.DataFrame:
+    """前回の結果JSONと共通の (stage, rows, tickers, metric) を突き合わせ、before / after / ratio (今回/前回) の表を返す。"""
+    with open(baseline_path, encoding='utf-8') as f:
+        before = pd.DataFrame(json.load(f)['results'])
+    keys = ['stage', 'rows', 'tickers', 'metric']
+    merged = before.merge(pd.DataFrame(records), on=keys, suffixes=('_before', '_after'))
+    merged['ratio'] = merged['value_after'] / merged['value_before'].replace(0, np.nan)
+    return merged.rename(columns={'value_before': 'before', 'value_after': 'after'})[keys + ['before', 'after', 'ratio']]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ayumi ホットパスのベンチマーク")
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help="約定の件数 (全銘柄の合計)")
+    parser.add_argument('--tickers', type=int, nargs='+', default=[1, 10, 50], help="銘柄数 (ingest/collector/query/archive/dashboard のみ)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="結果を書き出すJSONファイル")
+    parser.add_argument('--compare', help="比較対象 (前回) の結果JSONファイル")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        records = run_benchmarks(args.stages, args.sizes, args.tickers, args.repeat, workdir)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'results': records}, f, ensure_ascii=False, indent=1)
+        print(f"結果を書き出しました: {args.output}")
+    if args.compare:
+        print(f"--- 比較 ({args.compare} -> 今回) ---")
+        print(compare(records, args.compare).to_string(index=False, float_format=lambda v: f"{v:,.3f}"))
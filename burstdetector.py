@@ -0,0 +1,240 @@
+# coding: utf-8
+"""
+約定時刻 (イベント時刻) にもとづくバースト検知。ポーリングの間隔や1回に読めた件数には依存しない。
+1秒ごとの約定件数・出来高・買い出来高を集計し、完了した秒で件数の EWMA (平均・2乗平均) を更新する。
+集計中の秒の件数が基準から標準偏差の sensitivity 倍を超えた時点で、その秒を待たずにバーストとする。
+更新は新しい約定の数に比例し (秒ごとに O(1))、直近 RING_SEC 秒の1秒集計はリングバッファに残る。
+
+収集スクリプトでは BurstMonitor が取り込みと同じトランザクションで bursts テーブルに書き、TUIは新着通知を受けて読む。
+保存済みの約定で感度を調整するときは、このファイルを直接実行する:
+
+    python burstdetector.py c:/ayumi/market_data.db --tickers 7203 --from 2026-10-01 --sensitivity 3 4 5 6
+"""
+import os
+import sys
+import time
+import argparse
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+BURST_SENSITIVITY = 4.0     # 基準から標準偏差の何倍多ければバーストとするか
+BASELINE_HALFLIFE_SEC = 300 # 基準 (1秒あたり件数の EWMA) の半減期
+MIN_TRADES = 5              # 1秒の約定がこれ未満ならバーストにしない
+WARMUP_SEC = 60             # 基準ができるまで (観測した秒数) は検知しない
+MAX_GAP_SEC = 60            # 約定のない秒を基準に織り込む上限 (昼休み・寄り前で基準が縮みきらないように)
+SIDE_RATIO = 0.8            # その秒の出来高に占める買い (売り) の比率がこれ以上なら買い (売り) バースト
+COOLDOWN_SEC = 10           # 同じ向きのバーストを続けて出さない間隔
+RING_SEC = 300
+SEED_SEC = 1800             # 収集スクリプトの起動時に基準を作るため読む直近の1秒足の数
+
+# side は 1=買い, -1=売り, 0=偏りなし。time_ms はバーストの秒の開始時刻。score は基準から標準偏差の何倍か
+BurstEvent = namedtuple('BurstEvent', 'trade_date time_ms side trades volume buy_ratio score')
+BURST_LABELS = {1: '買いバースト', -1: '売りバースト', 0: 'バースト'}
+
+class BurstDetector:
+    """1銘柄分の検知器。約定は時刻順に update へ渡す (前の秒より古い約定は集計中の秒に加える)。"""
+    def __init__(self, sensitivity: float = BURST_SENSITIVITY, halflife_sec: float = BASELINE_HALFLIFE_SEC, min_trades: int = MIN_TRADES,
+                 warmup_sec: int = WARMUP_SEC, side_ratio: float = SIDE_RATIO, cooldown_sec: int = COOLDOWN_SEC):
+        self.sensitivity, self.min_trades, self.warmup_sec, self.side_ratio, self.cooldown_sec = sensitivity, min_trades, warmup_sec, side_ratio, cooldown_sec
+        self.decay = 0.5 ** (1 / halflife_sec)
+        self.reset()
+
+    def reset(self) -> None:
+        self.trade_date = None
+        self.second = None                    # 集計中の秒 (0時からの秒)
+        self.trades = self.volume = self.buy_volume = self.sell_volume = 0
+        self.mean = self.mean_sq = 0.0        # 完了した秒の件数の EWMA と、件数の2乗の EWMA
+        self.observed = 0                     # 基準に織り込んだ秒数
+        self.fired = False                    # 集計中の秒で検知済みか
+        self.last_fired = {}                  # 向き -> 最後に検知した (取引日, 秒)
+        self.ring = np.zeros((RING_SEC, 4), dtype=np.int64)  # 秒 % RING_SEC -> (秒, 件数, 出来高, 買い出来高)
+        self.ring[:, 0] = -1
+
+    def baseline(self) -> tuple:
+        """(1秒あたり件数の平均, 標準偏差)。標準偏差は ポアソン分布相当 (√平均) と 1 を下限にする。"""
+        variance = max(self.mean_sq - self.mean * self.mean, self.mean, 1.0)
+        return self.mean, variance ** 0.5
+
+    def _close_second(self, next_second: int | None) -> None:
+        """集計中の秒を基準に織り込み、next_second までの約定のない秒 (MAX_GAP_SEC まで) も 0件として織り込む。"""
+        if self.second is not None:
+            self.ring[self.second % RING_SEC] = (self.second, self.trades, self.volume, self.buy_volume)
+            self.mean = self.decay * self.mean + (1 - self.decay) * self.trades
+            self.mean_sq = self.decay * self.mean_sq + (1 - self.decay) * self.trades * self.trades
+            self.observed += 1
+            if next_second is not None and next_second > self.second + 1:
+                gap = min(next_second - self.second - 1, MAX_GAP_SEC)
+                self.mean *= self.decay ** gap; self.mean_sq *= self.decay ** gap; self.observed += gap
+        self.second, self.fired = next_second, False
+        self.trades = self.volume = self.buy_volume = self.sell_volume = 0
+
+    def _check(self) -> BurstEvent | None:
+        if self.fired or self.observed < self.warmup_sec or self.trades < self.min_trades: return None
+        mean, std = self.baseline()
+        score = (self.trades - mean) / std
+        if score < self.sensitivity: return None
+        total = self.buy_volume + self.sell_volume
+        buy_ratio = self.buy_volume / total if total else 0.5
+        side = 1 if buy_ratio >= self.side_ratio else -1 if buy_ratio <= 1 - self.side_ratio else 0
+        last = self.last_fired.get(side)
+        if last is not None and last[0] == self.trade_date and self.second - last[1] < self.cooldown_sec: return None
+        self.fired = True; self.last_fired[side] = (self.trade_date, self.second)
+        return BurstEvent(self.trade_date, self.second * 1000, side, self.trades, self.volume, buy_ratio, score)
+
+    def _enter(self, trade_date: int, second: int) -> None:
+        """約定の秒に進める (前の秒は基準に織り込む)。"""
+        if trade_date != self.trade_date:
+            self._close_second(None); self.trade_date = trade_date; self.second = second
+        elif second > self.second:
+            self._close_second(second)
+
+    def _needed(self) -> int | None:
+        """集計中の秒で検知に必要な件数の目安 (この件数の1件手前から1件ずつ確かめる)。検知しない状態なら None。"""
+        if self.fired or self.observed < self.warmup_sec: return None
+        mean, std = self.baseline()
+        return max(self.min_trades, int(np.ceil(mean + self.sensitivity * std)))
+
+    def add_second(self, trade_date: int, second: int, trades: int, volume: int, buy_volume: int, sell_volume: int, alert: bool = True) -> BurstEvent | None:
+        """1秒分 (の一部) の集計を加え、検知したら BurstEvent を返す。alert が False なら基準を作るだけ。"""
+        self._enter(trade_date, second)
+        self.trades += trades; self.volume += volume; self.buy_volume += buy_volume; self.sell_volume += sell_volume
+        return self._check() if alert else None
+
+    def update(self, trade_date, time_ms, volume, side, alert: bool = True) -> list:
+        """
+        新しい約定 (配列。trade_date はスカラーでもよい) を加え、検知した BurstEvent のリストを返す。
+        秒ごとにまとめて加え、しきい値に届く秒だけ1件ずつ確かめるので、どう区切って渡しても同じ約定で検知する。
+        """
+        time_ms = np.asarray(time_ms, dtype=np.int64)
+        if not len(time_ms): return []
+        trade_date = np.broadcast_to(np.asarray(trade_date, dtype=np.int64), time_ms.shape)
+        volume, side = np.asarray(volume, dtype=np.int64), np.asarray(side)
+        seconds = time_ms // 1000
+        starts = np.r_[0, np.flatnonzero((np.diff(seconds) != 0) | (np.diff(trade_date) != 0)) + 1]
+        ends = np.r_[starts[1:], len(seconds)]
+        cum = np.zeros((len(seconds) + 1, 3), dtype=np.int64)  # 出来高・買い出来高・売り出来高の累積
+        np.cumsum(np.column_stack([volume, np.where(side > 0, volume, 0), np.where(side < 0, volume, 0)]), axis=0, out=cum[1:])
+        def add(a, b):
+            v, buy, sell = (cum[b] - cum[a]).tolist()
+            self.trades += b - a; self.volume += v; self.buy_volume += buy; self.sell_volume += sell
+        events = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            self._enter(int(trade_date[start]), int(seconds[start]))
+            needed = self._needed() if alert else None
+            if needed is None or self.trades + end - start < needed:
+                add(start, end); continue
+            split = start + max(needed - self.trades - 1, 0)
+            add(start, split)
+            for j in range(split, end):
+                add(j, j + 1)
+                event = self._check()
+                if event:
+                    events.append(event); add(j + 1, end); break
+        return events
+
+    def recent(self, seconds: int = 60) -> pd.DataFrame:
+        """リングバッファにある直近 seconds 秒 (完了した秒) の 件数・出来高・買い比率。"""
+        rows = self.ring[self.ring[:, 0] >= 0]
+        rows = rows[np.argsort(rows[:, 0])][-seconds:]
+        return pd.DataFrame({'second': rows[:, 0], 'trades': rows[:, 1], 'volume': rows[:, 2],
+                             'buy_ratio': np.divide(rows[:, 3], rows[:, 2], out=np.full(len(rows), np.nan), where=rows[:, 2] > 0)})
+
+class BurstMonitor:
+    """
+    収集スクリプト側で銘柄ごとの BurstDetector を持ち、取り込んだ約定を渡して、検知したバーストを bursts テーブルに書く。
+    銘柄を初めて見たときは、保存済みの1秒足 (直近 SEED_SEC 本) で基準を作ってから検知を始める。
+    """
+    def __init__(self, **params):
+        self.params = params
+        self.detectors = {}  # ticker_id -> BurstDetector
+
+    def _detector(self, conn, ticker_id: int, trade_date: int, time_ms: int) -> BurstDetector:
+        detector = self.detectors.get(ticker_id)
+        if detector is None:
+            detector = self.detectors[ticker_id] = BurstDetector(**self.params)
+            rows = conn.execute(
+                "SELECT trade_date, start_ms, trades, volume, buy_volume, sell_volume FROM bars "
+                "WHERE ticker_id = ? AND resolution_ms = 1000 AND (trade_date, start_ms) < (?, ?) ORDER BY trade_date DESC, start_ms DESC LIMIT ?",
+                (ticker_id, trade_date, time_ms - time_ms % 1000, SEED_SEC)
+            ).fetchall()[::-1]
+            for d, start_ms, trades, volume, buy_volume, sell_volume in rows:
+                detector.add_second(d, start_ms // 1000, trades, volume, buy_volume, sell_volume, alert=False)
+        return detector
+
+    def observe(self, conn, ticker_id: int, records: list) -> list:
+        """
+        records (ticks に挿入した (ticker_id, trade_date, time_ms, price_x10, volume, side, seq) のリスト) を検知器に渡し、
+        検知したバーストを呼び出し側のトランザクションで bursts に書いて返す。
+        """
+        if not records: return []
+        _, trade_date, time_ms, _, volume, side, _ = (np.array(column) for column in zip(*records))
+        detector = self._detector(conn, ticker_id, int(trade_date[0]), int(time_ms[0]))
+        events = detector.update(trade_date, time_ms, volume, side)
+        if events:
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO bursts (ticker_id, trade_date, time_ms, side, trades, volume, buy_ratio, score, detected_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(ticker_id, *event, now) for event in events]
+            )
+        return events
+
+def describe(event) -> str:
+    """BurstEvent (か bursts の同じ並びの行) を1行の文にする。"""
+    t = event.time_ms // 1000
+    return (f"{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d} {BURST_LABELS[event.side]} "
+            f"{event.trades}件/秒 出来高{event.volume:,} 買い比率{event.buy_ratio:.0%} (基準比 {event.score:.1f}σ)")
+
+def detect_day(day: np.ndarray, trade_date: int, batch_ms: int = 0, **params) -> list:
+    """
+    保存済みの1銘柄・1日 (replay.load_day の配列) を検知器に流し、BurstEvent のリストを返す。
+    batch_ms > 0 なら、その幅の時刻区間ごとにまとめて渡す (収集スクリプトの取り込み単位の再現。結果は同じになる)。
+    """
+    detector, events = BurstDetector(**params), []
+    time_ms, volume, side = day[:, 1], day[:, 3], day[:, 4]
+    if batch_ms <= 0: return detector.update(trade_date, time_ms, volume, side)
+    bounds = np.r_[0, np.flatnonzero(np.diff(time_ms // batch_ms)) + 1, len(time_ms)]
+    for a, b in zip(bounds[:-1], bounds[1:]): events += detector.update(trade_date, time_ms[a:b], volume[a:b], side[a:b])
+    return events
+
+if __name__ == "__main__":
+    from datetime import datetime
+    from replay import list_tasks, load_day
+    from ayumidb import connect, date_to_int
+    parse_date = lambda text: date_to_int(datetime.strptime(text, '%Y-%m-%d').date()) if text else None
+    parser = argparse.ArgumentParser(description="保存済みの約定でバースト検知を再現し、感度ごとの検知数を比べる")
+    parser.add_argument('db_path')
+    parser.add_argument('--tickers', nargs='+')
+    parser.add_argument('--from', dest='date_from', help="YYYY-MM-DD")
+    parser.add_argument('--to', dest='date_to', help="YYYY-MM-DD")
+    parser.add_argument('--archive', help="アーカイブ済みの過去日も読む")
+    parser.add_argument('--sensitivity', type=float, nargs='+', default=[BURST_SENSITIVITY])
+    parser.add_argument('--halflife', type=float, default=BASELINE_HALFLIFE_SEC)
+    parser.add_argument('--min-trades', type=int, default=MIN_TRADES)
+    parser.add_argument('--events', action='store_true', help="検知したバーストを1件ずつ表示する")
+    parser.add_argument('--out', help="検知したバーストを書き出すCSV")
+    args = parser.parse_args()
+    if not os.path.exists(args.db_path):
+        print(f"エラー: DBファイルが見つかりません: {args.db_path}"); sys.exit(1)
+    conn = connect(args.db_path, 'reader')
+    tasks = list_tasks(conn, args.tickers, parse_date(args.date_from), parse_date(args.date_to), args.archive)
+    records, summary = [], []
+    started = time.perf_counter()
+    for code, trade_date in tasks:
+        day = load_day(conn, code, trade_date, args.archive)
+        for sensitivity in args.sensitivity:
+            events = detect_day(day, trade_date, sensitivity=sensitivity, halflife_sec=args.halflife, min_trades=args.min_trades)
+            summary.append({'ticker': code, 'date': trade_date, 'sensitivity': sensitivity, 'ticks': len(day), 'bursts': len(events),
+                            'buy': sum(e.side > 0 for e in events), 'sell': sum(e.side < 0 for e in events)})
+            records += [{'ticker': code, 'sensitivity': sensitivity, **e._asdict()} for e in events]
+            if args.events:
+                for e in events: print(f"  [{code} {trade_date} σ={sensitivity}] {describe(e)}")
+    conn.close()
+    if not summary:
+        print("対象の約定がありません。"); sys.exit(0)
+    table = pd.DataFrame(summary)
+    print(table.to_string(index=False))
+    print(table.groupby('sensitivity')[['ticks', 'bursts', 'buy', 'sell']].sum().to_string())
+    print(f"{len(tasks)} 銘柄日を {time.perf_counter() - started:,.2f}秒で処理しました。")
+    if args.out:
+        pd.DataFrame(records).to_csv(args.out, index=False, encoding='utf-8-sig'); print(f"書き出しました: {args.out}")
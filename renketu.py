@@ -1,31 +1,212 @@
-import pandas as pd
-from openpyxl import Workbook
-
-# Excelファイルのパスを指定
-input_excel_path = 'c:/ayumi/updated_data.xlsx'  # 入力ファイルのパスに変更してください
-output_excel_path = 'c:/ayumi/consolidated_data.xlsx'  # 新しい出力ファイルのパス
-
-# 新しいワークブックとシートを作成
-wb = Workbook()
-ws_consolidated = wb.active
-ws_consolidated.title = "Consolidated"
-
-# パンダスでExcelファイルを読み込む
-xls = pd.ExcelFile(input_excel_path)
-
-# すべてのシートをループ処理
-first_sheet_processed = False
-for sheet_name in xls.sheet_names:
-    # シートごとにDataFrameを読み込む
-    df = pd.read_excel(xls, sheet_name=sheet_name)
-    if not first_sheet_processed:
-        # 最初のシートからヘッダーを追加
-        ws_consolidated.append(df.columns.tolist())
-        first_sheet_processed = True
-    # データ行を追加
-    for row in df.itertuples(index=False):
-        ws_consolidated.append(row)
-
-# 新しいExcelファイルに保存
-wb.save(output_excel_path)
-print(f'データが結合され、{output_excel_path} に保存されました。')
+# coding: utf-8
+"""
+ayumiac.py が updated_data.xlsx に5秒ごとに追加するシートを、1つの表に結合する。
+入力は読み取り専用モードでシートを1枚ずつストリームで読み、出力へ1行ずつ書くので、メモリ使用量は入力の大きさによらず一定。
+出力形式は出力先の拡張子で選ぶ: .xlsx (書き込み専用ブック) / .db・.sqlite (SQLite) / .csv
+前回どのシートまで結合したかを記録し、次回はその続きのシートだけを読む (--full で最初から作り直す)。
+
+    python renketu.py --input c:/ayumi/updated_data.xlsx --output c:/ayumi/consolidated_data.db
+"""
+import os
+import csv
+import json
+import sqlite3
+import argparse
+from datetime import datetime, date, time as dt_time
+from openpyxl import Workbook, load_workbook
+
+INPUT_EXCEL_PATH = 'c:/ayumi/updated_data.xlsx'
+OUTPUT_PATH = 'c:/ayumi/consolidated_data.xlsx'
+SHEET_TITLE = 'Consolidated'
+TABLE_NAME = 'consolidated'
+COMMIT_EVERY = 100  # 何シートごとに出力と進捗を確定させるか
+
+def _plain(value):
+    """SQLite / CSV に書ける値にする (日付・時刻は文字列)。"""
+    if isinstance(value, datetime): return value.isoformat(sep=' ')
+    if isinstance(value, (date, dt_time)): return value.isoformat()
+    return value
+
+def _progress_path(output_path: str) -> str:
+    return output_path + '.progress.json'
+
+def _load_progress_file(output_path: str) -> dict | None:
+    if not (os.path.exists(output_path) and os.path.exists(_progress_path(output_path))): return None
+    with open(_progress_path(output_path), encoding='utf-8') as f:
+        return json.load(f)
+
+def _save_progress_file(output_path: str, progress: dict) -> None:
+    tmp = _progress_path(output_path) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(progress, f, ensure_ascii=False)
+    os.replace(tmp, _progress_path(output_path))
+
+class SqliteSink:
+    """consolidated テーブルへ書き込む。進捗は同じDBの consolidate_progress に、行と同じトランザクションで記録する。"""
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS consolidate_progress (id INTEGER PRIMARY KEY CHECK (id = 1), progress TEXT NOT NULL)")
+        self.insert_sql = None
+
+    def load_progress(self) -> dict | None:
+        row = self.conn.execute("SELECT progress FROM consolidate_progress WHERE id = 1").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def begin(self, header: list, resume: bool) -> None:
+        if not resume:
+            self.conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}"); self.conn.execute("DELETE FROM consolidate_progress")
+        columns = ', '.join('"' + name.replace('"', '""') + '"' for name in header)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE_NAME} ({columns})")
+        self.insert_sql = f"INSERT INTO {TABLE_NAME} VALUES ({', '.join('?' * len(header))})"
+
+    def write(self, rows) -> None:
+        self.conn.executemany(self.insert_sql, ([_plain(v) for v in row] for row in rows))
+
+    def commit(self, progress: dict) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO consolidate_progress (id, progress) VALUES (1, ?)", (json.dumps(progress, ensure_ascii=False),))
+        self.conn.commit()
+
+    def discard(self) -> None:
+        self.conn.rollback()
+
+    def close(self) -> None:
+        self.conn.close()
+
+class CsvSink:
+    """CSV へ追記する。進捗は '<出力先>.progress.json' に、追記分を書き出した後で記録する。"""
+    def __init__(self, path: str):
+        self.path, self.file, self.writer = path, None, None
+        self.resume_offset = 0
+
+    def load_progress(self) -> dict | None:
+        progress = _load_progress_file(self.path)
+        if progress: self.resume_offset = progress.get('offset', os.path.getsize(self.path))
+        return progress
+
+    def begin(self, header: list, resume: bool) -> None:
+        if resume:
+            # 前回の確定後に書きかけた行があれば切り捨ててから追記する
+            self.file = open(self.path, 'r+', newline='', encoding='utf-8'); self.file.truncate(self.resume_offset); self.file.seek(self.resume_offset)
+        else:
+            self.file = open(self.path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        if not resume: self.writer.writerow(header)
+
+    def write(self, rows) -> None:
+        self.writer.writerows([_plain(v) for v in row] for row in rows)
+
+    def commit(self, progress: dict) -> None:
+        self.file.flush(); os.fsync(self.file.fileno())
+        _save_progress_file(self.path, {**progress, 'offset': self.file.tell()})
+
+    def discard(self) -> None:
+        pass  # 確定後に書いた行は、次回 resume_offset で切り捨てる
+
+    def close(self) -> None:
+        if self.file: self.file.close()
+
+class XlsxSink:
+    """
+    書き込み専用ブック (行は openpyxl が一時ファイルへ逐次書き出す) に書き込み、最後に出力先へ置き換える。
+    xlsx は追記できないため、続きから結合するときは既存の出力を読み取り専用で1行ずつ写してから続ける。
+    途中で失敗したときはブックを保存しない (進捗の記録と出力の中身が常に一致するように、出力は前回のまま残す)。
+    """
+    def __init__(self, path: str):
+        self.path, self.tmp_path = path, path + '.tmp.xlsx'
+        self.wb, self.ws, self.progress = None, None, None
+
+    def load_progress(self) -> dict | None:
+        return _load_progress_file(self.path)
+
+    def begin(self, header: list, resume: bool) -> None:
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet(SHEET_TITLE)
+        if resume:
+            previous = load_workbook(self.path, read_only=True)
+            try:
+                for row in previous[SHEET_TITLE].iter_rows(values_only=True): self.ws.append(row)
+            finally:
+                previous.close()
+        else:
+            self.ws.append(header)
+
+    def write(self, rows) -> None:
+        for row in rows: self.ws.append(row)
+
+    def commit(self, progress: dict) -> None:
+        self.progress = progress  # ブックは close で一度に保存する
+
+    def discard(self) -> None:
+        if self.ws is not None and not self.ws.closed: self.ws.close()  # 書きかけの一時ファイルを閉じる (削除は openpyxl が終了時に行う)
+        self.wb, self.ws, self.progress = None, None, None
+        if os.path.exists(self.tmp_path): os.remove(self.tmp_path)
+
+    def close(self) -> None:
+        if self.wb is None: return
+        self.wb.save(self.tmp_path); os.replace(self.tmp_path, self.path)
+        if self.progress: _save_progress_file(self.path, self.progress)
+
+def open_sink(output_path: str):
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext in ('.db', '.sqlite', '.sqlite3'): return SqliteSink(output_path)
+    if ext == '.csv': return CsvSink(output_path)
+    if ext == '.xlsx': return XlsxSink(output_path)
+    raise ValueError(f"対応していない出力形式です: {output_path} (.xlsx / .db / .sqlite / .csv)")
+
+def resume_index(sheet_names: list, progress: dict | None) -> int:
+    """前回結合した最後のシートの次の位置を返す。記録がなければ 0。"""
+    if not progress: return 0
+    done, last = progress['sheets_done'], progress['last_sheet']
+    if 0 < done <= len(sheet_names) and sheet_names[done - 1] == last: return done
+    if last in sheet_names: return sheet_names.index(last) + 1
+    raise ValueError(f"前回結合した最後のシート '{last}' が入力にありません。--full で作り直してください。")
+
+def consolidate(input_path: str, output_path: str, full: bool = False) -> tuple:
+    """入力の各シート (1行目は見出し) のデータ行を出力へ結合し、(今回結合したシート数, 行数) を返す。"""
+    sink = open_sink(output_path)
+    wb = load_workbook(input_path, read_only=True)
+    try:
+        progress = None if full else sink.load_progress()
+        if progress and progress.get('input') != os.path.abspath(input_path): progress = None  # 別の入力の記録なら最初から
+        names = wb.sheetnames
+        start = resume_index(names, progress)
+        if start >= len(names): return 0, 0
+        sheets, rows_written = 0, 0
+        total_rows = progress['rows'] if progress else 0
+        header = progress['header'] if progress else None
+        for i in range(start, len(names)):
+            rows = wb[names[i]].iter_rows(values_only=True)
+            sheet_header = next(rows, None)
+            if header is None:
+                if sheet_header is None: continue
+                header = [str(v) if v is not None else f'col{j}' for j, v in enumerate(sheet_header)]
+                sink.begin(header, resume=False)
+            elif sheets == 0:
+                sink.begin(header, resume=progress is not None)
+            count = [0]
+            def data_rows():
+                for row in rows:
+                    if any(v is not None for v in row): count[0] += 1; yield row[:len(header)]
+            sink.write(data_rows())
+            sheets += 1; rows_written += count[0]; total_rows += count[0]
+            if sheets % COMMIT_EVERY == 0 or i == len(names) - 1:
+                sink.commit({'input': os.path.abspath(input_path), 'sheets_done': i + 1, 'last_sheet': names[i], 'rows': total_rows, 'header': header})
+        return sheets, rows_written
+    except BaseException:
+        sink.discard()  # 進捗に記録していない行を出力に残さない
+        raise
+    finally:
+        wb.close(); sink.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="updated_data.xlsx の全シートを1つの表に結合する")
+    parser.add_argument('--input', default=INPUT_EXCEL_PATH)
+    parser.add_argument('--output', default=OUTPUT_PATH, help="出力先 (.xlsx / .db / .sqlite / .csv)")
+    parser.add_argument('--full', action='store_true', help="前回の進捗を無視して最初から作り直す")
+    args = parser.parse_args()
+    sheets, rows = consolidate(args.input, args.output, full=args.full)
+    if sheets:
+        print(f'{sheets} シート・{rows} 行のデータが結合され、{args.output} に保存されました。')
+    else:
+        print('新しいシートはありません。')
@@ -0,0 +1,169 @@
+# coding: utf-8
+"""
+market_data.db に保存済みの約定を、銘柄×取引日ごとにイベント時刻順で StreamingTradeAnalyzer に流すリプレイ/バックテスト。
+シグナル (シグナル名, 信頼度) が変わった時点だけを並べた推移表と、シグナル別の集計 (継続時間・その後の値動き) を出力する。
+銘柄×取引日の単位でプロセスプールに分散する。Excel / win32com は不要。
+ayumiarchive.py でアーカイブへ移した過去日も、DBに残っている分と合わせて読む。
+ロットのしきい値は、ライブのTUIと同じく約定代金の分布 (lot_profile) から求める。先読みにならないよう、リプレイする日より前の日の分だけを使う。
+
+    python replay.py c:/ayumi/market_data.db --tickers 7203 6758 --from 2026-10-01 --workers 8 --out signals.csv
+"""
+import os
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from ayumidb import connect, TickerDirectory, to_epoch_ns, date_to_int, decode_jikoku, load_lot_profile, PRICE_SCALE
+from tradeanalyzer import StreamingTradeAnalyzer, profile_thresholds
+import ayumiarchive
+
+STRONG_SIGNALS = ('強い買い', '強い売り')
+
+def list_tasks(conn, tickers: list | None = None, date_from: int | None = None, date_to: int | None = None, archive_dir: str | None = None) -> list:
+    """DB (と archive_dir のアーカイブ) にある (銘柄コード, 取引日) の組を列挙する。tickers・日付範囲 (YYYYMMDD) で絞り込める。"""
+    rows = conn.execute(
+        "SELECT k.code, d.trade_date FROM (SELECT DISTINCT ticker_id, trade_date FROM ticks) d JOIN tickers k ON k.ticker_id = d.ticker_id"
+    ).fetchall()
+    if archive_dir: rows = set(rows) | set(ayumiarchive.list_partitions(archive_dir))
+    return [(code, trade_date) for code, trade_date in sorted(rows, key=lambda r: (r[1], r[0]))
+            if (not tickers or code in tickers) and (date_from is None or trade_date >= date_from) and (date_to is None or trade_date <= date_to)]
+
+def load_day(conn, ticker_code: str, trade_date: int, archive_dir: str | None = None) -> np.ndarray:
+    """1銘柄・1日の約定を (id, time_ms, price_x10, volume, side) の int64 配列で、時刻順に返す。アーカイブ済みの分も含める。"""
+    ticker_id = TickerDirectory().get(conn, ticker_code)
+    rows = [] if ticker_id is None else conn.execute(
+        "SELECT id, time_ms, price_x10, volume, side, seq FROM ticks WHERE ticker_id = ? AND trade_date = ? ORDER BY time_ms, seq",
+        (ticker_id, trade_date)
+    ).fetchall()
+    day = dict(zip(ayumiarchive.COLUMNS, np.array(rows, dtype=np.int64).reshape(-1, 6).T))
+    archived = ayumiarchive.load_partition(ticker_code, trade_date, archive_dir) if archive_dir else None
+    if archived is not None: day = ayumiarchive.merge_columns(archived, day) if rows else archived
+    return np.column_stack([np.asarray(day[name], dtype=np.int64) for name in ('id', 'time_ms', 'price_x10', 'volume', 'side')])
+
+def lot_thresholds_before(conn, ticker_code: str, trade_date: int) -> tuple | None:
+    """trade_date より前の取引日の約定代金の分布から求めたロットのしきい値。分布が足りない・旧スキーマなら None。"""
+    ticker_id = TickerDirectory().get(conn, ticker_code)
+    if ticker_id is None: return None
+    try:
+        return profile_thresholds(load_lot_profile(conn, ticker_id, trade_date - 1))
+    except sqlite3.Error:
+        return None
+
+def replay_day(db_path: str, ticker_code: str, trade_date: int, step_ms: int = 1000, horizons: tuple = (60, 300), history_size: int = 10000, time_window_sec: int = 300, archive_dir: str | None = None, lot_profile: bool = True) -> tuple:
+    """
+    1銘柄・1日分をリプレイし、(シグナル推移のレコードのリスト, 実行統計の辞書) を返す。
+    約定は step_ms ごとの時刻区間単位でまとめて analyzer に渡す (ライブのTUIがポーリングごとに受け取るのに相当)。
+    推移の各行には、その時点から horizons 秒後までの値動きをシグナルの向きで符号付けした値 (bp) を付ける。
+    lot_profile が False なら、ロットのしきい値を従来どおり時間窓の平均から求める。
+    """
+    started = time.perf_counter()
+    conn = connect(db_path, 'reader')
+    try:
+        ticks = load_day(conn, ticker_code, trade_date, archive_dir)
+        thresholds = lot_thresholds_before(conn, ticker_code, trade_date) if lot_profile else None
+    finally:
+        conn.close()
+    ids, time_ms, price_x10, volume, side = ticks.T
+    prices, t_ns = price_x10 / PRICE_SCALE, to_epoch_ns(np.full(len(ticks), trade_date), time_ms)
+    analyzer = StreamingTradeAnalyzer(time_window_sec=time_window_sec, history_size=history_size)
+    analyzer.set_lot_thresholds(thresholds)
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(time_ms // step_ms)) + 1, [len(ticks)])) if len(ticks) else np.array([0])
+    timeline, last_key = [], None
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        res = analyzer.update_arrays(ids[a:b], t_ns[a:b], prices[a:b], volume[a:b], side[a:b].astype(np.int8))
+        if not res: continue
+        summary = res['summary']
+        key = (summary['signal'], summary['confidence'])
+        if key == last_key: continue
+        last_key = key
+        timeline.append({
+            'ticker': ticker_code, 'trade_date': trade_date, 'time_ms': int(time_ms[b - 1]),
+            'signal': summary['signal'], 'confidence': summary['confidence'], 'condition': summary['condition'],
+            'price': float(prices[b - 1]), 'vwap': float(summary['metrics']['vwap']), 'buy_ratio': float(summary['buy_ratio']),
+        })
+    # 継続時間と、その後の値動き (シグナルの向きに符号付け。中立・優勢系は買い=+1/売り=-1/中立=0)
+    for i, row in enumerate(timeline):
+        end_ms = timeline[i + 1]['time_ms'] if i + 1 < len(timeline) else int(time_ms[-1])
+        row['duration_s'] = (end_ms - row['time_ms']) / 1000
+        direction = 1 if '買い' in row['signal'] else -1 if '売り' in row['signal'] else 0
+        for h in horizons:
+            target = row['time_ms'] + h * 1000
+            row[f'fwd_{h}s_bps'] = (prices[np.searchsorted(time_ms, target, side='right') - 1] / row['price'] - 1) * 1e4 * direction if target <= time_ms[-1] else np.nan
+    stats = {'ticker': ticker_code, 'trade_date': trade_date, 'ticks': len(ticks), 'batches': len(bounds) - 1, 'changes': len(timeline),
+             'lot_thresholds': 'profile' if thresholds else 'window', 'elapsed_s': time.perf_counter() - started}
+    return timeline, stats
+
+def _replay_task(args: tuple) -> tuple:
+    return replay_day(*args)
+
+def run_replay(db_path: str, tasks: list, workers: int | None = None, **options) -> tuple:
+    """tasks (銘柄コード, 取引日) をプロセスプールでリプレイし、(推移のDataFrame, 実行統計のDataFrame) を返す。"""
+    step_ms, horizons = options.get('step_ms', 1000), options.get('horizons', (60, 300))
+    history_size, time_window_sec = options.get('history_size', 10000), options.get('time_window_sec', 300)
+    archive_dir, lot_profile = options.get('archive_dir'), options.get('lot_profile', True)
+    args = [(db_path, code, trade_date, step_ms, horizons, history_size, time_window_sec, archive_dir, lot_profile) for code, trade_date in tasks]
+    if workers == 1 or len(args) <= 1:
+        results = [_replay_task(a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_replay_task, args))
+    timeline = pd.DataFrame([row for rows, _ in results for row in rows])
+    stats = pd.DataFrame([s for _, s in results])
+    return timeline, stats
+
+def summarize(timeline: pd.DataFrame, horizons: tuple = (60, 300)) -> pd.DataFrame:
+    """シグナル別に、発生回数・平均信頼度・継続時間の合計と割合・その後の値動きの平均と的中率を集計する。"""
+    if timeline.empty: return pd.DataFrame()
+    grouped = timeline.groupby('signal')
+    summary = pd.DataFrame({
+        'count': grouped.size(), 'avg_confidence': grouped['confidence'].mean(),
+        'duration_s': grouped['duration_s'].sum(),
+    })
+    summary['time_share'] = summary['duration_s'] / summary['duration_s'].sum()
+    for h in horizons:
+        col = f'fwd_{h}s_bps'
+        summary[f'avg_{col}'] = grouped[col].mean()
+        summary[f'hit_{h}s'] = grouped[col].apply(lambda v: (v.dropna() > 0).mean() if v.notna().any() else np.nan)
+    return summary.sort_values('count', ascending=False)
+
+def _parse_date(text: str | None) -> int | None:
+    return date_to_int(datetime.strptime(text, '%Y-%m-%d').date()) if text else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="保存済みの約定をリプレイしてシグナルの推移を検証する")
+    parser.add_argument('db_path')
+    parser.add_argument('--tickers', nargs='+', help="対象の銘柄コード (省略時は全銘柄)")
+    parser.add_argument('--from', dest='date_from', help="開始日 (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='date_to', help="終了日 (YYYY-MM-DD)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="プロセス数 (1 なら直列)")
+    parser.add_argument('--step-ms', type=int, default=1000, help="analyzer に渡す時刻区間の幅 (ミリ秒)")
+    parser.add_argument('--horizons', type=int, nargs='+', default=[60, 300], help="値動きを測る秒数")
+    parser.add_argument('--archive', default=ayumiarchive.ARCHIVE_DIR, help="アーカイブの置き場所 (なければDBだけを読む)")
+    parser.add_argument('--window-thresholds', action='store_true', help="ロットのしきい値を約定代金の分布ではなく時間窓の平均から求める")
+    parser.add_argument('--out', help="シグナル推移の出力先 CSV")
+    parser.add_argument('--summary-out', help="シグナル別集計の出力先 CSV")
+    args = parser.parse_args()
+
+    archive_dir = args.archive if os.path.isdir(args.archive) else None
+    conn = connect(args.db_path, 'reader')
+    try:
+        tasks = list_tasks(conn, args.tickers, _parse_date(args.date_from), _parse_date(args.date_to), archive_dir)
+    finally:
+        conn.close()
+    if not tasks:
+        print("対象の約定がありません。"); raise SystemExit(0)
+    print(f"{len(tasks)} 銘柄日をリプレイします (プロセス数 {args.workers})...")
+    started = time.perf_counter()
+    horizons = tuple(args.horizons)
+    timeline, stats = run_replay(args.db_path, tasks, args.workers, step_ms=args.step_ms, horizons=horizons, archive_dir=archive_dir, lot_profile=not args.window_thresholds)
+    elapsed = time.perf_counter() - started
+    print(f"約定 {stats['ticks'].sum():,} 件 / 変化点 {len(timeline):,} 件 / {elapsed:,.2f}秒 ({stats['ticks'].sum() / elapsed:,.0f} 件/秒)")
+    for row in timeline.tail(5).itertuples():
+        print(f"  {row.ticker} {row.trade_date} {decode_jikoku(row.time_ms)} {row.signal} 信頼度{row.confidence} {row.condition} @ {row.price:,}")
+    summary = summarize(timeline, horizons)
+    print(summary.to_string(float_format=lambda v: f"{v:,.2f}"))
+    if args.out: timeline.to_csv(args.out, index=False, encoding='utf-8-sig')
+    if args.summary_out: summary.to_csv(args.summary_out, encoding='utf-8-sig')
@@ -0,0 +1,87 @@
+# coding: utf-8
+"""
+ベンチマーク・検証用の合成データ生成。Excel や MarketSpeed2 がない環境でも ayumi.xlsm 相当のファイルを作れる。
+"""
+import zipfile
+from xml.sax.saxutils import escape
+import numpy as np
+import pandas as pd
+
+def generate_ticks(n: int, seed: int = 0, start: str = '09:00:00', base_price: float = 1000.0, tick_size: float = 1.0) -> pd.DataFrame:
+    """歩み値風の約定を n 件生成する。列は 時刻('HH:MM:SS'), 価格, 出来高, 方向('2'=買い/'1'=売り)。"""
+    rng = np.random.default_rng(seed)
+    seconds = np.cumsum(rng.exponential(0.5, n)).astype(np.int64)
+    times = pd.Timestamp(f"2000-01-01 {start}") + pd.to_timedelta(seconds, unit='s')
+    steps = rng.choice([-1, 0, 1], n, p=[0.3, 0.4, 0.3])
+    prices = np.maximum(base_price + np.cumsum(steps) * tick_size, tick_size)
+    volumes = rng.choice([100, 200, 300, 500, 1000, 3000, 10000, 50000], n, p=[0.35, 0.2, 0.1, 0.1, 0.1, 0.08, 0.05, 0.02])
+    directions = np.where(steps > 0, '2', np.where(steps < 0, '1', rng.choice(['1', '2'], n)))
+    return pd.DataFrame({'時刻': times.strftime('%H:%M:%S'), '価格': prices, '出来高': volumes, '方向': directions})
+
+def ticker_codes(n: int) -> list:
+    """合成用の銘柄コードを n 個返す ('1301', '1302', ...)。"""
+    return [str(1301 + i) for i in range(n)]
+
+def generate_multi_ticks(n_rows: int, n_tickers: int, seed: int = 0) -> dict:
+    """合計 n_rows 件の約定を n_tickers 銘柄に分けて生成し、{銘柄コード: DataFrame} を返す。銘柄ごとに価格帯を変える。"""
+    per_ticker = max(1, n_rows // n_tickers)
+    return {code: generate_ticks(per_ticker, seed=seed * 1000 + i, base_price=500.0 + 250.0 * (i % 20))
+            for i, code in enumerate(ticker_codes(n_tickers))}
+
+# --- .xlsm 書き出し (最低限のパートのみ) ---
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/><Override PartName="/xl/workbook.xml" ContentType="application/vnd.ms-excel.sheet.macroEnabled.main+xml"/><Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/><Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/><Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/><Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/></Types>"""
+_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>"""
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/><sheet name="Sheet2" sheetId="2" r:id="rId2"/></sheets></workbook>"""
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/><Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet2.xml"/><Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/><Relationship Id="rId4" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/></Relationships>"""
+# s="1" は 時刻書式 (組み込みID 21 = h:mm:ss)
+_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts><fills count="1"><fill><patternFill patternType="none"/></fill></fills><borders count="1"><border/></borders><cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs><cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="21" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs></styleSheet>"""
+_SHEET_HEAD = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+_SHEET_TAIL = '</sheetData></worksheet>'
+
+class _SharedStrings:
+    def __init__(self):
+        self.index, self.items = {}, []
+    def ref(self, text: str) -> int:
+        if text not in self.index: self.index[text] = len(self.items); self.items.append(text)
+        return self.index[text]
+    def xml(self) -> str:
+        body = ''.join(f'<si><t>{escape(t)}</t></si>' for t in self.items)
+        return f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="{len(self.items)}" uniqueCount="{len(self.items)}">{body}</sst>'
+
+def _col_name(i: int) -> str:
+    name = ''
+    i += 1
+    while i: i, r = divmod(i - 1, 26); name = chr(65 + r) + name
+    return name
+
+def _cell(ref: str, value, sst: _SharedStrings, time_serial: bool = False) -> str:
+    if isinstance(value, str):
+        if time_serial and value.count(':') == 2:
+            h, m, s = map(int, value.split(':'))
+            return f'<c r="{ref}" s="1"><v>{(h * 3600 + m * 60 + s) / 86400!r}</v></c>'
+        return f'<c r="{ref}" t="s"><v>{sst.ref(value)}</v></c>'
+    return f'<c r="{ref}"><v>{value}</v></c>'
+
+def write_ayumi_xlsm(path: str, ticks: pd.DataFrame, ticker: str = '7203', newest_first: bool = True, time_serial: bool = False, extra_columns: int = 0) -> None:
+    """
+    ayumi.xlsm と同じ構成 (Sheet1!E4 に銘柄コード、Sheet2 のA-D列に 時刻・価格・出来高・方向) のブックを書き出す。
+    time_serial=True なら時刻を文字列ではなく時刻書式付きのシリアル値で書く。extra_columns で E列以降にダミー列を足せる。
+    """
+    sst = _SharedStrings()
+    sheet1 = _SHEET_HEAD + f'<row r="4">{_cell("E4", ticker, sst)}</row>' + _SHEET_TAIL
+    rows = ticks.iloc[::-1] if newest_first else ticks
+    parts = [_SHEET_HEAD]
+    for i, values in enumerate(rows.itertuples(index=False, name=None), start=1):
+        values = list(values) + [i * 10 + j for j in range(extra_columns)]
+        parts.append(f'<row r="{i}">' + ''.join(_cell(f'{_col_name(j)}{i}', v, sst, time_serial) for j, v in enumerate(values)) + '</row>')
+    parts.append(_SHEET_TAIL)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', _CONTENT_TYPES); zf.writestr('_rels/.rels', _ROOT_RELS)
+        zf.writestr('xl/workbook.xml', _WORKBOOK); zf.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        zf.writestr('xl/styles.xml', _STYLES); zf.writestr('xl/worksheets/sheet1.xml', sheet1)
+        zf.writestr('xl/worksheets/sheet2.xml', ''.join(parts)); zf.writestr('xl/sharedStrings.xml', sst.xml())
@@ -0,0 +1,115 @@
+# coding: utf-8
+import numpy as np
+import pandas as pd
+
+# --- 方向・ロットのコード表 ---
+DIRECTION_CODES = {'買い': 1, '売り': -1}
+LOT_LABELS = ['小口', '中口', '大口', '超大口']
+
+class TickRingBuffer:
+    """
+    約定を列ごとの固定長NumPy配列に保持するリングバッファ。
+    各行を位置 i と i+capacity の2か所に書き込む「ミラー方式」のため、
+    capacity 件以内の連続区間は常にコピーなしのスライス(ビュー)として取り出せる。
+    行は追加順の通し番号 (seq) で指定する。保持しているのは [start_seq, end_seq) の範囲。
+    """
+    COLUMNS = {'id': np.int64, 't': np.int64, 'price': np.float64, 'volume': np.int64, 'direction': np.int8, 'lot': np.int8}
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self._data = {name: np.zeros(capacity * 2, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self.end_seq = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def start_seq(self) -> int:
+        return self.end_seq - self._size
+
+    def clear(self) -> None:
+        """保持している行をすべて破棄する。配列は再確保しない。"""
+        self.end_seq = 0
+        self._size = 0
+
+    def overflow(self, k: int) -> int:
+        """k 件を追加したときに押し出される古い行の件数。"""
+        return min(self._size, max(0, self._size + k - self.capacity))
+
+    def append(self, **columns) -> None:
+        """列ごとの配列で k 件を追加する (O(k))。lot を省略した場合は -1 (未判定)。"""
+        k = len(columns['id'])
+        if k == 0: return
+        skip = max(0, k - self.capacity)  # 容量を超える分は古い側を捨てる
+        pos = (self.end_seq + skip + np.arange(k - skip)) % self.capacity
+        for name, arr in self._data.items():
+            values = columns.get(name)
+            values = np.full(k, -1) if values is None else np.asarray(values)
+            arr[pos] = values[skip:]; arr[pos + self.capacity] = values[skip:]
+        self.end_seq += k
+        self._size = min(self._size + k, self.capacity)
+
+    def assign(self, name: str, a: int, values: np.ndarray) -> None:
+        """seq a から始まる保持中の行の列を上書きする (ミラー側も含めて)。"""
+        pos = (a + np.arange(len(values))) % self.capacity
+        self._data[name][pos] = values; self._data[name][pos + self.capacity] = values
+
+    def view(self, name: str, a: int | None = None, b: int | None = None) -> np.ndarray:
+        """seq 範囲 [a, b) の列をコピーなしで返す。範囲は保持中の行に切り詰める。"""
+        a = self.start_seq if a is None else max(a, self.start_seq)
+        b = self.end_seq if b is None else min(b, self.end_seq)
+        if b <= a: return self._data[name][:0]
+        pos = a % self.capacity
+        return self._data[name][pos:pos + (b - a)]
+
+    def at(self, name: str, seq: int):
+        """seq の行の値を1つ返す。seq は保持範囲内であること。"""
+        return self._data[name][seq % self.capacity]
+
+    def tail(self, name: str, n: int) -> np.ndarray:
+        """末尾 n 件の列をコピーなしで返す。"""
+        return self.view(name, self.end_seq - n)
+
+    def snapshot(self, n: int | None = None) -> 'TickRingBuffer':
+        """末尾 n 件 (省略時は全件) をコピーした別のバッファを返す。seq は元と同じ。別スレッドに渡す読み取り専用の写しとして使う。"""
+        n = len(self) if n is None else min(n, len(self))
+        snap = TickRingBuffer(max(n, 1))
+        snap.end_seq = self.end_seq - n
+        snap.append(**{name: self.tail(name, n) for name in self.COLUMNS})
+        return snap
+
+    def extend(self, other: 'TickRingBuffer') -> None:
+        """other (snapshot の写し) の行を末尾に続ける。seq が続いていなければ (作り直した後の写しなど) other の内容に置き換える。"""
+        if len(other) == 0: return
+        if len(self) == 0 or other.start_seq != self.end_seq:
+            self.clear(); self.end_seq = other.start_seq
+        self.append(**{name: other.view(name) for name in self.COLUMNS})
+
+    def state(self) -> dict:
+        """保持中の行と end_seq を {名前: 配列} で返す (np.savez で書ける)。restore で同じ内容に戻せる。"""
+        return {'end_seq': np.int64(self.end_seq), **{name: self.view(name).copy() for name in self.COLUMNS}}
+
+    def restore(self, state: dict) -> None:
+        """state() の内容に置き換える。seq は保存時と同じになる。容量を超える分は古い側を捨てる。"""
+        self.clear()
+        self.end_seq = int(state['end_seq']) - len(state['id'])
+        self.append(**{name: state[name] for name in self.COLUMNS})
+
+    def seq_after_time(self, t_ns: int, a: int | None = None) -> int:
+        """時刻が t_ns より後になる最初の seq を返す (時刻昇順を前提に二分探索)。"""
+        a = self.start_seq if a is None else max(a, self.start_seq)
+        return a + int(np.searchsorted(self.view('t', a), t_ns, side='right'))
+
+    def to_frame(self, n: int | None = None) -> pd.DataFrame:
+        """末尾 n 件 (省略時は全件) を表示・分析用の DataFrame に変換する。必要な時だけ呼ぶ。"""
+        a = self.start_seq if n is None else self.end_seq - n
+        direction, lot = self.view('direction', a), self.view('lot', a)
+        return pd.DataFrame({
+            'id': self.view('id', a).copy(),
+            '時刻': pd.to_datetime(self.view('t', a), unit='ns'),
+            '価格': self.view('price', a).copy(),
+            '出来高': self.view('volume', a).copy(),
+            '方向': np.where(direction > 0, '買い', np.where(direction < 0, '売り', '不明')),
+            'ロット': np.asarray(LOT_LABELS + ['-'], dtype=object)[np.where(lot >= 0, lot, len(LOT_LABELS))],
+        })
@@ -0,0 +1,358 @@
+# coding: utf-8
+"""
+約定データの分析 (シグナル判定)。TUI・リプレイ・ベンチマークから共通で使う。
+"""
+import pandas as pd
+import numpy as np
+from tickbuffer import TickRingBuffer, DIRECTION_CODES, LOT_LABELS
+from ayumidb import PRICE_SCALE, BAR_KEY_SCALE, LOT_BIN_EDGES_X10
+
+HORIZONS_SEC = (60, 300, 900)  # 期間別比較で並べる直近の期間 (秒)
+LOT_QUANTILES = (0.90, 0.97, 0.995)  # 中口・大口・超大口 のしきい値とする、約定代金の分布の分位点 (件数基準)
+LOT_PROFILE_MIN_TRADES = 1000       # 分布の件数がこれに満たない間は、時間窓から求めるしきい値を使う
+HISTORY_SIZE = 10000                # StreamingTradeAnalyzer が保持する直近の約定の件数 (既定)
+
+def profile_thresholds(counts: np.ndarray, quantiles: tuple = LOT_QUANTILES, min_trades: int = LOT_PROFILE_MIN_TRADES) -> tuple | None:
+    """
+    約定代金ビンごとの約定件数 (ayumidb.load_lot_profile) から、中口・大口・超大口 のしきい値 (円) を返す。
+    各分位点を含むビンの上端をしきい値とするので、しきい値は常にビンの境界に一致する。件数が min_trades 未満なら None。
+    """
+    cum = np.cumsum(counts)
+    if len(cum) == 0 or cum[-1] < min_trades: return None
+    idx = np.minimum(np.searchsorted(cum, np.asarray(quantiles) * cum[-1], side='left') + 1, len(LOT_BIN_EDGES_X10) - 1)
+    return tuple(float(edge) / PRICE_SCALE for edge in LOT_BIN_EDGES_X10[idx])
+
+def horizon_metrics(t_ns: np.ndarray, prices: np.ndarray, volumes: np.ndarray, directions: np.ndarray, thresholds: tuple, horizons: tuple = HORIZONS_SEC) -> dict:
+    """
+    時刻順の約定配列から、直近 h 秒 (h ∈ horizons) ごとの VWAP・ボラティリティ・取引密度・買い比率・ロット別出来高を1回の走査で求める。
+    必要な量の累積和を1度だけ取り、各期間の開始位置は searchsorted で引くので、期間を1つ増やしても加わるのは差分1回分。
+    ロットは現在のしきい値 thresholds で分ける。配列が期間の全体を含まない (最古の約定が期間内) 場合は complete=False。
+    """
+    n = len(t_ns)
+    if n == 0: return {}
+    prices, volumes = np.asarray(prices, dtype=float), np.asarray(volumes, dtype=float)
+    dp = prices - prices[-1]  # 分散の桁落ちを避けるため、最新値からの差で累積する
+    lots = np.searchsorted(np.asarray(thresholds, dtype=float), prices * volumes, side='right')
+    buy, sell = directions > 0, directions < 0
+    # 列: 出来高, 価格×出来高, 差, 差², 買い出来高, 売り出来高, (ロット, 買い/売り) 別出来高 × 8
+    sums = np.zeros((n + 1, 14))
+    rows = sums[1:]
+    rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3] = volumes, prices * volumes, dp, dp * dp
+    rows[:, 4], rows[:, 5] = volumes * buy, volumes * sell
+    index = np.arange(n)
+    rows[index[buy], 6 + lots[buy] * 2] = volumes[buy]; rows[index[sell], 7 + lots[sell] * 2] = volumes[sell]
+    np.cumsum(sums, axis=0, out=sums)
+    starts = np.searchsorted(t_ns, t_ns[-1] - np.asarray(horizons, dtype=np.int64) * 1_000_000_000, side='right')
+    result = {}
+    for h, a in zip(horizons, starts):
+        k, total = n - a, sums[n] - sums[a]
+        volume, mean_dp = total[0], total[2] / max(n - a, 1)
+        time_span_min = (t_ns[-1] - t_ns[a]) / 60e9
+        result[h] = {
+            'vwap': total[1] / volume if volume > 0 else float('nan'),
+            'volatility': float(np.sqrt(max(total[3] / k - mean_dp * mean_dp, 0.0))) if k else float('nan'),
+            'trade_density_per_min': k / time_span_min if time_span_min > 0 else 0,
+            'buy_ratio': total[4] / (total[4] + total[5]) if total[4] + total[5] > 0 else 0,
+            'volume': int(volume), 'trades': int(k), 'breakdown': total[6:].reshape(4, 2), 'complete': bool(a > 0),
+        }
+    return result
+
+class TradeAnalyzer:
+    def __init__(self, window_size: int = 5000, time_window_sec: int = 300, horizons: tuple = HORIZONS_SEC):
+        self.window_size, self.time_window_sec, self.history = window_size, time_window_sec, pd.DataFrame()
+        self.horizons = tuple(horizons)
+        self.lot_thresholds = None  # 約定代金の分布から求めた固定のしきい値 (set_lot_thresholds)。None なら時間窓から毎回求める
+    def set_lot_thresholds(self, thresholds: tuple | None) -> None:
+        self.lot_thresholds = tuple(thresholds) if thresholds else None
+    def _calculate_metrics(self, df: pd.DataFrame) -> dict:
+        if df.empty or '時刻' not in df.columns or df['時刻'].iloc[-1] is pd.NaT: return {}
+        now = pd.to_datetime(df['時刻'].iloc[-1]); window_df = df[df['時刻'] > now - pd.Timedelta(seconds=self.time_window_sec)]
+        if window_df.empty or len(window_df) < 2: return {}
+        vwap = (window_df['価格'] * window_df['出来高']).sum() / window_df['出来高'].sum(); volatility = window_df['価格'].std(ddof=0)
+        time_span_min = (window_df['時刻'].iloc[-1] - window_df['時刻'].iloc[0]).total_seconds() / 60
+        trade_density = len(window_df) / time_span_min if time_span_min > 0 else 0; avg_volume_per_trade = window_df['出来高'].mean()
+        price_open, price_close = window_df['価格'].iloc[0], window_df['価格'].iloc[-1]
+        return {'vwap': vwap, 'volatility': volatility, 'trade_density_per_min': trade_density, 'avg_volume_per_trade': avg_volume_per_trade, 'price_open': price_open, 'price_close': price_close}
+    def _get_dynamic_thresholds(self, metrics: dict) -> tuple:
+        if self.lot_thresholds: return self.lot_thresholds
+        if not metrics or 'avg_volume_per_trade' not in metrics or metrics['avg_volume_per_trade'] == 0: return (1_000_000, 10_000_000, 50_000_000)
+        base_vol, vwap = metrics['avg_volume_per_trade'], metrics['vwap']; return (base_vol * 5 * vwap, base_vol * 20 * vwap, base_vol * 100 * vwap)
+    def _build_summary(self, total_volume: int, pivot: pd.DataFrame, metrics: dict, thresholds: tuple, large_buy_volume: float, large_sell_volume: float, buy_vwap: float, sell_vwap: float) -> dict:
+        """ロット別集計と大口の売買量からシグナルを判定し、summary辞書を組み立てる。"""
+        m_th, l_th, s_th = thresholds
+        totals = dict(zip(pivot.columns, pivot.to_numpy().sum(axis=0)))  # 列ごとの合計 (pandas の集計より軽い)
+        total_buy_volume = totals['買い']
+        total_sell_volume = totals['売り']
+        total_volume_for_ratio = total_buy_volume + total_sell_volume
+        buy_ratio = total_buy_volume / total_volume_for_ratio if total_volume_for_ratio > 0 else 0
+        signal, confidence, condition = "中立", 0, "様子見"
+        large_net_volume = large_buy_volume - large_sell_volume
+        confidence_score = abs(large_net_volume) / (metrics.get('avg_volume_per_trade', 1) * 10)
+        is_price_up = metrics['price_close'] >= metrics['price_open']; is_price_down = metrics['price_close'] < metrics['price_open']
+        if large_sell_volume > large_buy_volume * 1.5 and is_price_up: signal, confidence, condition = "強い買い", min(10, int(confidence_score * 1.5) + 3), "売り吸収の可能性"
+        elif large_buy_volume > large_sell_volume * 1.5 and is_price_down: signal, confidence, condition = "強い売り", min(10, int(confidence_score * 1.5) + 3), "買い疲れの兆候"
+        elif large_net_volume > 0 and confidence_score > 1:
+            signal, confidence = "強い買い", min(10, int(confidence_score) + 1)
+            condition = "VWAP越えの積極買い" if buy_vwap > metrics['vwap'] else "大口による買い集め"
+        elif large_net_volume < 0 and confidence_score > 1:
+            signal, confidence = "強い売り", min(10, int(confidence_score) + 1)
+            condition = "VWAP下での売り" if sell_vwap < metrics['vwap'] else "大口による売り"
+        elif totals['差引'] > 0: signal, confidence, condition = "買い優勢", 3, "小口中心の買い"
+        elif totals['差引'] < 0: signal, confidence, condition = "売り優勢", 3, "小口中心の売り"
+        return {'total_volume': int(total_volume), 'breakdown': pivot, 'signal': signal, 'confidence': confidence, 'condition': condition, 'metrics': metrics, 'thresholds_yen': {'medium': m_th, 'large': l_th, 'super_large': s_th}, 'thresholds_source': 'profile' if self.lot_thresholds else 'window', 'buy_ratio': buy_ratio}
+    def analyze(self, df: pd.DataFrame) -> dict | None:
+        if df.empty or len(df) < 2: return None
+        df = df.copy(); df.columns = ['id', '時刻', '価格', '出来高', '方向']
+        df['時刻'] = pd.to_datetime(df['時刻'], errors='coerce'); df['価格'] = pd.to_numeric(df['価格'], errors='coerce'); df['出来高'] = pd.to_numeric(df['出来高'], errors='coerce')
+        df.dropna(inplace=True); df = df[df['出来高'] > 0]
+        if df.empty: return None
+        metrics = self._calculate_metrics(df)
+        if not metrics: return None
+        df['約定代金'] = df['価格'] * df['出来高']; m_th, l_th, s_th = self._get_dynamic_thresholds(metrics)
+        bins, code_labels = [0, m_th, l_th, s_th, float('inf')], LOT_LABELS
+        df['ロット'] = pd.cut(df['約定代金'], bins=bins, labels=code_labels, right=False, include_lowest=True)
+        pivot = df.groupby(['ロット', '方向'], observed=True)['出来高'].sum().unstack(fill_value=0)
+        for col in ['買い', '売り']:
+            if col not in pivot.columns: pivot[col] = 0
+        pivot['差引'] = pivot['買い'] - pivot['売り']; pivot = pivot.reindex(code_labels, fill_value=0)
+        large_trades = df[df['ロット'].isin(['大口', '超大口'])]; large_buys = large_trades[large_trades['方向'] == '買い']; large_sells = large_trades[large_trades['方向'] == '売り']
+        large_buy_volume = large_buys['出来高'].sum(); large_sell_volume = large_sells['出来高'].sum()
+        buy_vwap = (large_buys['価格'] * large_buys['出来高']).sum() / large_buy_volume if large_buy_volume > 0 else 0
+        sell_vwap = (large_sells['価格'] * large_sells['出来高']).sum() / large_sell_volume if large_sell_volume > 0 else 0
+        summary = self._build_summary(df['出来高'].sum(), pivot, metrics, (m_th, l_th, s_th), large_buy_volume, large_sell_volume, buy_vwap, sell_vwap)
+        summary['horizons'] = horizon_metrics(
+            df['時刻'].values.astype('datetime64[ns]').view('int64'), df['価格'].to_numpy(dtype=float), df['出来高'].to_numpy(dtype=float),
+            df['方向'].map(DIRECTION_CODES).fillna(0).to_numpy(dtype=np.int8), (m_th, l_th, s_th), self.horizons,
+        )
+        return {'summary': summary, 'detail_df': df.tail(self.window_size)}
+
+def session_metrics(bars: dict) -> dict:
+    """
+    足 (ayumidb.load_bars の戻り値) を合算し、_calculate_metrics と同じ指標に 高値・安値・売買別出来高 を加えて返す。
+    計算量は足の本数分なので、1日全体 (1万件の上限を超える期間) の指標にも使える。足がなければ空の辞書。
+    """
+    trades, volume = int(bars['trades'].sum()), int(bars['volume'].sum())
+    if trades < 2 or volume <= 0: return {}
+    mean = bars['price_sum_x10'].sum() / trades
+    time_span_min = (bars['close_key'][-1] // BAR_KEY_SCALE - bars['open_key'][0] // BAR_KEY_SCALE) / 60_000
+    return {
+        'vwap': bars['notional_x10'].sum() / volume / PRICE_SCALE,
+        'volatility': float(np.sqrt(max(bars['price_sq_sum'].sum() / trades - mean * mean, 0.0))) / PRICE_SCALE,
+        'trade_density_per_min': trades / time_span_min if time_span_min > 0 else 0,
+        'avg_volume_per_trade': volume / trades,
+        'price_open': bars['open_x10'][0] / PRICE_SCALE, 'price_close': bars['close_x10'][-1] / PRICE_SCALE,
+        'high': bars['high_x10'].max() / PRICE_SCALE, 'low': bars['low_x10'].min() / PRICE_SCALE,
+        'volume': volume, 'buy_volume': int(bars['buy_volume'].sum()), 'sell_volume': int(bars['sell_volume'].sum()), 'trades': trades,
+    }
+
+class StreamingTradeAnalyzer(TradeAnalyzer):
+    """
+    新規に取得した約定だけを受け取り、累積値を逐次更新して analyze と同じ形式の summary を返す。
+    約定は TickRingBuffer (直近 history_size 件) に保持し、時間窓(VWAP・分散・密度)は窓の先頭 seq を
+    進めながら合計値から差し引く。保持中の約定は約定代金の対数ビン(1%刻み、ayumidb の lot_profile と同じ境界)ごとの出来高に集計しておき、
+    ロット別ピボットは現在のしきい値でビン単位に切り分け、しきい値を含むビンの約定だけは保持中の約定から拾って1件ずつ分けるので、
+    結果は analyze で同じ約定を一括分析したものと一致する。
+    set_lot_thresholds で分布から求めた固定のしきい値 (ビンの境界) を与えると、ロットはビン→ロットの表引きで約定ごとに1度だけ決まり、
+    ロット別の合計も追加・押し出しのたびに差分で更新する (しきい値を変えたときだけビン集計から作り直す)。
+    state() で蓄積した状態を配列の辞書に書き出し、restore() でその続きから再開できる。
+    """
+    BIN_EDGES, BIN_COUNT = LOT_BIN_EDGES_X10 / PRICE_SCALE, len(LOT_BIN_EDGES_X10)
+    PIVOT_INDEX = pd.Index(LOT_LABELS, name='ロット')
+    PIVOT_COLUMNS = pd.Index(['買い', '売り', '差引'], name='方向')
+    # state() / restore() で保存する累積値
+    STATE_SCALARS = ('_w_start', '_ref_price', '_w_vol', '_w_pv', '_w_dp', '_w_dp2', '_total_volume')
+    STATE_ARRAYS = ('_vol_hist', '_pv_hist', '_lot_vol', '_lot_pv')
+    def __init__(self, window_size: int = 5000, time_window_sec: int = 300, history_size: int = HISTORY_SIZE, horizons: tuple = HORIZONS_SEC):
+        super().__init__(window_size, time_window_sec, horizons)
+        self.ticks = TickRingBuffer(history_size)
+        self._bin_lot = None
+        self.reset()
+
+    def reset(self) -> None:
+        """蓄積した状態をすべて破棄する (銘柄変更時など)。"""
+        self.ticks.clear()
+        # 時間窓: 先頭 seq と、窓内の (出来高, 価格×出来高, 基準価格との差, その二乗) の合計
+        self._w_start = 0
+        self._ref_price = None
+        self._w_vol = self._w_pv = self._w_dp = self._w_dp2 = 0.0
+        # 保持中の約定の、方向(買い/売り) × 約定代金ビンごとの 出来高 と 価格×出来高
+        self._vol_hist = np.zeros((2, self.BIN_COUNT)); self._pv_hist = np.zeros((2, self.BIN_COUNT))
+        # 固定しきい値のときの (ロット, 方向) ごとの 出来高 と 価格×出来高
+        self._lot_vol = np.zeros((4, 2)); self._lot_pv = np.zeros((4, 2))
+        self._total_volume = 0
+        self.new_rows = 0
+        self.last_result = None
+        self.set_lot_thresholds(None)  # しきい値は銘柄ごとのものなので、銘柄を変えたら与え直す
+
+    def set_lot_thresholds(self, thresholds: tuple | None) -> None:
+        """固定のしきい値を設定 (None で解除) し、ビン→ロットの表と、保持中の約定のロット・ロット別合計を作り直す。"""
+        thresholds = tuple(thresholds) if thresholds else None
+        if thresholds == self.lot_thresholds: return
+        super().set_lot_thresholds(thresholds)
+        if thresholds is None:
+            self._bin_lot = None; return
+        self._bin_lot = np.searchsorted(self._bin_index(np.asarray(thresholds, dtype=float)), np.arange(self.BIN_COUNT), side='right').astype(np.int8)
+        self._lot_vol, self._lot_pv = self._lot_sums(self._vol_hist, thresholds), self._lot_sums(self._pv_hist, thresholds)
+        if len(self.ticks):
+            a = self.ticks.start_seq
+            self.ticks.assign('lot', a, self._bin_lot[self._bin_index(self.ticks.view('price', a) * self.ticks.view('volume', a))])
+
+    def _bin_index(self, notional):
+        return np.maximum(np.searchsorted(self.BIN_EDGES, notional, side='right') - 1, 0)
+
+    def _window_add(self, a: int, b: int, sign: int) -> None:
+        prices, volumes = self.ticks.view('price', a, b), self.ticks.view('volume', a, b)
+        dp = prices - self._ref_price
+        self._w_vol += sign * volumes.sum(); self._w_pv += sign * (prices * volumes).sum()
+        self._w_dp += sign * dp.sum(); self._w_dp2 += sign * (dp * dp).sum()
+
+    def _hist_add(self, a: int, b: int, sign: int) -> None:
+        prices, volumes, direction = self.ticks.view('price', a, b), self.ticks.view('volume', a, b), self.ticks.view('direction', a, b)
+        self._total_volume += sign * int(volumes.sum())
+        known = direction != 0; side = (direction[known] < 0).astype(int); bins = self._bin_index(prices[known] * volumes[known])
+        np.add.at(self._vol_hist, (side, bins), sign * volumes[known]); np.add.at(self._pv_hist, (side, bins), sign * prices[known] * volumes[known])
+        if self._bin_lot is not None:
+            lots = self._bin_lot[bins]
+            np.add.at(self._lot_vol, (lots, side), sign * volumes[known]); np.add.at(self._lot_pv, (lots, side), sign * prices[known] * volumes[known])
+
+    def _metrics(self) -> dict:
+        n = self.ticks.end_seq - self._w_start
+        if n < 2 or self._w_vol <= 0: return {}
+        mean_dp = self._w_dp / n
+        volatility = float(np.sqrt(max(self._w_dp2 / n - mean_dp * mean_dp, 0.0)))
+        t, price = self.ticks.view('t', self._w_start), self.ticks.view('price', self._w_start)
+        time_span_min = (t[-1] - t[0]) / 60e9
+        return {
+            'vwap': self._w_pv / self._w_vol, 'volatility': volatility,
+            'trade_density_per_min': n / time_span_min if time_span_min > 0 else 0,
+            'avg_volume_per_trade': self._w_vol / n,
+            'price_open': price[0], 'price_close': price[-1],
+        }
+
+    def _horizon_metrics(self, thresholds: tuple) -> dict:
+        """保持中の約定のうち、最長の期間に掛かる分 (と期間の外側の1件) だけを horizon_metrics に渡す。"""
+        if not self.horizons: return {}
+        cutoff = int(self.ticks.tail('t', 1)[0]) - max(self.horizons) * 1_000_000_000
+        a = max(self.ticks.start_seq, self.ticks.seq_after_time(cutoff) - 1)
+        view = lambda name: self.ticks.view(name, a)
+        return horizon_metrics(view('t'), view('price'), view('volume'), view('direction'), thresholds, self.horizons)
+
+    def _lot_sums(self, hist: np.ndarray, thresholds: tuple) -> np.ndarray:
+        """ビン集計をしきい値で4ロットに切り分け、(ロット, 方向) の合計を返す。"""
+        edges = np.concatenate(([0], self._bin_index(np.asarray(thresholds, dtype=float)), [self.BIN_COUNT]))
+        cum = np.concatenate((np.zeros((2, 1)), np.cumsum(hist, axis=1)), axis=1)
+        return (cum[:, edges[1:]] - cum[:, edges[:-1]]).T
+
+    def _window_lot_sums(self, thresholds: tuple) -> tuple:
+        """
+        時間窓から求めたしきい値 (ビンの境界と一致しない) で、保持中の約定の (ロット, 方向) ごとの 出来高 と 価格×出来高 を返す。
+        しきい値を含むビンはビン単位では上のロットに数えられるので、そのビンの約定だけを約定代金で分け直して差し替える。
+        """
+        lot_volume, lot_pv = self._lot_sums(self._vol_hist, thresholds), self._lot_sums(self._pv_hist, thresholds)
+        thresholds = np.asarray(thresholds, dtype=float)
+        boundary = self._bin_index(thresholds)
+        # ビン i は [BIN_EDGES[i], BIN_EDGES[i+1])。_bin_index に合わせて、最初のビンは下に・最後のビンは上に開いている
+        edges = np.concatenate(([-np.inf], self.BIN_EDGES[1:], [np.inf]))
+        prices, volumes, direction = self.ticks.view('price'), self.ticks.view('volume'), self.ticks.view('direction')
+        notional = prices * volumes
+        near = np.zeros(len(notional), dtype=bool)
+        for b in np.unique(boundary): near |= (notional >= edges[b]) & (notional < edges[b + 1])
+        near &= direction != 0
+        if not near.any(): return lot_volume, lot_pv
+        notional, volume, side = notional[near], volumes[near].astype(float), (direction[near] < 0).astype(int)
+        binned, exact = np.searchsorted(boundary, self._bin_index(notional), side='right'), np.searchsorted(thresholds, notional, side='right')
+        np.add.at(lot_volume, (binned, side), -volume); np.add.at(lot_volume, (exact, side), volume)
+        np.add.at(lot_pv, (binned, side), -notional); np.add.at(lot_pv, (exact, side), notional)
+        return lot_volume, lot_pv
+
+    def state(self) -> dict:
+        """蓄積した状態 (保持中の約定・時間窓と履歴の累積値・ロットのしきい値) を {名前: 配列} で返す (np.savez で書ける)。"""
+        state = {f'ticks_{name}': value for name, value in self.ticks.state().items()}
+        state.update({name: np.float64(np.nan if getattr(self, name) is None else getattr(self, name)) for name in self.STATE_SCALARS})
+        state.update({name: getattr(self, name).copy() for name in self.STATE_ARRAYS})
+        state['lot_thresholds'] = np.asarray(self.lot_thresholds or (), dtype=np.float64)
+        state['config'] = np.array([self.ticks.capacity, self.time_window_sec], dtype=np.int64)
+        return state
+
+    def restore(self, state: dict) -> dict | None:
+        """
+        state() の内容に戻し、その時点の分析結果を返す (続けて update_arrays に渡す約定は、保存時の続きから)。
+        保持件数・時間窓の設定が違う状態は ValueError。
+        """
+        if tuple(int(v) for v in state['config']) != (self.ticks.capacity, self.time_window_sec):
+            raise ValueError(f"保持件数・時間窓の設定が違う状態です: {tuple(state['config'])}")
+        self.reset()
+        self.ticks.restore({name[len('ticks_'):]: value for name, value in state.items() if name.startswith('ticks_')})
+        for name in self.STATE_SCALARS: setattr(self, name, float(state[name]))
+        self._w_start, self._total_volume = int(self._w_start), int(self._total_volume)
+        if self._ref_price != self._ref_price: self._ref_price = None
+        for name in self.STATE_ARRAYS: setattr(self, name, np.array(state[name], dtype=np.float64))
+        lot_vol, lot_pv = self._lot_vol, self._lot_pv
+        self.set_lot_thresholds(tuple(state['lot_thresholds'].tolist()) or None)
+        self._lot_vol, self._lot_pv = lot_vol, lot_pv  # しきい値を設定し直すとビン集計から作り直すので、保存時の累積値に戻す
+        metrics = self._metrics()
+        return self._summarize(metrics, self._get_dynamic_thresholds(metrics))
+
+    def update(self, new_df: pd.DataFrame) -> dict | None:
+        """新規約定 (id, 時刻, 価格, 出来高, 方向) の DataFrame を取り込み、最新の分析結果を返す。"""
+        self.new_rows = 0
+        if new_df.empty: return self.last_result
+        df = new_df.copy(); df.columns = ['id', '時刻', '価格', '出来高', '方向']
+        df['時刻'] = pd.to_datetime(df['時刻'], errors='coerce'); df['価格'] = pd.to_numeric(df['価格'], errors='coerce'); df['出来高'] = pd.to_numeric(df['出来高'], errors='coerce')
+        df.dropna(inplace=True); df = df[df['出来高'] > 0]
+        if df.empty: return self.last_result
+        return self.update_arrays(
+            df['id'].to_numpy(dtype=np.int64), df['時刻'].values.astype('datetime64[ns]').view('int64'),
+            df['価格'].to_numpy(dtype=float), df['出来高'].to_numpy(dtype=np.int64),
+            df['方向'].map(DIRECTION_CODES).fillna(0).to_numpy(dtype=np.int8),
+        )
+
+    def update_arrays(self, ids: np.ndarray, t_ns: np.ndarray, prices: np.ndarray, volumes: np.ndarray, directions: np.ndarray) -> dict | None:
+        """型付き配列 (時刻はエポックns、方向は 1=買い/-1=売り) で新規約定を取り込み、最新の分析結果を返す。取り込んだ件数は new_rows に残る。"""
+        self.new_rows = 0
+        valid = volumes > 0
+        if not valid.all(): ids, t_ns, prices, volumes, directions = ids[valid], t_ns[valid], prices[valid], volumes[valid], directions[valid]
+        cap = self.ticks.capacity
+        ids, t_ns, prices, volumes, directions = ids[-cap:], t_ns[-cap:], prices[-cap:], volumes[-cap:], directions[-cap:]
+        if len(ids) == 0: return self.last_result
+        if self._ref_price is None: self._ref_price = float(prices[0])
+        # 1. 押し出される古い行を履歴集計と時間窓から差し引く
+        evicted = self.ticks.overflow(len(ids))
+        if evicted:
+            evict_end = self.ticks.start_seq + evicted
+            self._hist_add(self.ticks.start_seq, evict_end, -1)
+            if self._w_start < evict_end: self._window_add(self._w_start, evict_end, -1); self._w_start = evict_end
+        # 2. 新規行を追加して集計に加える
+        first_new = self.ticks.end_seq
+        self.ticks.append(id=ids, t=t_ns, price=prices, volume=volumes, direction=directions)
+        self.new_rows = self.ticks.end_seq - first_new
+        self._hist_add(first_new, self.ticks.end_seq, 1); self._window_add(first_new, self.ticks.end_seq, 1)
+        # 3. 時間窓から外れた行を差し引く
+        cutoff = int(self.ticks.tail('t', 1)[0]) - self.time_window_sec * 1_000_000_000
+        w_start = self.ticks.seq_after_time(cutoff, self._w_start)
+        self._window_add(self._w_start, w_start, -1); self._w_start = w_start
+        metrics = self._metrics()
+        thresholds = self._get_dynamic_thresholds(metrics)
+        new_notional = self.ticks.view('price', first_new) * self.ticks.view('volume', first_new)
+        if self._bin_lot is not None:
+            self.ticks.assign('lot', first_new, self._bin_lot[self._bin_index(new_notional)])
+        else:
+            self.ticks.assign('lot', first_new, np.searchsorted(np.asarray(thresholds, dtype=float), new_notional, side='right'))
+        return self._summarize(metrics, thresholds)
+
+    def _summarize(self, metrics: dict, thresholds: tuple) -> dict | None:
+        """現在の累積値から分析結果を組み立てて last_result に置く。"""
+        if not metrics or len(self.ticks) < 2:
+            self.last_result = None; return None
+        if self._bin_lot is not None:
+            lot_volume, lot_pv = self._lot_vol, self._lot_pv
+        else:
+            lot_volume, lot_pv = self._window_lot_sums(thresholds)
+        pivot = pd.DataFrame(np.column_stack((lot_volume, lot_volume[:, 0] - lot_volume[:, 1])), index=self.PIVOT_INDEX, columns=self.PIVOT_COLUMNS)
+        large_buy_volume, large_sell_volume = lot_volume[2:, 0].sum(), lot_volume[2:, 1].sum()
+        buy_vwap = lot_pv[2:, 0].sum() / large_buy_volume if large_buy_volume > 0 else 0
+        sell_vwap = lot_pv[2:, 1].sum() / large_sell_volume if large_sell_volume > 0 else 0
+        summary = self._build_summary(self._total_volume, pivot, metrics, thresholds, large_buy_volume, large_sell_volume, buy_vwap, sell_vwap)
+        summary['horizons'] = self._horizon_metrics(thresholds)
+        self.last_result = {'summary': summary}
+        return self.last_result